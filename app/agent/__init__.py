@@ -0,0 +1,3 @@
+"""
+Агент сбора метрик для удалённых серверов
+"""
@@ -0,0 +1,142 @@
+"""
+Агент: сбор метрик на удалённом сервере и отправка центральному боту
+
+Запуск: python -m app.agent.main
+Настройки (.env): AGENT_INGEST_URL, AGENT_TOKEN, AGENT_HOST,
+AGENT_INTERVAL (сек между замерами), AGENT_BATCH_SIZE (замеров в пакете).
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+import aiohttp
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.agent.protocol import encode_frame
+from app.core.monitor import SystemMonitor
+from app.utils.helpers import get_env_float, get_env_int
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsAgent:
+    """
+    Агент сбора метрик
+
+    Раз в interval секунд снимает метрики теми же функциями SystemMonitor,
+    что и бот, и каждые batch_size замеров отправляет их одним пакетом
+    POST-запросом. Неотправленные пакеты хранятся в очереди (не больше
+    max_pending) и повторяются перед следующей отправкой.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        host: str,
+        token: str = '',
+        interval: float = 10.0,
+        batch_size: int = 3,
+        max_pending: int = 100,
+        timeout: float = 10.0,
+    ):
+        self.url = url
+        self.host = host
+        self.token = token
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self._batch: List[Tuple[float, Dict]] = []
+        self._pending: Deque[bytes] = deque(maxlen=max_pending)
+        self.frames_sent = 0
+        self.errors = 0
+
+    def collect(self) -> Tuple[float, Dict]:
+        """Один замер (psutil, выполняется в отдельном потоке)"""
+        return time.time(), SystemMonitor.collect_all_metrics()
+
+    def add_sample(self, timestamp: float, metrics: Dict):
+        """Добавление замера; полный пакет ставится в очередь отправки"""
+        self._batch.append((timestamp, metrics))
+        if len(self._batch) >= self.batch_size:
+            self._pending.append(encode_frame(self.host, self._batch))
+            self._batch = []
+
+    async def push(self, session: aiohttp.ClientSession) -> int:
+        """Отправка накопленных пакетов по порядку, возвращает число отправленных"""
+        headers = {'Content-Type': 'application/octet-stream'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        sent = 0
+        while self._pending:
+            frame = self._pending[0]
+            try:
+                async with session.post(self.url, data=frame, headers=headers) as response:
+                    if response.status >= 500:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, (), status=response.status
+                        )
+                    if response.status >= 400:
+                        # Пакет отклонён (формат, токен) - повтор не поможет
+                        logger.error(f"Пакет отклонён сервером: HTTP {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.errors += 1
+                logger.warning(f"Не удалось отправить пакет ({len(self._pending)} в очереди): {e}")
+                break
+            self._pending.popleft()
+            self.frames_sent += 1
+            sent += 1
+        return sent
+
+    async def run(self):
+        """Основной цикл: замеры по расписанию и отправка пакетов"""
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            # Первый вызов cpu_percent только запоминает счётчики
+            await asyncio.to_thread(self.collect)
+            next_tick = time.monotonic()
+            while True:
+                next_tick += self.interval
+                await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+                timestamp, metrics = await asyncio.to_thread(self.collect)
+                self.add_sample(timestamp, metrics)
+                if self._pending:
+                    await self.push(session)
+
+
+async def main():
+    url = os.getenv('AGENT_INGEST_URL')
+    if not url:
+        logger.error("AGENT_INGEST_URL не установлен в переменных окружения!")
+        return
+
+    agent = MetricsAgent(
+        url=url,
+        host=os.getenv('AGENT_HOST') or socket.gethostname(),
+        token=os.getenv('AGENT_TOKEN', ''),
+        interval=get_env_float('AGENT_INTERVAL', 10.0),
+        batch_size=get_env_int('AGENT_BATCH_SIZE', 3),
+        max_pending=get_env_int('AGENT_MAX_PENDING', 100),
+    )
+    logger.info(
+        f"Агент {agent.host} запущен: {url}, замер раз в {agent.interval} сек, "
+        f"пакет {agent.batch_size} замеров"
+    )
+    await agent.run()
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Агент остановлен")
@@ -0,0 +1,77 @@
+"""
+Бинарный формат пакета сэмплов от агента
+
+Пакет сжат zlib. Внутри - заголовок, имя хоста в UTF-8 и сэмплы
+фиксированной длины: timestamp и значения BUFFER_FIELDS как float64
+(пропуск - NaN). Сэмпл занимает 8 * (1 + len(BUFFER_FIELDS)) байт,
+разбор - один struct.iter_unpack без JSON.
+"""
+import re
+import math
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+from app.core.buffer import BUFFER_FIELDS
+
+MAGIC = b'SSBF'
+VERSION = 2  # 2: добавлены net_sent_rate, net_recv_rate
+
+# Максимальный размер распакованного пакета (защита от zip-бомб)
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+_HEADER = struct.Struct('!4sBBHI')  # magic, версия, число полей, длина имени, число сэмплов
+_SAMPLE = struct.Struct(f'!{1 + len(BUFFER_FIELDS)}d')
+_NAN = float('nan')
+
+# Имя хоста: как hostname (буквы, цифры, '.', '-', '_'), не длиннее hosts.name
+MAX_HOST_LENGTH = 255
+_HOST_RE = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]*')
+
+
+class FrameError(ValueError):
+    """Некорректный пакет"""
+
+
+def encode_frame(host: str, samples: List[Tuple[float, Dict]]) -> bytes:
+    """Упаковка сэмплов [(timestamp, metrics), ...] хоста в сжатый пакет"""
+    host_bytes = host.encode('utf-8')
+    parts = [_HEADER.pack(MAGIC, VERSION, len(BUFFER_FIELDS), len(host_bytes), len(samples)), host_bytes]
+    for timestamp, metrics in samples:
+        values = [metrics.get(field) for field in BUFFER_FIELDS]
+        parts.append(_SAMPLE.pack(timestamp, *(_NAN if v is None else float(v) for v in values)))
+    return zlib.compress(b''.join(parts), 6)
+
+
+def decode_frame(frame: bytes) -> Tuple[str, List[Tuple[float, Dict]]]:
+    """Распаковка пакета: (хост, [(timestamp, metrics), ...])"""
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(frame, MAX_FRAME_SIZE)
+    except zlib.error as e:
+        raise FrameError(f"Ошибка распаковки: {e}")
+    if decompressor.unconsumed_tail:
+        raise FrameError(f"Пакет больше {MAX_FRAME_SIZE} байт")
+    if len(data) < _HEADER.size:
+        raise FrameError("Пакет короче заголовка")
+    
+    magic, version, field_count, host_len, count = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or field_count != len(BUFFER_FIELDS):
+        raise FrameError(f"Неподдерживаемый формат пакета (версия {version}, полей {field_count})")
+    offset = _HEADER.size + host_len
+    if len(data) != offset + count * _SAMPLE.size:
+        raise FrameError("Длина пакета не совпадает с заголовком")
+    if not 0 < host_len <= MAX_HOST_LENGTH:
+        raise FrameError(f"Длина имени хоста должна быть от 1 до {MAX_HOST_LENGTH} байт")
+    
+    host = data[_HEADER.size:offset].decode('ascii', errors='replace')
+    if not _HOST_RE.fullmatch(host):
+        raise FrameError("Недопустимые символы в имени хоста")
+    samples = []
+    for values in _SAMPLE.iter_unpack(memoryview(data)[offset:]):
+        metrics = {
+            field: None if math.isnan(value) else value
+            for field, value in zip(BUFFER_FIELDS, values[1:])
+        }
+        samples.append((values[0], metrics))
+    return host, samples
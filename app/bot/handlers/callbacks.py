@@ -1,71 +1,103 @@
 """
 Обработчики callback-запросов
 """
+import os
 import logging
+from typing import Optional, Tuple
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, BufferedInputFile
+from aiogram.types import CallbackQuery
 from datetime import datetime, timedelta
 
 from app.core.db import async_session_maker
 from app.core.monitor import SystemMonitor
-from app.core.charts import ChartGenerator
+from app.core.render import ChartQueueFull, PANEL_CHARTS, DETAIL_CHARTS
+from app.core.graphs import get_period_charts, get_detail_chart
+from app.core.cache import chart_cache, send_cached_chart, send_cached_album
+from app.core.hosts import host_directory
+from app.bot.keyboards.inline import DETAIL_BUTTONS
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Способ отправки графиков по /graph:
+# dashboard - одно сводное изображение, album - альбом из четырёх графиков,
+# photos - отдельные сообщения
+GRAPH_DELIVERY = os.getenv('GRAPH_DELIVERY', 'album')
+
+
+def _parse_period_data(data: str) -> Tuple[int, Optional[int]]:
+    """Период и host_id из callback_data вида 'graph_24' или 'graph_24_3'"""
+    parts = data.split("_")
+    hours = int(parts[1])
+    host_id = int(parts[2]) if len(parts) > 2 else None
+    return hours, host_id
+
 
 @router.callback_query(F.data.startswith("graph_"))
 async def callback_graph(callback: CallbackQuery):
     """Обработчик callback для графиков"""
     try:
-        # Извлекаем период из callback_data
-        hours = int(callback.data.split("_")[1])
+        # Извлекаем период и хост из callback_data
+        hours, host_id = _parse_period_data(callback.data)
+        host_text = f" ({host_directory.get_name(host_id)})" if host_id is not None else ""
         
         await callback.answer()
         await callback.message.edit_text(
             f"⏳ Генерирую графики за {hours}ч... Пожалуйста, подождите."
         )
         
-        # Получаем метрики из БД
-        async with async_session_maker() as session:
-            metrics = await SystemMonitor.get_metrics_for_period(session, hours=hours)
+        # Графики из общего кэша, недостающие строятся параллельно в пуле процессов
+        bucket = chart_cache.current_bucket()
+        chart_types = ('dashboard',) if GRAPH_DELIVERY == 'dashboard' else PANEL_CHARTS
+        charts = await get_period_charts(hours, chart_types, bucket=bucket, host_id=host_id)
         
-        if not metrics:
+        if not any(charts.values()):
             await callback.message.edit_text(
                 "❌ Нет данных за выбранный период.\n"
                 "Метрики ещё не накоплены или база данных пуста."
             )
             return
         
-        # Генерируем графики
-        charts = ChartGenerator.create_all_charts(metrics)
-        
         period_text = f"{hours}ч" if hours < 24 else f"{hours // 24}д"
         
-        # Отправляем графики
-        for chart_name, chart_data in charts.items():
-            if chart_data:
-                chart_file = BufferedInputFile(
-                    chart_data,
-                    filename=f"{chart_name}_{period_text}.png"
-                )
-                
-                caption_map = {
-                    'cpu': f"🖥 CPU метрики за {period_text}",
-                    'memory': f"🧠 RAM метрики за {period_text}",
-                    'disk': f"💾 Disk метрики за {period_text}",
-                    'network': f"🌐 Network метрики за {period_text}",
-                }
-                
-                await callback.message.answer_photo(
-                    photo=chart_file,
-                    caption=caption_map.get(chart_name, f"График за {period_text}")
+        caption_map = {
+            'cpu': f"🖥 CPU метрики за {period_text}{host_text}",
+            'memory': f"🧠 RAM метрики за {period_text}{host_text}",
+            'disk': f"💾 Disk метрики за {period_text}{host_text}",
+            'network': f"🌐 Network метрики за {period_text}{host_text}",
+            'dashboard': f"📊 Метрики сервера за {period_text}{host_text}",
+        }
+        
+        items = [
+            (
+                chart_cache.make_key(chart_name, hours, bucket, host_id),
+                chart_data,
+                f"{chart_name}_{period_text}.png",
+                caption_map.get(chart_name, f"График за {period_text}"),
+            )
+            for chart_name, chart_data in charts.items() if chart_data
+        ]
+        
+        if GRAPH_DELIVERY == 'album' and len(items) > 1:
+            # Все графики одним запросом sendMediaGroup
+            await send_cached_album(callback.message.answer_media_group, items)
+        else:
+            # Повторно графики отправляются по file_id без загрузки PNG
+            for key, chart_data, filename, caption in items:
+                await send_cached_chart(
+                    callback.message.answer_photo, key, chart_data,
+                    filename=filename, caption=caption
                 )
         
         await callback.message.edit_text(
-            f"✅ Графики за {period_text} успешно отправлены!"
+            f"✅ Графики за {period_text}{host_text} успешно отправлены!"
         )
         
+    except ChartQueueFull:
+        logger.warning("Очередь отрисовки графиков заполнена")
+        await callback.message.edit_text(
+            "⏳ Сервер занят построением графиков, попробуйте через минуту"
+        )
     except Exception as e:
         logger.error(f"Ошибка в callback_graph: {e}")
         await callback.message.edit_text(
@@ -77,79 +109,69 @@ async def callback_graph(callback: CallbackQuery):
 async def callback_history(callback: CallbackQuery):
     """Обработчик callback для истории"""
     try:
-        # Извлекаем период из callback_data
-        hours = int(callback.data.split("_")[1])
+        # Извлекаем период и хост из callback_data
+        hours, host_id = _parse_period_data(callback.data)
+        host_text = f" ({host_directory.get_name(host_id)})" if host_id is not None else ""
         
         await callback.answer()
         await callback.message.edit_text(
             f"⏳ Загружаю историю за {hours}ч..."
         )
         
-        # Получаем метрики из БД
+        # Получаем агрегированную статистику из БД
         async with async_session_maker() as session:
-            metrics = await SystemMonitor.get_metrics_for_period(session, hours=hours)
+            stats = await SystemMonitor.get_period_stats(session, hours=hours, host_id=host_id)
         
-        if not metrics:
+        if not stats:
             await callback.message.edit_text(
                 "❌ Нет данных за выбранный период."
             )
             return
         
-        # Анализируем метрики
-        cpu_values = [m.cpu_percent for m in metrics if m.cpu_percent is not None]
-        ram_values = [m.ram_percent for m in metrics if m.ram_percent is not None]
-        disk_values = [m.disk_percent for m in metrics if m.disk_percent is not None]
-        
         period_text = f"{hours}ч" if hours < 24 else f"{hours // 24}д"
         
-        text = f"📊 <b>История метрик за {period_text}</b>\n\n"
-        text += f"📅 Период: {metrics[0].timestamp.strftime('%d.%m %H:%M')} - "
-        text += f"{metrics[-1].timestamp.strftime('%d.%m %H:%M')}\n"
-        text += f"📈 Записей: {len(metrics)}\n\n"
+        text = f"📊 <b>История метрик за {period_text}{host_text}</b>\n\n"
+        text += f"📅 Период: {stats['first'].strftime('%d.%m %H:%M')} - "
+        text += f"{stats['last'].strftime('%d.%m %H:%M')}\n"
+        text += f"📈 Записей: {stats['count']}\n\n"
         
         # CPU статистика
-        if cpu_values:
+        if stats['cpu_avg'] is not None:
             text += "🖥 <b>CPU:</b>\n"
-            text += f"  • Среднее: {sum(cpu_values)/len(cpu_values):.1f}%\n"
-            text += f"  • Минимум: {min(cpu_values):.1f}%\n"
-            text += f"  • Максимум: {max(cpu_values):.1f}%\n"
+            text += f"  • Среднее: {stats['cpu_avg']:.1f}%\n"
+            text += f"  • Минимум: {stats['cpu_min']:.1f}%\n"
+            text += f"  • Максимум: {stats['cpu_max']:.1f}%\n"
+            text += f"  • 95-й перцентиль: {stats['cpu_p95']:.1f}%\n"
             
-            # Подсчитываем случаи превышения порога
-            high_cpu = sum(1 for v in cpu_values if v > 80)
-            if high_cpu:
-                text += f"  • ⚠️ Высокая нагрузка (>80%): {high_cpu} раз\n"
+            # Случаи превышения порога
+            if stats['cpu_high']:
+                text += f"  • ⚠️ Высокая нагрузка (>80%): {stats['cpu_high']} раз\n"
         
         # RAM статистика
-        if ram_values:
+        if stats['ram_avg'] is not None:
             text += "\n🧠 <b>RAM:</b>\n"
-            text += f"  • Среднее: {sum(ram_values)/len(ram_values):.1f}%\n"
-            text += f"  • Минимум: {min(ram_values):.1f}%\n"
-            text += f"  • Максимум: {max(ram_values):.1f}%\n"
+            text += f"  • Среднее: {stats['ram_avg']:.1f}%\n"
+            text += f"  • Минимум: {stats['ram_min']:.1f}%\n"
+            text += f"  • Максимум: {stats['ram_max']:.1f}%\n"
+            text += f"  • 95-й перцентиль: {stats['ram_p95']:.1f}%\n"
             
-            high_ram = sum(1 for v in ram_values if v > 80)
-            if high_ram:
-                text += f"  • ⚠️ Высокое использование (>80%): {high_ram} раз\n"
+            if stats['ram_high']:
+                text += f"  • ⚠️ Высокое использование (>80%): {stats['ram_high']} раз\n"
         
         # Disk статистика
-        if disk_values:
+        if stats['disk_avg'] is not None:
             text += "\n💾 <b>Disk:</b>\n"
-            text += f"  • Среднее: {sum(disk_values)/len(disk_values):.1f}%\n"
-            text += f"  • Минимум: {min(disk_values):.1f}%\n"
-            text += f"  • Максимум: {max(disk_values):.1f}%\n"
+            text += f"  • Среднее: {stats['disk_avg']:.1f}%\n"
+            text += f"  • Минимум: {stats['disk_min']:.1f}%\n"
+            text += f"  • Максимум: {stats['disk_max']:.1f}%\n"
         
         # Network статистика
-        if len(metrics) > 1:
-            first_sent = metrics[0].net_sent or 0
-            last_sent = metrics[-1].net_sent or 0
-            first_recv = metrics[0].net_recv or 0
-            last_recv = metrics[-1].net_recv or 0
-            
-            total_sent = last_sent - first_sent
-            total_recv = last_recv - first_recv
-            
+        if stats['net_sent'] is not None and stats['net_recv'] is not None:
             text += "\n🌐 <b>Network (за период):</b>\n"
-            text += f"  • Отправлено: {SystemMonitor.format_bytes(total_sent)}\n"
-            text += f"  • Получено: {SystemMonitor.format_bytes(total_recv)}\n"
+            text += f"  • Отправлено: {SystemMonitor.format_bytes(stats['net_sent'])} "
+            text += f"(пик {SystemMonitor.format_bytes(stats['net_sent_peak'])}/с)\n"
+            text += f"  • Получено: {SystemMonitor.format_bytes(stats['net_recv'])} "
+            text += f"(пик {SystemMonitor.format_bytes(stats['net_recv_peak'])}/с)\n"
         
         await callback.message.edit_text(text)
         
@@ -159,3 +181,40 @@ async def callback_history(callback: CallbackQuery):
             "❌ Ошибка при загрузке истории"
         )
 
+
+@router.callback_query(F.data.startswith("detail_"))
+async def callback_detail(callback: CallbackQuery):
+    """Обработчик callback для графиков детальных метрик"""
+    try:
+        # detail_<тип>_<часы>[_<host_id>]
+        _, chart_type, data = callback.data.split("_", 2)
+        hours, host_id = _parse_period_data(f"detail_{data}")
+        if chart_type not in DETAIL_CHARTS:
+            await callback.answer("Неизвестный график")
+            return
+        host_text = f" ({host_directory.get_name(host_id)})" if host_id is not None else ""
+        
+        await callback.answer()
+        bucket = chart_cache.current_bucket()
+        chart_data = await get_detail_chart(chart_type, hours, bucket=bucket, host_id=host_id)
+        if not chart_data:
+            await callback.message.answer(
+                "❌ Нет детальных метрик за выбранный период.\n"
+                "Они собираются только на сервере бота, раз в MONITOR_INTERVAL."
+            )
+            return
+        
+        await send_cached_chart(
+            callback.message.answer_photo,
+            chart_cache.make_key(chart_type, hours, bucket, host_id),
+            chart_data,
+            filename=f"{chart_type}_{hours}h.png",
+            caption=f"{dict(DETAIL_BUTTONS)[chart_type]} за {hours}ч{host_text}"
+        )
+        
+    except ChartQueueFull:
+        logger.warning("Очередь отрисовки графиков заполнена")
+        await callback.message.answer("⏳ Сервер занят построением графиков, попробуйте через минуту")
+    except Exception as e:
+        logger.error(f"Ошибка в callback_detail: {e}")
+        await callback.message.answer("❌ Ошибка при генерации графика")
@@ -1,7 +1,11 @@
 """
 Обработчики команд бота
 """
+import time
+import asyncio
 import logging
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
 from aiogram import Router, F
 from aiogram.filters import Command, CommandStart
 from aiogram.types import Message, FSInputFile, BufferedInputFile
@@ -9,10 +13,17 @@ from aiogram.fsm.context import FSMContext
 from sqlalchemy import select
 
 from app.core.db import async_session_maker
-from app.core.monitor import SystemMonitor
+from app.core.monitor import SystemMonitor, process_tracker
+from app.core.snapshot import snapshot_store
+from app.core.buffer import ring_buffer
+from app.core.alerts import alert_engine, alert_subscribers
+from app.core.reports import report_scheduler
+from app.core.processes import get_top_consumers
+from app.core.ingest import host_registry
+from app.core.hosts import host_directory
 from app.models.metrics import UserSettings
 from app.utils.helpers import get_or_create_user_settings
-from app.bot.keyboards.inline import get_period_keyboard, get_history_keyboard
+from app.bot.keyboards.inline import get_period_keyboard, get_history_keyboard, get_detail_keyboard
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -40,68 +51,124 @@ async def cmd_help(message: Message):
     """Обработчик команды /help"""
     help_text = (
         "📚 <b>Доступные команды:</b>\n\n"
-        "/status - Текущие показатели сервера\n"
-        "/graph - Графики метрик (выбор периода)\n"
-        "/history - Текстовый отчёт за период\n"
+        "/status [хост] - Текущие показатели сервера\n"
+        "/graph [хост] - Графики метрик (выбор периода)\n"
+        "/history [хост] - Текстовый отчёт за период\n"
+        "/detail [хост] - Ядра CPU, разделы, интерфейсы, Disk I/O\n"
         "/top - Топ процессов по CPU и RAM\n"
+        "/top ЧЧ:ММ ЧЧ:ММ - Топ процессов за период (UTC)\n"
+        "/hosts - Серверы с агентами\n"
         "/setinterval [минуты] - Установить автоотправку\n"
         "/stop - Остановить автоотправку\n"
+        "/alerts [on|off] - Уведомления о превышении порогов\n"
+        "/alerts [cpu|ram|disk] [порог|default] - Личный порог алерта\n"
         "/settings - Ваши текущие настройки\n"
         "/help - Эта справка"
     )
     await message.answer(help_text)
 
 
+async def _host_argument(message: Message) -> Tuple[bool, Optional[int]]:
+    """
+    Хост из аргумента команды (/status web-1)
+
+    Returns:
+        (хост найден, host_id); host_id = None - локальный сервер
+    """
+    args = message.text.split()
+    if len(args) < 2:
+        return True, None
+    name = args[1]
+    host_id = host_directory.get_id(name)
+    if host_id is None and host_registry.get(name) is not None:
+        # Агент подключился, но его метрики ещё не записывались в БД
+        async with async_session_maker() as session:
+            host_id = await host_directory.resolve(session, name)
+            await session.commit()
+    if host_id is None:
+        return False, None
+    return True, None if host_directory.is_local(host_id) else host_id
+
+
+HOST_NOT_FOUND = "❌ Хост не найден. Список: /hosts"
+
+
 @router.message(Command("status"))
 async def cmd_status(message: Message):
-    """Обработчик команды /status"""
+    """Обработчик команды /status [хост]"""
     try:
-        # Получаем текущие метрики
-        cpu = SystemMonitor.get_cpu_metrics()
-        memory = SystemMonitor.get_memory_metrics()
-        disk = SystemMonitor.get_disk_metrics()
-        network = SystemMonitor.get_network_metrics()
-        uptime = SystemMonitor.get_uptime()
-        processes = SystemMonitor.get_process_metrics()
+        found, host_id = await _host_argument(message)
+        if not found:
+            await message.answer(HOST_NOT_FOUND)
+            return
         
-        # Форматируем сообщение
-        status_text = "📊 <b>Текущее состояние сервера</b>\n\n"
+        if host_id is None:
+            # Получаем текущие метрики из снимка (без прямых вызовов psutil)
+            snapshot = await snapshot_store.get()
+            uptime = SystemMonitor.get_uptime(snapshot.get('boot_time'))
+            # Пики за последние минуты из буфера высокого разрешения
+            recent = ring_buffer.aggregate(since=time.time() - 300)
+            status_text = "📊 <b>Текущее состояние сервера</b>\n\n"
+        else:
+            # Последний замер агента и пики по его буферу (время агента)
+            name = host_directory.get_name(host_id)
+            host = host_registry.get(name)
+            if host is None or host.last_sample is None:
+                await message.answer(
+                    f"❌ От хоста {name} нет свежих данных.\n"
+                    f"История доступна в /graph {name} и /history {name}"
+                )
+                return
+            snapshot = host.last_sample
+            uptime = None
+            recent = host.buffer.aggregate(since=host.last_timestamp - 300)
+            status_text = f"📊 <b>Текущее состояние: {name}</b>\n\n"
         
         # CPU
         status_text += f"🖥 <b>CPU:</b>\n"
-        status_text += f"  • Использование: {cpu.get('cpu_percent', 0):.1f}%\n"
-        status_text += f"  • Load Avg: {cpu.get('cpu_load_1m', 0):.2f} / "
-        status_text += f"{cpu.get('cpu_load_5m', 0):.2f} / {cpu.get('cpu_load_15m', 0):.2f}\n"
+        status_text += f"  • Использование: {snapshot.get('cpu_percent') or 0:.1f}%\n"
+        status_text += f"  • Load Avg: {snapshot.get('cpu_load_1m') or 0:.2f} / "
+        status_text += f"{snapshot.get('cpu_load_5m') or 0:.2f} / {snapshot.get('cpu_load_15m') or 0:.2f}\n"
         
-        if cpu.get('cpu_temp'):
-            status_text += f"  • Температура: {cpu.get('cpu_temp'):.1f}°C\n"
+        if recent and recent.get('cpu_percent_max') is not None:
+            status_text += f"  • Пик за 5 мин: {recent['cpu_percent_max']:.1f}%\n"
+        
+        if snapshot.get('cpu_temp'):
+            status_text += f"  • Температура: {snapshot.get('cpu_temp'):.1f}°C\n"
         
         # RAM
-        ram_used = memory.get('ram_used', 0)
-        ram_total = memory.get('ram_total', 1)
-        ram_percent = memory.get('ram_percent', 0)
+        ram_used = snapshot.get('ram_used') or 0
+        ram_total = snapshot.get('ram_total') or 1
+        ram_percent = snapshot.get('ram_percent') or 0
         status_text += f"\n🧠 <b>RAM:</b>\n"
         status_text += f"  • {SystemMonitor.format_bytes(ram_used)} / "
         status_text += f"{SystemMonitor.format_bytes(ram_total)} ({ram_percent:.1f}%)\n"
+        if recent and recent.get('ram_percent_max') is not None:
+            status_text += f"  • Пик за 5 мин: {recent['ram_percent_max']:.1f}%\n"
         
         # Disk
-        disk_used = disk.get('disk_used', 0)
-        disk_total = disk.get('disk_total', 1)
-        disk_percent = disk.get('disk_percent', 0)
+        disk_used = snapshot.get('disk_used') or 0
+        disk_total = snapshot.get('disk_total') or 1
+        disk_percent = snapshot.get('disk_percent') or 0
         status_text += f"\n💾 <b>Disk:</b>\n"
         status_text += f"  • {SystemMonitor.format_bytes(disk_used)} / "
         status_text += f"{SystemMonitor.format_bytes(disk_total)} ({disk_percent:.1f}%)\n"
         
         # Network
-        net_sent = network.get('net_sent', 0)
-        net_recv = network.get('net_recv', 0)
+        net_sent = snapshot.get('net_sent') or 0
+        net_recv = snapshot.get('net_recv') or 0
         status_text += f"\n🌐 <b>Network:</b>\n"
         status_text += f"  • ↑ Отправлено: {SystemMonitor.format_bytes(net_sent)}\n"
         status_text += f"  • ↓ Получено: {SystemMonitor.format_bytes(net_recv)}\n"
+        if snapshot.get('net_sent_rate') is not None and snapshot.get('net_recv_rate') is not None:
+            status_text += f"  • Скорость: ↑ {SystemMonitor.format_bytes(snapshot['net_sent_rate'])}/с, "
+            status_text += f"↓ {SystemMonitor.format_bytes(snapshot['net_recv_rate'])}/с\n"
         
-        # Uptime & Processes
-        status_text += f"\n⏱ <b>Uptime:</b> {SystemMonitor.format_uptime(uptime)}\n"
-        status_text += f"⚙️ <b>Процессов:</b> {processes.get('process_count', 0)}\n"
+        # Uptime & Processes (агент uptime не передаёт)
+        status_text += "\n"
+        if uptime is not None:
+            status_text += f"⏱ <b>Uptime:</b> {SystemMonitor.format_uptime(uptime)}\n"
+        status_text += f"⚙️ <b>Процессов:</b> {int(snapshot.get('process_count') or 0)}\n"
         
         await message.answer(status_text)
         
@@ -110,32 +177,64 @@ async def cmd_status(message: Message):
         await message.answer("❌ Ошибка при получении статуса сервера")
 
 
+def _host_title(host_id: Optional[int]) -> str:
+    """Подпись хоста для заголовков (пусто для локального сервера)"""
+    return f" ({host_directory.get_name(host_id)})" if host_id is not None else ""
+
+
 @router.message(Command("graph"))
 async def cmd_graph(message: Message):
-    """Обработчик команды /graph"""
+    """Обработчик команды /graph [хост]"""
+    found, host_id = await _host_argument(message)
+    if not found:
+        await message.answer(HOST_NOT_FOUND)
+        return
     await message.answer(
-        "📈 <b>Выберите период для графиков:</b>",
-        reply_markup=get_period_keyboard()
+        f"📈 <b>Выберите период для графиков{_host_title(host_id)}:</b>",
+        reply_markup=get_period_keyboard(host_id)
     )
 
 
 @router.message(Command("history"))
 async def cmd_history(message: Message):
-    """Обработчик команды /history"""
+    """Обработчик команды /history [хост]"""
+    found, host_id = await _host_argument(message)
+    if not found:
+        await message.answer(HOST_NOT_FOUND)
+        return
     await message.answer(
-        "📜 <b>Выберите период для истории:</b>",
-        reply_markup=get_history_keyboard()
+        f"📜 <b>Выберите период для истории{_host_title(host_id)}:</b>",
+        reply_markup=get_history_keyboard(host_id)
+    )
+
+
+@router.message(Command("detail"))
+async def cmd_detail(message: Message):
+    """Обработчик команды /detail [хост]"""
+    found, host_id = await _host_argument(message)
+    if not found:
+        await message.answer(HOST_NOT_FOUND)
+        return
+    await message.answer(
+        f"🔬 <b>Детальные метрики{_host_title(host_id)}:</b>",
+        reply_markup=get_detail_keyboard(host_id)
     )
 
 
 @router.message(Command("top"))
 async def cmd_top(message: Message):
     """Обработчик команды /top"""
+    args = message.text.split()
+    if len(args) >= 3:
+        await top_history(message, args[1], args[2])
+        return
+    
     try:
-        # Топ процессов по CPU
-        top_cpu = SystemMonitor.get_top_processes(by='cpu', limit=5)
-        # Топ процессов по RAM
-        top_mem = SystemMonitor.get_top_processes(by='memory', limit=5)
+        # Обе выборки из одного прохода по таблице процессов
+        # (обновляется сэмплером; без него - проход в отдельном потоке)
+        await asyncio.to_thread(process_tracker.refresh)
+        top_cpu = process_tracker.top('cpu')
+        top_mem = process_tracker.top('memory')
         
         text = "📊 <b>Топ процессов</b>\n\n"
         
@@ -156,6 +255,86 @@ async def cmd_top(message: Message):
         await message.answer("❌ Ошибка при получении списка процессов")
 
 
+def _parse_period(start: str, end: str):
+    """Период по времени ЧЧ:ММ (UTC) за последние сутки"""
+    now = datetime.utcnow()
+    bounds = []
+    for value in (start, end):
+        parsed = datetime.strptime(value, '%H:%M')
+        moment = now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+        if moment > now:
+            moment -= timedelta(days=1)
+        bounds.append(moment)
+    since, until = bounds
+    if until < since:
+        since -= timedelta(days=1)
+    return since, until
+
+
+async def top_history(message: Message, start: str, end: str):
+    """Топ процессов за прошедший период из истории"""
+    try:
+        try:
+            since, until = _parse_period(start, end)
+        except ValueError:
+            await message.answer(
+                "❌ Укажите время начала и конца в формате ЧЧ:ММ (UTC).\n"
+                "Пример: /top 03:00 03:30"
+            )
+            return
+        
+        async with async_session_maker() as session:
+            top_cpu = await get_top_consumers(session, since, until, by='cpu', limit=5)
+            top_mem = await get_top_consumers(session, since, until, by='memory', limit=5)
+        
+        if not top_cpu and not top_mem:
+            await message.answer("❌ Нет данных о процессах за выбранный период.")
+            return
+        
+        text = (
+            f"📊 <b>Топ процессов</b>\n"
+            f"📅 {since.strftime('%d.%m %H:%M')} - {until.strftime('%d.%m %H:%M')} UTC\n\n"
+        )
+        
+        text += "🔥 <b>По CPU (пик / среднее):</b>\n"
+        for i, proc in enumerate(top_cpu, 1):
+            text += f"{i}. {proc['name'][:20]} - {proc['cpu_max'] or 0:.1f}% / {proc['cpu_avg'] or 0:.1f}%\n"
+        
+        text += "\n💾 <b>По RAM (пик):</b>\n"
+        for i, proc in enumerate(top_mem, 1):
+            text += f"{i}. {proc['name'][:20]} - {proc['memory_max'] or 0:.1f}%\n"
+        
+        await message.answer(text)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в top_history: {e}")
+        await message.answer("❌ Ошибка при получении истории процессов")
+
+
+@router.message(Command("hosts"))
+async def cmd_hosts(message: Message):
+    """Обработчик команды /hosts"""
+    hosts = sorted(host_registry.hosts.values(), key=lambda host: host.name)
+    if not hosts:
+        await message.answer(
+            "🖧 Агенты ещё не подключались.\n"
+            "Запустите на сервере: python -m app.agent.main"
+        )
+        return
+    
+    now = time.time()
+    text = f"🖧 <b>Серверы ({len(hosts)}):</b>\n\n"
+    for host in hosts:
+        status = '🟢' if host_registry.is_online(host, now) else '🔴'
+        sample = host.last_sample or {}
+        text += f"{status} <b>{host.name}</b> ({int(now - host.last_seen)} сек назад)\n"
+        text += f"  CPU {sample.get('cpu_percent') or 0:.1f}% • "
+        text += f"RAM {sample.get('ram_percent') or 0:.1f}% • "
+        text += f"Disk {sample.get('disk_percent') or 0:.1f}%\n"
+    
+    await message.answer(text)
+
+
 @router.message(Command("setinterval"))
 async def cmd_setinterval(message: Message):
     """Обработчик команды /setinterval"""
@@ -188,6 +367,7 @@ async def cmd_setinterval(message: Message):
             user_settings.auto_report_enabled = True
             user_settings.report_interval = interval
             await session.commit()
+            report_scheduler.schedule(user_settings.user_id, interval, user_settings.last_report_time)
         
         await message.answer(
             f"✅ Автоматическая отправка отчётов включена.\n"
@@ -211,6 +391,7 @@ async def cmd_stop(message: Message):
             )
             user_settings.auto_report_enabled = False
             await session.commit()
+        report_scheduler.unschedule(message.from_user.id)
         
         await message.answer("⏸ Автоматическая отправка отчётов остановлена")
         
@@ -219,6 +400,65 @@ async def cmd_stop(message: Message):
         await message.answer("❌ Ошибка при остановке автоотправки")
 
 
+@router.message(Command("alerts"))
+async def cmd_alerts(message: Message):
+    """Обработчик команды /alerts"""
+    try:
+        args = message.text.split()
+        usage = (
+            "❌ Укажите on/off или порог.\n"
+            "Примеры: /alerts off, /alerts cpu 85, /alerts cpu default"
+        )
+        if len(args) < 2:
+            await message.answer(usage)
+            return
+        
+        action = args[1].lower()
+        rule = alert_engine.get_rule(action)
+        threshold = None
+        if action in ('on', 'off'):
+            pass
+        elif rule is None or not rule.user_field or len(args) < 3:
+            await message.answer(usage)
+            return
+        elif args[2].lower() != 'default':
+            try:
+                threshold = float(args[2])
+            except ValueError:
+                await message.answer("❌ Порог должен быть числом")
+                return
+            if threshold <= 0 or threshold > 100:
+                await message.answer("❌ Порог должен быть от 0 до 100%")
+                return
+        
+        async with async_session_maker() as session:
+            user_settings = await get_or_create_user_settings(
+                session,
+                message.from_user.id,
+                message.from_user.username
+            )
+            if rule is None:
+                user_settings.alerts_enabled = action == 'on'
+            else:
+                setattr(user_settings, rule.user_field, threshold)
+            await session.commit()
+        alert_subscribers.invalidate()
+        alert_engine.forget_user(message.from_user.id)
+        
+        if action == 'on':
+            await message.answer("🔔 Уведомления о превышении порогов включены")
+        elif action == 'off':
+            await message.answer("🔕 Уведомления о превышении порогов отключены")
+        elif threshold is None:
+            await message.answer(f"✅ {rule.title}: порог по умолчанию ({rule.threshold:g}%)")
+        else:
+            await message.answer(f"✅ {rule.title}: ваш порог {threshold:g}% ({rule.describe()})")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в cmd_alerts: {e}")
+        await message.answer("❌ Ошибка при настройке уведомлений")
+
+
 @router.message(Command("settings"))
 async def cmd_settings(message: Message):
     """Обработчик команды /settings"""
@@ -240,6 +480,10 @@ async def cmd_settings(message: Message):
                 text += f"📊 Автоотправка: ❌ отключена\n"
             
             text += f"🔔 Уведомления: {'✅' if user_settings.alerts_enabled else '❌'}\n"
+            for rule in alert_engine.rules:
+                if rule.user_field:
+                    threshold = rule.threshold_for({rule.user_field: getattr(user_settings, rule.user_field, None)})
+                    text += f"  • {rule.title}: {threshold:g}% ({rule.describe()})\n"
             
             await message.answer(text)
             
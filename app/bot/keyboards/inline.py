@@ -1,35 +1,62 @@
 """
 Inline-клавиатуры для бота
 """
+from typing import Optional
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 
-def get_period_keyboard() -> InlineKeyboardMarkup:
-    """Клавиатура выбора периода для графиков"""
+def _period_keyboard(prefix: str, host_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора периода
+
+    callback_data: '<prefix>_<часы>' или '<prefix>_<часы>_<host_id>' для
+    удалённого хоста (id вместо имени - лимит callback_data 64 байта).
+    """
+    suffix = f"_{host_id}" if host_id is not None else ""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="1 час", callback_data="graph_1"),
-            InlineKeyboardButton(text="6 часов", callback_data="graph_6"),
+            InlineKeyboardButton(text="1 час", callback_data=f"{prefix}_1{suffix}"),
+            InlineKeyboardButton(text="6 часов", callback_data=f"{prefix}_6{suffix}"),
         ],
         [
-            InlineKeyboardButton(text="24 часа", callback_data="graph_24"),
-            InlineKeyboardButton(text="7 дней", callback_data="graph_168"),
+            InlineKeyboardButton(text="24 часа", callback_data=f"{prefix}_24{suffix}"),
+            InlineKeyboardButton(text="7 дней", callback_data=f"{prefix}_168{suffix}"),
         ],
     ])
     return keyboard
 
 
-def get_history_keyboard() -> InlineKeyboardMarkup:
+def get_period_keyboard(host_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    """Клавиатура выбора периода для графиков"""
+    return _period_keyboard("graph", host_id)
+
+
+def get_history_keyboard(host_id: Optional[int] = None) -> InlineKeyboardMarkup:
     """Клавиатура выбора периода для истории"""
+    return _period_keyboard("history", host_id)
+
+
+# Графики детальных метрик: тип (см. DETAIL_CHARTS) и подпись кнопки
+DETAIL_BUTTONS = (
+    ('cores', '🖥 Ядра CPU'),
+    ('mounts', '💾 Разделы'),
+    ('interfaces', '🌐 Интерфейсы'),
+    ('diskio', '💽 Disk I/O'),
+)
+
+
+def get_detail_keyboard(host_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора графика детальных метрик и периода
+
+    callback_data: 'detail_<тип>_<часы>' или 'detail_<тип>_<часы>_<host_id>'.
+    """
+    suffix = f"_{host_id}" if host_id is not None else ""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="1 час", callback_data="history_1"),
-            InlineKeyboardButton(text="6 часов", callback_data="history_6"),
-        ],
-        [
-            InlineKeyboardButton(text="24 часа", callback_data="history_24"),
-            InlineKeyboardButton(text="7 дней", callback_data="history_168"),
-        ],
+            InlineKeyboardButton(text=f"{title} 1ч", callback_data=f"detail_{chart}_1{suffix}"),
+            InlineKeyboardButton(text=f"{title} 24ч", callback_data=f"detail_{chart}_24{suffix}"),
+        ]
+        for chart, title in DETAIL_BUTTONS
     ])
     return keyboard
-
@@ -1,6 +1,9 @@
 """
 Главный модуль Telegram бота
 """
+import time
+_process_started = time.perf_counter()
+
 import os
 import sys
 import logging
@@ -13,9 +16,22 @@ from dotenv import load_dotenv
 # Добавляем корневую директорию в путь
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
-from app.core.db import init_db
+from app.core.db import init_db, dispose_engine
+from app.core.monitor import metrics_sampler, process_tracker
+from app.core.buffer import ring_buffer
+from app.core.snapshot import snapshot_store
+from app.core.writer import metric_writer
+from app.core.render import chart_renderer
+from app.core.reports import report_scheduler
+from app.core.web import start_web_server, stop_web_server
 from app.core.scheduler import init_scheduler, start_scheduler, stop_scheduler
 from app.bot.handlers import commands, callbacks
+from app.utils.startup import StartupTimer
+
+# Замер запуска: первая фаза - импорты (matplotlib в основной процесс не загружается)
+startup_timer = StartupTimer(_process_started)
+startup_timer.mark('imports')
+_warmup_task = None
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -32,6 +48,24 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def on_startup():
+    """Поллинг запущен: отчёт о времени запуска и прогрев пула графиков в фоне"""
+    global _warmup_task
+    startup_timer.mark('polling')
+    logger.info(f"Время запуска: {startup_timer.report()}")
+    _warmup_task = asyncio.create_task(chart_renderer.warmup())
+
+
+async def first_update_middleware(handler, event, data):
+    """Отметка времени до первого обработанного update"""
+    if startup_timer.first_update is None:
+        result = await handler(event, data)
+        if startup_timer.mark_first_update():
+            logger.info(f"Первый update обработан через {startup_timer.first_update:.2f}с после старта")
+        return result
+    return await handler(event, data)
+
+
 async def main():
     """Главная функция запуска бота"""
     
@@ -51,16 +85,37 @@ async def main():
     # Регистрация роутеров
     dp.include_router(commands.router)
     dp.include_router(callbacks.router)
+    dp.startup.register(on_startup)
+    dp.update.outer_middleware(first_update_middleware)
+    startup_timer.mark('dispatcher')
     
     try:
         # Инициализация базы данных
         logger.info("Инициализация базы данных...")
         await init_db()
+        startup_timer.mark('init_db')
+        
+        # Фоновый сэмплер метрик (не блокирует event loop)
+        metrics_sampler.add_listener(ring_buffer.append)
+        metrics_sampler.add_listener(snapshot_store.on_sample)
+        metrics_sampler.add_listener(process_tracker.on_sample)
+        metrics_sampler.start()
+        
+        # Отложенная пакетная запись метрик в БД
+        metric_writer.start()
+        startup_timer.mark('collectors')
         
         # Инициализация и запуск планировщика
         logger.info("Инициализация планировщика...")
         init_scheduler(bot)
         start_scheduler()
+        # Автоотчёты по расписанию пользователей
+        await report_scheduler.start(bot)
+        startup_timer.mark('scheduler')
+        
+        # HTTP-сервер: приём метрик от агентов (если задан WEB_PORT)
+        await start_web_server()
+        startup_timer.mark('web')
         
         # Запуск бота
         logger.info("Бот запущен и готов к работе!")
@@ -72,6 +127,13 @@ async def main():
     finally:
         # Остановка планировщика
         stop_scheduler()
+        await stop_web_server()
+        await report_scheduler.stop()
+        metrics_sampler.stop()
+        # Финальный сброс накопленных метрик в БД
+        await metric_writer.stop()
+        await dispose_engine()
+        chart_renderer.shutdown()
         # Закрытие бота
         await bot.session.close()
         logger.info("Бот остановлен")
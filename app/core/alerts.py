@@ -0,0 +1,356 @@
+"""
+Алерты: правила над потоком метрик и рассылка подписчикам
+
+Правило описывает условие вида "среднее CPU за 5 минут > 85" или
+"RAM > 90 три замера подряд". Агрегат окна (avg/min/max/last) обновляется
+за O(1) на каждый замер и общий для всех пользователей; с порогом
+сравнивается отдельно для каждого пользователя (личный порог или порог
+правила). Алерт срабатывает при превышении порога и снимается, только
+когда значение опустится ниже порога на hysteresis - так значение около
+порога не вызывает серию повторных сообщений.
+"""
+import os
+import json
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from aiogram import Bot
+
+from app.core.db import async_session_maker
+from app.models.metrics import UserSettings
+from app.utils.helpers import get_env_int, get_env_float
+
+logger = logging.getLogger(__name__)
+
+# Пороги правил по умолчанию
+ALERT_CPU_THRESHOLD = get_env_float('ALERT_CPU_THRESHOLD', 90.0)
+ALERT_RAM_THRESHOLD = get_env_float('ALERT_RAM_THRESHOLD', 90.0)
+ALERT_DISK_THRESHOLD = get_env_float('ALERT_DISK_THRESHOLD', 90.0)
+
+# Насколько значение должно опуститься ниже порога, чтобы алерт снялся
+ALERT_HYSTERESIS = get_env_float('ALERT_HYSTERESIS', 5.0)
+
+# Одновременных отправок сообщений (лимит Telegram - около 30 в секунду)
+ALERT_SEND_CONCURRENCY = get_env_int('ALERT_SEND_CONCURRENCY', 10)
+
+# Правила по умолчанию; заменяются JSON-списком из ALERT_RULES
+DEFAULT_RULES = [
+    {'name': 'cpu', 'title': 'Высокая нагрузка CPU', 'metric': 'cpu_percent',
+     'agg': 'avg', 'window': 300, 'threshold': ALERT_CPU_THRESHOLD,
+     'user_field': 'alert_cpu_threshold'},
+    {'name': 'ram', 'title': 'Высокое использование RAM', 'metric': 'ram_percent',
+     'agg': 'min', 'samples': 3, 'threshold': ALERT_RAM_THRESHOLD,
+     'user_field': 'alert_ram_threshold'},
+    {'name': 'disk', 'title': 'Мало места на диске', 'metric': 'disk_percent',
+     'agg': 'last', 'samples': 1, 'threshold': ALERT_DISK_THRESHOLD,
+     'user_field': 'alert_disk_threshold'},
+]
+
+_AGG_TITLES = {'avg': 'среднее', 'min': 'минимум', 'max': 'максимум', 'last': 'текущее'}
+
+# Колонки UserSettings, которые правило может использовать как личный порог
+USER_THRESHOLD_FIELDS = tuple(
+    name for name in UserSettings.__table__.columns.keys() if name.endswith('_threshold')
+)
+
+
+class WindowAggregate:
+    """
+    Скользящее окно по времени (window секунд) или по числу замеров (samples)
+
+    Сумма ведётся нарастающим итогом, минимум и максимум - монотонными
+    очередями, поэтому добавление замера стоит O(1) в среднем.
+    """
+
+    def __init__(self, window: float = 0, samples: int = 0):
+        self.window = window
+        self.samples = samples
+        # (номер замера, время, значение) и (номер замера, значение)
+        self._values: Deque[Tuple[int, float, float]] = deque()
+        self._min: Deque[Tuple[int, float]] = deque()
+        self._max: Deque[Tuple[int, float]] = deque()
+        self._sum = 0.0
+        self._seq = 0
+        self._started: Optional[float] = None
+
+    def _evict(self, ts: float):
+        values = self._values
+        while values and (
+            (self.window and values[0][1] <= ts - self.window)
+            or (self.samples and len(values) > self.samples)
+        ):
+            seq, _, old_value = values.popleft()
+            self._sum -= old_value
+            if self._min and self._min[0][0] == seq:
+                self._min.popleft()
+            if self._max and self._max[0][0] == seq:
+                self._max.popleft()
+
+    def push(self, ts: float, value: float):
+        """Добавление замера"""
+        if self._started is None:
+            self._started = ts
+        self._seq += 1
+        self._values.append((self._seq, ts, value))
+        self._sum += value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((self._seq, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((self._seq, value))
+        self._evict(ts)
+
+    def ready(self) -> bool:
+        """Окно заполнено: прошло window секунд или накоплено samples замеров"""
+        if not self._values:
+            return False
+        if self.samples and len(self._values) < self.samples:
+            return False
+        if self.window and self._values[-1][1] - self._started < self.window:
+            return False
+        return True
+
+    def value(self, agg: str) -> Optional[float]:
+        """Агрегат окна: avg, min, max или last"""
+        if not self.ready():
+            return None
+        if agg == 'avg':
+            return self._sum / len(self._values)
+        if agg == 'min':
+            return self._min[0][1]
+        if agg == 'max':
+            return self._max[0][1]
+        return self._values[-1][2]
+
+
+class AlertRule:
+    """Условие алерта над одной метрикой"""
+
+    def __init__(
+        self,
+        name: str,
+        metric: str,
+        threshold: float,
+        agg: str = 'last',
+        window: float = 0,
+        samples: int = 0,
+        hysteresis: float = ALERT_HYSTERESIS,
+        title: Optional[str] = None,
+        user_field: Optional[str] = None,
+    ):
+        if agg not in _AGG_TITLES:
+            raise ValueError(f"Неизвестная агрегация {agg!r} в правиле {name}")
+        if user_field is not None and user_field not in USER_THRESHOLD_FIELDS:
+            raise ValueError(
+                f"Неизвестное поле порога {user_field!r} в правиле {name}, "
+                f"допустимы: {', '.join(USER_THRESHOLD_FIELDS)}"
+            )
+        self.name = name
+        self.metric = metric
+        self.threshold = float(threshold)
+        self.agg = agg
+        self.window = float(window)
+        self.samples = int(samples) if samples or window else 1
+        self.hysteresis = float(hysteresis)
+        self.title = title or name
+        self.user_field = user_field
+
+    def describe(self) -> str:
+        """Описание условия для сообщения, например 'среднее за 5 мин'"""
+        if self.window:
+            return f"{_AGG_TITLES[self.agg]} за {self.window / 60:g} мин"
+        if self.samples > 1:
+            return f"{_AGG_TITLES[self.agg]} по {self.samples} последним замерам"
+        return _AGG_TITLES[self.agg]
+
+    def threshold_for(self, thresholds: Dict[str, Optional[float]]) -> float:
+        """Порог для пользователя: личный, если задан, иначе порог правила"""
+        if self.user_field and thresholds.get(self.user_field) is not None:
+            return thresholds[self.user_field]
+        return self.threshold
+
+
+def build_rules(specs: List[Dict]) -> List[AlertRule]:
+    """Правила из списка описаний; ошибка в любом описании - ValueError"""
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("ожидается непустой JSON-список правил")
+    rules = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            raise ValueError(f"правило должно быть объектом: {spec!r}")
+        try:
+            rule = AlertRule(**spec)
+        except TypeError as e:
+            raise ValueError(f"некорректное правило {spec.get('name')!r}: {e}")
+        if any(existing.name == rule.name for existing in rules):
+            raise ValueError(f"повторяется имя правила {rule.name!r}")
+        rules.append(rule)
+    return rules
+
+
+def load_rules() -> List[AlertRule]:
+    """Правила из ALERT_RULES (JSON-список) или правила по умолчанию"""
+    raw = os.getenv('ALERT_RULES')
+    if raw:
+        try:
+            return build_rules(json.loads(raw))
+        except ValueError as e:
+            logger.error(f"Некорректный ALERT_RULES, используются правила по умолчанию: {e}")
+    return build_rules(DEFAULT_RULES)
+
+
+class AlertEngine:
+    """
+    Вычисление правил по потоку замеров
+
+    observe() обновляет окна всех правил, evaluate() сравнивает агрегаты
+    с порогами пользователей и возвращает для каждого новые и снятые алерты.
+    """
+
+    def __init__(self, rules: List[AlertRule]):
+        self.rules = rules
+        self._windows = {rule.name: WindowAggregate(rule.window, rule.samples) for rule in rules}
+        self._firing: Dict[Tuple[int, str], bool] = {}
+
+    def get_rule(self, name: str) -> Optional[AlertRule]:
+        return next((rule for rule in self.rules if rule.name == name), None)
+
+    def observe(self, ts: float, metrics: Dict) -> Dict[str, float]:
+        """Добавление замера, возвращает готовые агрегаты правил"""
+        values = {}
+        for rule in self.rules:
+            value = metrics.get(rule.metric)
+            window = self._windows[rule.name]
+            if value is not None:
+                window.push(ts, value)
+            aggregate = window.value(rule.agg)
+            if aggregate is not None:
+                values[rule.name] = aggregate
+        return values
+
+    def evaluate(
+        self,
+        values: Dict[str, float],
+        subscribers: Dict[int, Dict[str, Optional[float]]]
+    ) -> Dict[int, List[str]]:
+        """Строки сообщений для пользователей: сработавшие и снятые алерты"""
+        messages: Dict[int, List[str]] = {}
+        for rule in self.rules:
+            value = values.get(rule.name)
+            if value is None:
+                continue
+            for user_id, thresholds in subscribers.items():
+                threshold = rule.threshold_for(thresholds)
+                key = (user_id, rule.name)
+                firing = self._firing.get(key, False)
+                if not firing and value > threshold:
+                    self._firing[key] = True
+                    messages.setdefault(user_id, []).append(
+                        f"⚠️ {rule.title}: <b>{value:.1f}%</b> "
+                        f"({rule.describe()}, порог {threshold:g}%)"
+                    )
+                elif firing and value < threshold - rule.hysteresis:
+                    self._firing[key] = False
+                    messages.setdefault(user_id, []).append(
+                        f"✅ {rule.title} - норма: {value:.1f}% ({rule.describe()})"
+                    )
+        return messages
+
+    def firing_count(self) -> int:
+        """Количество активных алертов (пользователь, правило)"""
+        return sum(1 for firing in self._firing.values() if firing)
+
+    def forget_user(self, user_id: int):
+        """Сброс состояния алертов пользователя (отписка, смена порогов)"""
+        for key in [key for key in self._firing if key[0] == user_id]:
+            del self._firing[key]
+
+
+class AlertSubscribers:
+    """
+    Кэш пользователей с включёнными алертами и их личных порогов
+
+    Список читается из БД при первом обращении и после invalidate();
+    ttl - страховка на случай изменения таблицы в обход бота. Читаются
+    только колонки порогов fields, которые используют правила.
+    """
+
+    def __init__(self, fields: List[str], ttl: int = 3600):
+        self.fields = list(dict.fromkeys(fields))
+        self.ttl = ttl
+        self._users: Optional[Dict[int, Dict[str, Optional[float]]]] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Сброс кэша после изменения настроек пользователя"""
+        self._users = None
+
+    def _expired(self) -> bool:
+        return self._users is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    async def get(self) -> Dict[int, Dict[str, Optional[float]]]:
+        """Пользователи с включёнными алертами: user_id -> личные пороги"""
+        if not self._expired():
+            return self._users
+        async with self._lock:
+            if self._expired():
+                async with async_session_maker() as session:
+                    stmt = select(
+                        UserSettings.user_id,
+                        *(getattr(UserSettings, field) for field in self.fields)
+                    ).where(UserSettings.alerts_enabled == True)
+                    result = await session.execute(stmt)
+                    self._users = {row.user_id: dict(row._mapping) for row in result}
+                self._loaded_at = time.monotonic()
+                logger.debug(f"Подписчиков на алерты: {len(self._users)}")
+            return self._users
+
+
+# Глобальные правила и кэш подписчиков
+alert_engine = AlertEngine(load_rules())
+alert_subscribers = AlertSubscribers(
+    fields=[rule.user_field for rule in alert_engine.rules if rule.user_field],
+    ttl=get_env_int('ALERT_SUBSCRIBERS_TTL', 3600),
+)
+
+
+async def broadcast(bot: Bot, messages: Dict[int, str]):
+    """Параллельная отправка сообщений пользователям"""
+    slots = asyncio.Semaphore(ALERT_SEND_CONCURRENCY)
+
+    async def send(user_id: int, text: str):
+        async with slots:
+            try:
+                await bot.send_message(user_id, text)
+            except Exception as e:
+                logger.error(f"Ошибка отправки алерта пользователю {user_id}: {e}")
+
+    await asyncio.gather(*(send(user_id, text) for user_id, text in messages.items()))
+
+
+async def check_alerts(bot: Bot, metrics: Dict, ts: Optional[float] = None):
+    """Обработка замера правилами и отправка каждому пользователю одного сообщения"""
+    try:
+        values = alert_engine.observe(ts if ts is not None else time.time(), metrics)
+        if not values:
+            return
+
+        # Подписчики и их пороги берутся из кэша в памяти
+        users = await alert_subscribers.get()
+        lines = alert_engine.evaluate(values, users)
+        if not lines:
+            return
+
+        messages = {
+            user_id: "🔔 <b>Алерты сервера</b>\n\n" + "\n".join(user_lines)
+            for user_id, user_lines in lines.items()
+        }
+        await broadcast(bot, messages)
+        logger.info(f"Алерты отправлены {len(messages)} пользователям")
+    except Exception as e:
+        logger.error(f"Ошибка при проверке алертов: {e}")
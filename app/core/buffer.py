@@ -0,0 +1,167 @@
+"""
+Кольцевой буфер метрик высокого разрешения
+"""
+import math
+import time
+import logging
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+from app.utils.helpers import get_env_float, get_env_int
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые усредняются при агрегации
+AVG_FIELDS = (
+    'cpu_load_1m', 'cpu_load_5m', 'cpu_load_15m', 'cpu_percent', 'cpu_temp',
+    'ram_used', 'ram_percent', 'disk_used', 'disk_percent', 'process_count',
+    'net_sent_rate', 'net_recv_rate',
+)
+# Поля, для которых сохраняется последнее значение (счётчики и объёмы)
+LAST_FIELDS = ('ram_total', 'disk_total', 'net_sent', 'net_recv')
+# Поля, для которых дополнительно сохраняются минимум и максимум
+RANGE_FIELDS = ('cpu_percent', 'ram_percent', 'disk_percent')
+# Целочисленные колонки модели Metric
+INT_FIELDS = ('ram_used', 'ram_total', 'disk_used', 'disk_total', 'net_sent', 'net_recv', 'process_count')
+
+BUFFER_FIELDS = AVG_FIELDS + LAST_FIELDS
+
+_NAN = float('nan')
+
+
+class MetricRingBuffer:
+    """
+    Кольцевой буфер сэмплов на массивах array('d')
+
+    Каждое поле хранится в отдельном массиве фиксированной длины, пропуски
+    записываются как NaN. Запись идёт из потока сэмплера, чтение - из
+    event loop, поэтому все операции защищены блокировкой.
+    """
+
+    def __init__(self, capacity: int, interval: float = 1.0, fields=BUFFER_FIELDS):
+        self.capacity = capacity
+        self.interval = interval
+        self.fields = tuple(fields)
+        self._timestamps = array('d', [_NAN]) * capacity
+        self._columns = {field: array('d', [_NAN]) * capacity for field in self.fields}
+        self._head = 0  # индекс следующей записи
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, timestamp: float, metrics: Dict):
+        """Добавление сэмпла (timestamp - unix time)"""
+        with self._lock:
+            i = self._head
+            self._timestamps[i] = timestamp
+            for field, column in self._columns.items():
+                value = metrics.get(field)
+                column[i] = _NAN if value is None else float(value)
+            self._head = (i + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def _offset_after(self, start: int, timestamp: float) -> int:
+        """
+        Логическое смещение (0 - самый старый сэмпл) первого сэмпла с
+        timestamp > заданного; бинарный поиск без построения списка индексов
+        """
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamps[(start + mid) % self.capacity] > timestamp:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _indices_since(self, since: float, until: Optional[float] = None) -> List[int]:
+        """Индексы сэмплов с since < timestamp <= until в хронологическом порядке"""
+        start = (self._head - self._size) % self.capacity
+        first = self._offset_after(start, since)
+        last = self._size if until is None else self._offset_after(start, until)
+        # В физические индексы переводится только результат
+        return [(start + k) % self.capacity for k in range(first, last)]
+
+    def span(self) -> float:
+        """Промежуток времени, покрываемый буфером (секунды)"""
+        with self._lock:
+            if self._size < 2:
+                return 0.0
+            newest = self._timestamps[(self._head - 1) % self.capacity]
+            oldest = self._timestamps[(self._head - self._size) % self.capacity]
+            return newest - oldest
+
+    def covers(self, seconds: float) -> bool:
+        """Покрывает ли буфер последние seconds секунд"""
+        return self.span() + self.interval >= seconds
+
+    def window(self, seconds: float) -> Dict[str, array]:
+        """Сэмплы за последние seconds секунд: {'timestamp': array, поле: array}"""
+        since = time.time() - seconds
+        with self._lock:
+            indices = self._indices_since(since)
+            result = {'timestamp': array('d', (self._timestamps[i] for i in indices))}
+            for field, column in self._columns.items():
+                result[field] = array('d', (column[i] for i in indices))
+        return result
+
+    def series(self, seconds: float, fields: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Временные ряды за последние seconds секунд в том же формате,
+        что и SystemMonitor.get_series
+        """
+        data = self.window(seconds)
+        timestamps = np.frombuffer(data['timestamp'], dtype=np.float64)
+        result = {'timestamp': (timestamps * 1e6).astype('datetime64[us]')}
+        for field in fields:
+            result[field] = np.frombuffer(data[field], dtype=np.float64)
+        return result
+
+    def aggregate(self, since: float, until: Optional[float] = None) -> Optional[Dict]:
+        """
+        Агрегация сэмплов в интервале (since, until]
+
+        Returns:
+            Словарь в формате колонок Metric (avg/last, min/max для RANGE_FIELDS,
+            samples) или None, если сэмплов нет
+        """
+        with self._lock:
+            indices = self._indices_since(since, until)
+            if not indices:
+                return None
+            last_ts = self._timestamps[indices[-1]]
+            columns = {
+                field: [v for v in (column[i] for i in indices) if not math.isnan(v)]
+                for field, column in self._columns.items()
+            }
+
+        row = {
+            'timestamp': datetime.utcfromtimestamp(last_ts),
+            'samples': len(indices),
+        }
+        for field, values in columns.items():
+            if not values:
+                row[field] = None
+                if field in RANGE_FIELDS:
+                    row[f'{field}_min'] = row[f'{field}_max'] = None
+                continue
+            value = values[-1] if field in LAST_FIELDS else sum(values) / len(values)
+            row[field] = int(round(value)) if field in INT_FIELDS else value
+            if field in RANGE_FIELDS:
+                row[f'{field}_min'] = min(values)
+                row[f'{field}_max'] = max(values)
+        return row
+
+
+_sample_interval = get_env_float('SAMPLE_INTERVAL', 1.0)
+
+# Глобальный буфер (по умолчанию 1 час сэмплов)
+ring_buffer = MetricRingBuffer(
+    capacity=max(1, int(get_env_int('HIRES_WINDOW', 3600) / _sample_interval)),
+    interval=_sample_interval,
+)
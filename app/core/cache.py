@@ -0,0 +1,207 @@
+"""
+Кэш готовых графиков, общий для всех пользователей
+"""
+import time
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputMediaPhoto, Message
+
+from app.utils.helpers import get_env_int
+
+logger = logging.getLogger(__name__)
+
+
+class ChartCache:
+    """
+    LRU-кэш PNG-графиков с ограничением по памяти
+
+    Ключ - (тип графика, период, интервал времени, хост). Интервал выровнен по
+    периоду сбора метрик, поэтому все запросы в пределах одного интервала
+    получают один и тот же график, а при появлении новых данных ключ
+    меняется сам собой.
+
+    Для отправленных графиков запоминается file_id Telegram, чтобы повторно
+    отправлять только идентификатор; он удаляется вместе с графиком.
+    """
+
+    def __init__(self, max_bytes: int, bucket_seconds: int):
+        self.max_bytes = max_bytes
+        self.bucket_seconds = max(1, bucket_seconds)
+        self._entries: 'OrderedDict[Tuple, bytes]' = OrderedDict()
+        self._size = 0
+        self._file_ids: Dict[Tuple, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.file_id_hits = 0
+
+    def current_bucket(self, timestamp: Optional[float] = None) -> int:
+        """Номер интервала времени для timestamp (по умолчанию - сейчас)"""
+        if timestamp is None:
+            timestamp = time.time()
+        return int(timestamp // self.bucket_seconds)
+
+    def make_key(
+        self,
+        chart_type: str,
+        period: Hashable,
+        bucket: Optional[int] = None,
+        host_id: Optional[int] = None
+    ) -> Tuple:
+        """Ключ кэша для графика (host_id=None - локальный сервер)"""
+        if bucket is None:
+            bucket = self.current_bucket()
+        return (chart_type, period, bucket, host_id)
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        """Получение графика из кэша"""
+        data = self._entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key: Tuple, data: Optional[bytes]):
+        """Сохранение графика с вытеснением давно не использованных"""
+        if not data or len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+            if previous != data:
+                self._file_ids.pop(key, None)
+        self._entries[key] = data
+        self._size += len(data)
+        
+        while self._size > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self._file_ids.pop(evicted_key, None)
+            self.evictions += 1
+
+    def get_file_id(self, key: Tuple) -> Optional[str]:
+        """file_id ранее отправленного графика"""
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            self.file_id_hits += 1
+        return file_id
+
+    def has_file_id(self, key: Tuple) -> bool:
+        """Есть ли file_id для графика (без учёта в статистике попаданий)"""
+        return key in self._file_ids
+
+    def set_file_id(self, key: Tuple, file_id: str):
+        """Запоминание file_id отправленного графика (только пока график в кэше)"""
+        if key in self._entries:
+            self._file_ids[key] = file_id
+
+    def forget_file_id(self, key: Tuple):
+        """Удаление file_id, который Telegram больше не принимает"""
+        self._file_ids.pop(key, None)
+
+    def invalidate_before(self, bucket: int) -> int:
+        """Удаление графиков из интервалов раньше bucket"""
+        stale = [key for key in self._entries if key[2] < bucket]
+        for key in stale:
+            self._size -= len(self._entries.pop(key))
+            self._file_ids.pop(key, None)
+        self.invalidations += len(stale)
+        return len(stale)
+
+    def on_new_data(self, timestamp: Optional[float] = None):
+        """Новые данные пересекли границу интервала - старые графики больше не нужны"""
+        self.invalidate_before(self.current_bucket(timestamp))
+
+    def stats(self) -> Dict:
+        """Счётчики кэша"""
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'max_bytes': self.max_bytes,
+            'bucket_seconds': self.bucket_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'file_ids': len(self._file_ids),
+            'file_id_hits': self.file_id_hits,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+        }
+
+
+# Глобальный кэш графиков
+chart_cache = ChartCache(
+    max_bytes=get_env_int('CHART_CACHE_MB', 32) * 1024 * 1024,
+    bucket_seconds=get_env_int('CHART_CACHE_BUCKET', get_env_int('MONITOR_INTERVAL', 60)),
+)
+
+
+async def send_cached_chart(
+    send_photo: Callable[..., Awaitable[Message]],
+    key: Tuple,
+    chart_data: bytes,
+    filename: str,
+    **kwargs
+) -> Message:
+    """
+    Отправка графика с повторным использованием file_id Telegram
+    
+    Если график с таким ключом кэша уже отправлялся, передаётся только его
+    file_id, иначе загружается PNG и полученный file_id запоминается.
+    Повторная загрузка выполняется, только если Telegram отклонил file_id;
+    сетевые ошибки и лимиты передаются вызывающему коду.
+    """
+    file_id = chart_cache.get_file_id(key)
+    if file_id:
+        try:
+            return await send_photo(photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning(f"Не удалось отправить график по file_id, загружаем заново: {e}")
+            chart_cache.forget_file_id(key)
+    
+    message = await send_photo(photo=BufferedInputFile(chart_data, filename=filename), **kwargs)
+    if message.photo:
+        chart_cache.set_file_id(key, message.photo[-1].file_id)
+    return message
+
+
+async def send_cached_album(
+    send_media_group: Callable[..., Awaitable[List[Message]]],
+    items: List[Tuple[Tuple, bytes, str, str]],
+    **kwargs
+) -> List[Message]:
+    """
+    Отправка нескольких графиков одним альбомом (sendMediaGroup)
+    
+    items - список (ключ кэша, PNG, имя файла, подпись). Графики с известным
+    file_id передаются по идентификатору; если Telegram его не принял
+    (TelegramBadRequest), альбом отправляется заново с загрузкой всех PNG.
+    """
+    def build(use_file_ids: bool) -> List[InputMediaPhoto]:
+        media = []
+        for key, chart_data, filename, caption in items:
+            file_id = chart_cache.get_file_id(key) if use_file_ids else None
+            photo = file_id or BufferedInputFile(chart_data, filename=filename)
+            media.append(InputMediaPhoto(media=photo, caption=caption))
+        return media
+    
+    try:
+        messages = await send_media_group(media=build(True), **kwargs)
+    except TelegramBadRequest as e:
+        if not any(chart_cache.has_file_id(key) for key, *_ in items):
+            raise
+        logger.warning(f"Не удалось отправить альбом по file_id, загружаем заново: {e}")
+        for key, *_ in items:
+            chart_cache.forget_file_id(key)
+        messages = await send_media_group(media=build(False), **kwargs)
+    
+    for (key, *_), message in zip(items, messages):
+        if message.photo:
+            chart_cache.set_file_id(key, message.photo[-1].file_id)
+    return messages
@@ -1,27 +1,56 @@
 """
 Модуль для построения графиков метрик с помощью matplotlib
+
+Используется только объектный API (Figure), без глобального состояния
+pyplot, поэтому функции можно вызывать в рабочих процессах пула
+(см. app.core.render).
 """
 import io
+import os
 import logging
-from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Optional
+import numpy as np
 import matplotlib
 matplotlib.use('Agg')  # Использование non-GUI backend
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import matplotlib.style
+from matplotlib.artist import setp
 from matplotlib.figure import Figure
 
-from app.models.metrics import Metric
+from app.core.decimate import decimate
+from app.utils.helpers import get_env_int
 
 logger = logging.getLogger(__name__)
 
-# Настройка стиля графиков
-plt.style.use('seaborn-v0_8-darkgrid')
+# Стиль графиков
+CHART_STYLE = 'seaborn-v0_8-darkgrid'
+
+# Прореживание рядов до ширины графика в пикселях (12 дюймов * 100 dpi)
+CHART_MAX_POINTS = get_env_int('CHART_MAX_POINTS', 1200)
+CHART_DECIMATION = os.getenv('CHART_DECIMATION', 'minmax')  # minmax | lttb | none
+
+
+def _has_data(values: Optional[np.ndarray]) -> bool:
+    """Есть ли в массиве хотя бы одно значение (не NaN)"""
+    return values is not None and len(values) > 0 and not np.all(np.isnan(values))
 
 
 class ChartGenerator:
     """Класс для генерации графиков метрик"""
     
+    @staticmethod
+    def _decimate(timestamps: np.ndarray, values: np.ndarray):
+        """Прореживание ряда до CHART_MAX_POINTS точек с сохранением пиков"""
+        return decimate(timestamps, values, CHART_MAX_POINTS, CHART_DECIMATION)
+    
+    @staticmethod
+    def _to_png(fig: Figure) -> bytes:
+        """Сохранение фигуры в PNG"""
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+        return buf.getvalue()
+    
     @staticmethod
     def _setup_common_style(ax, title: str, ylabel: str):
         """Общие настройки стиля для всех графиков"""
@@ -35,179 +64,199 @@ class ChartGenerator:
         # Форматирование оси времени
         ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
         ax.xaxis.set_major_locator(mdates.AutoDateLocator())
-        plt.setp(ax.xaxis.get_majorticklabels(), rotation=45, ha='right')
+        setp(ax.xaxis.get_majorticklabels(), rotation=45, ha='right')
     
     @staticmethod
-    def create_cpu_chart(metrics: List[Metric]) -> Optional[bytes]:
-        """Создание графика CPU"""
-        if not metrics:
-            return None
+    def _draw_percent(ax, timestamps: np.ndarray, values: Optional[np.ndarray], title: str,
+                      label: str, color: str, marker: str, linewidth: float, threshold_color: str):
+        """Линия процента использования с заливкой и порогом 90%"""
+        if not _has_data(values):
+            return
+        x, y = ChartGenerator._decimate(timestamps, values)
+        ax.plot(x, y, label=label, color=color, linewidth=linewidth, marker=marker, markersize=3)
+        ax.axhline(y=90, color=threshold_color, linestyle='--', linewidth=1, alpha=0.7, label='Порог 90%')
+        ax.fill_between(x, y, alpha=0.3, color=color)
+        ChartGenerator._setup_common_style(ax, title, 'Использование (%)')
+        ax.set_ylim(0, 100)
+        ax.legend(loc='upper left')
+    
+    @staticmethod
+    def _draw_cpu_usage(ax, series: Dict[str, np.ndarray]):
+        """График CPU Usage (NaN отображаются как разрывы линии)"""
+        ChartGenerator._draw_percent(
+            ax, series['timestamp'], series.get('cpu_percent'), '🖥 CPU Usage (%)',
+            label='CPU Usage', color='#e74c3c', marker='o', linewidth=2, threshold_color='orange'
+        )
+    
+    @staticmethod
+    def _draw_cpu_load(ax, series: Dict[str, np.ndarray]):
+        """График Load Average"""
+        timestamps = series['timestamp']
+        load_1m = series.get('cpu_load_1m')
+        load_5m = series.get('cpu_load_5m')
+        load_15m = series.get('cpu_load_15m')
         
-        try:
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8))
-            
-            timestamps = [m.timestamp for m in metrics]
-            
-            # График CPU Usage
-            cpu_percents = [m.cpu_percent for m in metrics if m.cpu_percent is not None]
-            if cpu_percents:
-                ax1.plot(timestamps[:len(cpu_percents)], cpu_percents, 
-                        label='CPU Usage', color='#e74c3c', linewidth=2, marker='o', markersize=3)
-                ax1.axhline(y=90, color='orange', linestyle='--', linewidth=1, alpha=0.7, label='Порог 90%')
-                ax1.fill_between(timestamps[:len(cpu_percents)], cpu_percents, alpha=0.3, color='#e74c3c')
-                ChartGenerator._setup_common_style(ax1, '🖥 CPU Usage (%)', 'Использование (%)')
-                ax1.set_ylim(0, 100)
-                ax1.legend(loc='upper left')
-            
-            # График Load Average
-            load_1m = [m.cpu_load_1m for m in metrics if m.cpu_load_1m is not None]
-            load_5m = [m.cpu_load_5m for m in metrics if m.cpu_load_5m is not None]
-            load_15m = [m.cpu_load_15m for m in metrics if m.cpu_load_15m is not None]
-            
-            if load_1m:
-                ax2.plot(timestamps[:len(load_1m)], load_1m, label='1 min', color='#3498db', linewidth=2, marker='o', markersize=2)
-            if load_5m:
-                ax2.plot(timestamps[:len(load_5m)], load_5m, label='5 min', color='#2ecc71', linewidth=2, marker='s', markersize=2)
-            if load_15m:
-                ax2.plot(timestamps[:len(load_15m)], load_15m, label='15 min', color='#9b59b6', linewidth=2, marker='^', markersize=2)
-            
-            ChartGenerator._setup_common_style(ax2, '📊 CPU Load Average', 'Load')
-            ax2.legend(loc='upper left')
-            
-            plt.tight_layout()
-            
-            # Сохранение в буфер
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-            buf.seek(0)
-            plt.close(fig)
-            
-            return buf.getvalue()
-        except Exception as e:
-            logger.error(f"Ошибка при создании графика CPU: {e}")
-            return None
+        if _has_data(load_1m):
+            ax.plot(*ChartGenerator._decimate(timestamps, load_1m), label='1 min', color='#3498db', linewidth=2, marker='o', markersize=2)
+        if _has_data(load_5m):
+            ax.plot(*ChartGenerator._decimate(timestamps, load_5m), label='5 min', color='#2ecc71', linewidth=2, marker='s', markersize=2)
+        if _has_data(load_15m):
+            ax.plot(*ChartGenerator._decimate(timestamps, load_15m), label='15 min', color='#9b59b6', linewidth=2, marker='^', markersize=2)
+        
+        ChartGenerator._setup_common_style(ax, '📊 CPU Load Average', 'Load')
+        ax.legend(loc='upper left')
     
     @staticmethod
-    def create_memory_chart(metrics: List[Metric]) -> Optional[bytes]:
-        """Создание графика памяти"""
-        if not metrics:
-            return None
+    def _draw_memory(ax, series: Dict[str, np.ndarray]):
+        """График RAM"""
+        ChartGenerator._draw_percent(
+            ax, series['timestamp'], series.get('ram_percent'), '🧠 RAM Usage',
+            label='RAM Usage', color='#2ecc71', marker='o', linewidth=2.5, threshold_color='orange'
+        )
+    
+    @staticmethod
+    def _draw_disk(ax, series: Dict[str, np.ndarray]):
+        """График диска"""
+        ChartGenerator._draw_percent(
+            ax, series['timestamp'], series.get('disk_percent'), '💾 Disk Usage',
+            label='Disk Usage', color='#f39c12', marker='s', linewidth=2.5, threshold_color='red'
+        )
+    
+    @staticmethod
+    def _draw_network(ax, series: Dict[str, np.ndarray]):
+        """График сети: скорость, посчитанная сборщиком (байт/с -> MB/с)"""
+        timestamps = series['timestamp']
+        net_sent = series.get('net_sent_rate')
+        net_recv = series.get('net_recv_rate')
         
-        try:
-            fig, ax = plt.subplots(figsize=(12, 6))
-            
-            timestamps = [m.timestamp for m in metrics]
-            ram_percents = [m.ram_percent for m in metrics if m.ram_percent is not None]
-            
-            if ram_percents:
-                ax.plot(timestamps[:len(ram_percents)], ram_percents, 
-                       label='RAM Usage', color='#2ecc71', linewidth=2.5, marker='o', markersize=3)
-                ax.axhline(y=90, color='orange', linestyle='--', linewidth=1, alpha=0.7, label='Порог 90%')
-                ax.fill_between(timestamps[:len(ram_percents)], ram_percents, alpha=0.3, color='#2ecc71')
-                
-                ChartGenerator._setup_common_style(ax, '🧠 RAM Usage', 'Использование (%)')
-                ax.set_ylim(0, 100)
-                ax.legend(loc='upper left')
-            
-            plt.tight_layout()
-            
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-            buf.seek(0)
-            plt.close(fig)
-            
-            return buf.getvalue()
-        except Exception as e:
-            logger.error(f"Ошибка при создании графика RAM: {e}")
-            return None
+        if _has_data(net_sent):
+            ax.plot(*ChartGenerator._decimate(timestamps, net_sent / (1024 * 1024)),
+                   label='Отправлено', color='#e74c3c', linewidth=2, marker='^', markersize=3)
+        if _has_data(net_recv):
+            ax.plot(*ChartGenerator._decimate(timestamps, net_recv / (1024 * 1024)),
+                   label='Получено', color='#3498db', linewidth=2, marker='v', markersize=3)
+        
+        ChartGenerator._setup_common_style(ax, '🌐 Network Traffic', 'Скорость (MB/с)')
+        ax.legend(loc='upper left')
     
     @staticmethod
-    def create_disk_chart(metrics: List[Metric]) -> Optional[bytes]:
-        """Создание графика диска"""
-        if not metrics:
+    def _detail_columns(series: Dict[str, np.ndarray], name: str):
+        """Ряды детальной метрики name: пары (метка, значения), см. get_detail_series"""
+        prefix = f"{name}:"
+        return [(key[len(prefix):], values) for key, values in series.items()
+                if key.startswith(prefix) and _has_data(values)]
+    
+    @staticmethod
+    def _draw_detail_percent(ax, series: Dict[str, np.ndarray], name: str, title: str):
+        """Линии процентов по одной на метку (ядро, раздел)"""
+        timestamps = series['timestamp']
+        columns = ChartGenerator._detail_columns(series, name)
+        for label, values in columns:
+            ax.plot(*ChartGenerator._decimate(timestamps, values), label=label, linewidth=1.5)
+        ax.axhline(y=90, color='red', linestyle='--', linewidth=1, alpha=0.7)
+        ChartGenerator._setup_common_style(ax, title, 'Использование (%)')
+        ax.set_ylim(0, 100)
+        if 0 < len(columns) <= 16:
+            ax.legend(loc='upper left', ncol=2, fontsize=8)
+    
+    @staticmethod
+    def _draw_detail_rate(ax, series: Dict[str, np.ndarray], name: str, title: str):
+        """Скорость (байт/с -> MB/с) по одной линии на метку"""
+        timestamps = series['timestamp']
+        columns = ChartGenerator._detail_columns(series, name)
+        for label, values in columns:
+            ax.plot(*ChartGenerator._decimate(timestamps, values / (1024 * 1024)), label=label, linewidth=1.5)
+        ChartGenerator._setup_common_style(ax, title, 'Скорость (MB/с)')
+        if 0 < len(columns) <= 16:
+            ax.legend(loc='upper left', ncol=2, fontsize=8)
+    
+    @staticmethod
+    def _render(series: Dict[str, np.ndarray], name: str, figsize, layout, painters,
+                min_points: int = 1) -> Optional[bytes]:
+        """Создание фигуры с панелями layout=(строки, колонки), по одной функции на панель"""
+        timestamps = series.get('timestamp')
+        if timestamps is None or len(timestamps) < min_points:
             return None
         
         try:
-            fig, ax = plt.subplots(figsize=(12, 6))
-            
-            timestamps = [m.timestamp for m in metrics]
-            disk_percents = [m.disk_percent for m in metrics if m.disk_percent is not None]
-            
-            if disk_percents:
-                ax.plot(timestamps[:len(disk_percents)], disk_percents, 
-                       label='Disk Usage', color='#f39c12', linewidth=2.5, marker='s', markersize=3)
-                ax.axhline(y=90, color='red', linestyle='--', linewidth=1, alpha=0.7, label='Порог 90%')
-                ax.fill_between(timestamps[:len(disk_percents)], disk_percents, alpha=0.3, color='#f39c12')
-                
-                ChartGenerator._setup_common_style(ax, '💾 Disk Usage', 'Использование (%)')
-                ax.set_ylim(0, 100)
-                ax.legend(loc='upper left')
-            
-            plt.tight_layout()
-            
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-            buf.seek(0)
-            plt.close(fig)
-            
-            return buf.getvalue()
+            with matplotlib.style.context(CHART_STYLE):
+                fig = Figure(figsize=figsize)
+                axes = np.atleast_1d(fig.subplots(*layout)).ravel()
+                for ax, painter in zip(axes, painters):
+                    painter(ax, series)
+                return ChartGenerator._to_png(fig)
         except Exception as e:
-            logger.error(f"Ошибка при создании графика Disk: {e}")
+            logger.error(f"Ошибка при создании графика {name}: {e}")
             return None
     
     @staticmethod
-    def create_network_chart(metrics: List[Metric]) -> Optional[bytes]:
+    def create_cpu_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание графика CPU"""
+        return ChartGenerator._render(
+            series, 'CPU', (12, 8), (2, 1),
+            (ChartGenerator._draw_cpu_usage, ChartGenerator._draw_cpu_load)
+        )
+    
+    @staticmethod
+    def create_memory_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание графика памяти"""
+        return ChartGenerator._render(series, 'RAM', (12, 6), (1, 1), (ChartGenerator._draw_memory,))
+    
+    @staticmethod
+    def create_disk_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание графика диска"""
+        return ChartGenerator._render(series, 'Disk', (12, 6), (1, 1), (ChartGenerator._draw_disk,))
+    
+    @staticmethod
+    def create_network_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
         """Создание графика сети"""
-        if not metrics:
-            return None
-        
-        try:
-            fig, ax = plt.subplots(figsize=(12, 6))
-            
-            timestamps = [m.timestamp for m in metrics]
-            
-            # Вычисляем разницу для получения скорости
-            net_sent_mb = []
-            net_recv_mb = []
-            
-            for i in range(1, len(metrics)):
-                if metrics[i].net_sent and metrics[i-1].net_sent:
-                    sent_diff = (metrics[i].net_sent - metrics[i-1].net_sent) / (1024 * 1024)  # MB
-                    net_sent_mb.append(sent_diff if sent_diff >= 0 else 0)
-                
-                if metrics[i].net_recv and metrics[i-1].net_recv:
-                    recv_diff = (metrics[i].net_recv - metrics[i-1].net_recv) / (1024 * 1024)  # MB
-                    net_recv_mb.append(recv_diff if recv_diff >= 0 else 0)
-            
-            if net_sent_mb:
-                ax.plot(timestamps[1:len(net_sent_mb)+1], net_sent_mb, 
-                       label='Отправлено', color='#e74c3c', linewidth=2, marker='^', markersize=3)
-            if net_recv_mb:
-                ax.plot(timestamps[1:len(net_recv_mb)+1], net_recv_mb, 
-                       label='Получено', color='#3498db', linewidth=2, marker='v', markersize=3)
-            
-            ChartGenerator._setup_common_style(ax, '🌐 Network Traffic', 'Скорость (MB/период)')
-            ax.legend(loc='upper left')
-            
-            plt.tight_layout()
-            
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-            buf.seek(0)
-            plt.close(fig)
-            
-            return buf.getvalue()
-        except Exception as e:
-            logger.error(f"Ошибка при создании графика Network: {e}")
-            return None
+        return ChartGenerator._render(series, 'Network', (12, 6), (1, 1), (ChartGenerator._draw_network,))
+    
+    @staticmethod
+    def create_dashboard_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание сводного графика: CPU, RAM, Disk и Network на одном изображении"""
+        return ChartGenerator._render(
+            series, 'Dashboard', (16, 10), (2, 2),
+            (ChartGenerator._draw_cpu_usage, ChartGenerator._draw_memory,
+             ChartGenerator._draw_disk, ChartGenerator._draw_network)
+        )
+    
+    @staticmethod
+    def create_cores_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание графика загрузки каждого ядра CPU"""
+        return ChartGenerator._render(series, 'Cores', (12, 6), (1, 1), (
+            lambda ax, data: ChartGenerator._draw_detail_percent(ax, data, 'cpu_core_percent', '🖥 Загрузка ядер CPU'),
+        ))
+    
+    @staticmethod
+    def create_mounts_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание графика заполнения разделов"""
+        return ChartGenerator._render(series, 'Mounts', (12, 6), (1, 1), (
+            lambda ax, data: ChartGenerator._draw_detail_percent(ax, data, 'mount_percent', '💾 Заполнение разделов'),
+        ))
+    
+    @staticmethod
+    def create_interfaces_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание графика трафика по сетевым интерфейсам"""
+        return ChartGenerator._render(series, 'Interfaces', (12, 8), (2, 1), (
+            lambda ax, data: ChartGenerator._draw_detail_rate(ax, data, 'net_iface_sent_rate', '🌐 Отправлено'),
+            lambda ax, data: ChartGenerator._draw_detail_rate(ax, data, 'net_iface_recv_rate', '🌐 Получено'),
+        ))
+    
+    @staticmethod
+    def create_diskio_chart(series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Создание графика чтения и записи по дискам"""
+        return ChartGenerator._render(series, 'Disk I/O', (12, 8), (2, 1), (
+            lambda ax, data: ChartGenerator._draw_detail_rate(ax, data, 'disk_read_rate', '💽 Чтение'),
+            lambda ax, data: ChartGenerator._draw_detail_rate(ax, data, 'disk_write_rate', '💽 Запись'),
+        ))
     
     @classmethod
-    def create_all_charts(cls, metrics: List[Metric]) -> dict:
+    def create_all_charts(cls, series: Dict[str, np.ndarray]) -> dict:
         """Создание всех графиков"""
         return {
-            'cpu': cls.create_cpu_chart(metrics),
-            'memory': cls.create_memory_chart(metrics),
-            'disk': cls.create_disk_chart(metrics),
-            'network': cls.create_network_chart(metrics),
+            'cpu': cls.create_cpu_chart(series),
+            'memory': cls.create_memory_chart(series),
+            'disk': cls.create_disk_chart(series),
+            'network': cls.create_network_chart(series),
         }
-
@@ -0,0 +1,85 @@
+"""
+Прореживание временных рядов до разрешения графика
+"""
+from typing import Tuple
+import numpy as np
+
+
+def _as_float(x: np.ndarray) -> np.ndarray:
+    """Ось времени в виде float (datetime64 -> число тиков)"""
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.view(np.int64).astype(np.float64)
+    return x.astype(np.float64, copy=False)
+
+
+def minmax_decimate(x: np.ndarray, y: np.ndarray, n_out: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Прореживание min/max по корзинам
+
+    Ряд делится на n_out // 2 равных корзин, из каждой берутся точки
+    минимума и максимума в исходном порядке, поэтому пики сохраняются.
+    Корзины целиком из NaN дают NaN (разрыв линии).
+    """
+    n = len(y)
+    buckets = max(1, n_out // 2)
+    if n <= n_out or n < 2 * buckets:
+        return x, y
+    
+    size = -(-n // buckets)  # деление с округлением вверх
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    rows = padded.reshape(buckets, size)
+    
+    nan = np.isnan(rows)
+    low = np.where(nan, np.inf, rows).argmin(axis=1)
+    high = np.where(nan, -np.inf, rows).argmax(axis=1)
+    
+    offsets = np.arange(buckets) * size
+    indices = np.sort(np.stack([low, high], axis=1), axis=1) + offsets[:, None]
+    indices = np.minimum(indices.ravel(), n - 1)
+    return x[indices], y[indices]
+
+
+def lttb_decimate(x: np.ndarray, y: np.ndarray, n_out: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Прореживание Largest-Triangle-Three-Buckets
+
+    Сохраняет визуальную форму ряда лучше равномерной выборки. Ряды с NaN
+    прореживаются через minmax_decimate, т.к. площадь треугольника для них
+    не определена.
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return x, y
+    if np.isnan(y).any():
+        return minmax_decimate(x, y, n_out)
+    
+    xf = _as_float(x)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Среднее следующей корзины - третья вершина треугольника
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xf[end:next_end].mean() if next_end > end else xf[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        
+        px, py = xf[previous], y[previous]
+        areas = np.abs((px - avg_x) * (y[start:end] - py) - (px - xf[start:end]) * (avg_y - py))
+        previous = start + int(areas.argmax())
+        indices[i + 1] = previous
+    
+    return x[indices], y[indices]
+
+
+def decimate(x: np.ndarray, y: np.ndarray, n_out: int, method: str = 'minmax') -> Tuple[np.ndarray, np.ndarray]:
+    """Прореживание ряда выбранным методом ('minmax', 'lttb' или 'none')"""
+    if method == 'lttb':
+        return lttb_decimate(x, y, n_out)
+    if method == 'minmax':
+        return minmax_decimate(x, y, n_out)
+    return x, y
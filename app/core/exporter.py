@@ -0,0 +1,214 @@
+"""
+Экспорт метрик в формате Prometheus (GET /metrics на HTTP-сервере бота)
+
+Ответ строится только из состояния в памяти: снимок последнего сэмпла,
+последние сэмплы агентов и счётчики компонентов бота. psutil и БД при
+запросе не вызываются, готовый текст (и его gzip-версия, которую
+запрашивает Prometheus) кэшируется на EXPORTER_CACHE_TTL секунд, поэтому
+частый scrape почти ничего не стоит.
+"""
+import os
+import gzip
+import hmac
+import math
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+from aiohttp import web
+
+from app.core.snapshot import snapshot_store
+from app.core.hosts import LOCAL_HOST
+from app.core.ingest import host_registry
+from app.core.cache import chart_cache
+from app.core.writer import metric_writer
+from app.core.render import chart_renderer
+from app.core.alerts import alert_engine
+from app.core.reports import report_scheduler
+from app.core.monitor import network_rates
+from app.core.db import get_pool_stats
+from app.utils.helpers import get_env_float
+
+logger = logging.getLogger(__name__)
+
+# Токен для Authorization: Bearer (пусто - без авторизации)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Время жизни готового ответа (секунды)
+EXPORTER_CACHE_TTL = get_env_float('EXPORTER_CACHE_TTL', 1.0)
+
+PREFIX = 'servermon'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Поля сэмпла хоста: (поле, имя метрики, тип, описание)
+HOST_METRICS = (
+    ('cpu_percent', 'cpu_usage_percent', 'gauge', 'Загрузка CPU, %'),
+    ('cpu_load_1m', 'load1', 'gauge', 'Load average за 1 минуту'),
+    ('cpu_load_5m', 'load5', 'gauge', 'Load average за 5 минут'),
+    ('cpu_load_15m', 'load15', 'gauge', 'Load average за 15 минут'),
+    ('cpu_temp', 'cpu_temperature_celsius', 'gauge', 'Температура CPU'),
+    ('ram_used', 'memory_used_bytes', 'gauge', 'Занято RAM'),
+    ('ram_total', 'memory_total_bytes', 'gauge', 'Всего RAM'),
+    ('ram_percent', 'memory_usage_percent', 'gauge', 'Использование RAM, %'),
+    ('disk_used', 'disk_used_bytes', 'gauge', 'Занято на диске'),
+    ('disk_total', 'disk_total_bytes', 'gauge', 'Размер диска'),
+    ('disk_percent', 'disk_usage_percent', 'gauge', 'Заполнение диска, %'),
+    ('net_sent', 'network_sent_bytes_total', 'counter', 'Отправлено байт с загрузки системы'),
+    ('net_recv', 'network_received_bytes_total', 'counter', 'Получено байт с загрузки системы'),
+    ('net_sent_rate', 'network_sent_bytes_per_second', 'gauge', 'Скорость отправки'),
+    ('net_recv_rate', 'network_received_bytes_per_second', 'gauge', 'Скорость приёма'),
+    ('process_count', 'processes', 'gauge', 'Количество процессов'),
+)
+
+# Время запуска процесса бота (unix time)
+_STARTED_AT = time.time()
+
+
+def _escape(value: str) -> str:
+    """Экранирование значения метки"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = float(value)
+    if math.isnan(value):
+        return None
+    return repr(value) if not value.is_integer() else str(int(value))
+
+
+class MetricsExporter:
+    """Построение текста в формате Prometheus с кэшированием на ttl секунд"""
+
+    def __init__(self, ttl: float = 1.0):
+        self.ttl = ttl
+        self._body: Optional[bytes] = None
+        self._gzipped: Optional[bytes] = None
+        self._rendered_at = 0.0
+        self.scrapes = 0
+        self.renders = 0
+
+    def _family(self, lines: List[str], name: str, kind: str, help_text: str,
+                samples: List[Tuple[Dict[str, str], object]]):
+        """Семейство метрик: HELP, TYPE и значения (пропуски не выводятся)"""
+        rows = []
+        for labels, value in samples:
+            formatted = _format_value(value)
+            if formatted is None:
+                continue
+            label_text = ','.join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+            rows.append(f'{PREFIX}_{name}{{{label_text}}} {formatted}' if label_text
+                        else f'{PREFIX}_{name} {formatted}')
+        if rows:
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+            lines.extend(rows)
+
+    def _host_samples(self, now: float) -> List[Tuple[str, Dict, float, bool]]:
+        """(хост, сэмпл, возраст сэмпла, онлайн) для локального сервера и агентов"""
+        hosts = []
+        snapshot = snapshot_store.peek()
+        if snapshot is not None:
+            hosts.append((LOCAL_HOST, snapshot, snapshot_store.age, True))
+        for host in host_registry.hosts.values():
+            if host.last_sample is not None:
+                hosts.append((host.name, host.last_sample, now - host.last_seen, host_registry.is_online(host, now)))
+        return hosts
+
+    def render(self) -> bytes:
+        """Текст ответа /metrics"""
+        lines: List[str] = []
+        now = time.time()
+
+        hosts = self._host_samples(now)
+        for field, name, kind, help_text in HOST_METRICS:
+            self._family(lines, name, kind, help_text,
+                         [({'host': host}, sample.get(field)) for host, sample, _, _ in hosts])
+        self._family(lines, 'host_up', 'gauge', 'Хост присылает метрики (1) или молчит (0)',
+                     [({'host': host}, int(online)) for host, _, _, online in hosts])
+        self._family(lines, 'sample_age_seconds', 'gauge', 'Возраст последнего сэмпла хоста',
+                     [({'host': host}, age) for host, _, age, _ in hosts])
+
+        # Счётчики компонентов бота
+        cache = chart_cache.stats()
+        pool = get_pool_stats()
+        counters = (
+            ('writer_rows_written_total', 'counter', 'Записано строк метрик', metric_writer.rows_written),
+            ('writer_flushes_total', 'counter', 'Пакетных записей в БД', metric_writer.flushes),
+            ('writer_errors_total', 'counter', 'Ошибок пакетной записи', metric_writer.errors),
+            ('writer_pending', 'gauge', 'Строк в очереди записи', metric_writer.pending),
+            ('chart_cache_hits_total', 'counter', 'Попаданий в кэш графиков', cache['hits']),
+            ('chart_cache_misses_total', 'counter', 'Промахов кэша графиков', cache['misses']),
+            ('chart_cache_evictions_total', 'counter', 'Вытеснений из кэша графиков', cache['evictions']),
+            ('chart_cache_bytes', 'gauge', 'Размер кэша графиков', cache['bytes']),
+            ('chart_cache_file_id_hits_total', 'counter', 'Отправок графиков по file_id', cache['file_id_hits']),
+            ('chart_render_in_flight', 'gauge', 'Графиков в отрисовке', chart_renderer.in_flight),
+            ('chart_render_rejected_total', 'counter', 'Отказов при заполненной очереди отрисовки', chart_renderer.rejected),
+            ('chart_render_pool_restarts_total', 'counter', 'Пересозданий пула отрисовки после падения процесса', chart_renderer.restarts),
+            ('ingest_frames_total', 'counter', 'Принято пакетов от агентов', host_registry.frames),
+            ('ingest_rejected_total', 'counter', 'Отклонено пакетов от агентов', host_registry.rejected),
+            ('ingest_hosts', 'gauge', 'Хостов с агентами', len(host_registry.hosts)),
+            ('alerts_firing', 'gauge', 'Активных алертов (пользователь, правило)', alert_engine.firing_count()),
+            ('reports_sent_total', 'counter', 'Отправлено автоотчётов', report_scheduler.reports_sent),
+            ('counter_resets_total', 'counter', 'Сбросов счётчиков сети', network_rates.resets),
+            ('db_pool_checked_out', 'gauge', 'Занятых соединений с БД', pool['checked_out']),
+            ('db_pool_waiting', 'gauge', 'Запросов соединения с БД в ожидании', pool['waiting']),
+            ('db_pool_slow_checkouts_total', 'counter', 'Медленных получений соединения с БД', pool['slow_checkouts']),
+            ('db_pool_checkout_wait_seconds_total', 'counter', 'Суммарное время получения соединений с БД',
+             pool['checkout_wait_ms_total'] / 1000),
+            ('db_pool_checkouts_total', 'counter', 'Выдач соединений из пула', pool['checkouts']),
+            ('exporter_scrapes_total', 'counter', 'Запросов /metrics', self.scrapes),
+            ('start_time_seconds', 'gauge', 'Время запуска бота (unix time)', _STARTED_AT),
+        )
+        for name, kind, help_text, value in counters:
+            self._family(lines, name, kind, help_text, [({}, value)])
+
+        lines.append('')
+        self.renders += 1
+        return '\n'.join(lines).encode('utf-8')
+
+    def get(self, compressed: bool = False) -> bytes:
+        """Ответ из кэша или новый, если кэш старше ttl (compressed - gzip)"""
+        self.scrapes += 1
+        monotonic = time.monotonic()
+        if self._body is None or monotonic - self._rendered_at >= self.ttl:
+            self._body = self.render()
+            self._gzipped = None
+            self._rendered_at = monotonic
+        if not compressed:
+            return self._body
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self._body, compresslevel=1)
+        return self._gzipped
+
+
+# Глобальный экспортёр
+metrics_exporter = MetricsExporter(ttl=EXPORTER_CACHE_TTL)
+
+
+def _authorized(request: web.Request) -> bool:
+    if not METRICS_TOKEN:
+        return True
+    header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(header, f'Bearer {METRICS_TOKEN}')
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Ответ на scrape Prometheus"""
+    if not _authorized(request):
+        return web.Response(status=401)
+    compressed = 'gzip' in request.headers.get('Accept-Encoding', '')
+    try:
+        body = metrics_exporter.get(compressed)
+    except Exception as e:
+        logger.error(f"Ошибка при формировании /metrics: {e}")
+        return web.Response(status=500)
+    headers = {'Content-Type': CONTENT_TYPE}
+    if compressed:
+        headers['Content-Encoding'] = 'gzip'
+    return web.Response(body=body, headers=headers)
+
+
+def setup_exporter(app: web.Application):
+    """Регистрация маршрута /metrics"""
+    app.router.add_get('/metrics', handle_metrics)
@@ -0,0 +1,160 @@
+"""
+Графики за период: выборка рядов из буфера или БД, общий кэш и отрисовка
+
+Модуль работает в процессе бота. render.py остаётся лёгким, потому что его
+импортирует каждый рабочий процесс пула отрисовки.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+from app.core.buffer import ring_buffer
+from app.core.cache import chart_cache
+from app.core.db import async_session_maker
+from app.core.monitor import SystemMonitor
+from app.core.series import get_detail_series
+from app.core.hosts import host_directory
+from app.core.ingest import host_registry
+from app.core.render import chart_renderer, CHART_FIELDS, PANEL_CHARTS, DETAIL_CHARTS
+
+logger = logging.getLogger(__name__)
+
+# Графики, которые сейчас строятся: ключ кэша -> future с PNG. Одновременные
+# запросы одного графика ждут первый запрос, а не читают БД и рисуют заново.
+_in_flight: Dict[Tuple, asyncio.Future] = {}
+
+
+def _claim(key: Tuple) -> Optional[asyncio.Future]:
+    """Future уже идущей отрисовки или None, если отрисовка закреплена за вызывающим"""
+    future = _in_flight.get(key)
+    if future is None:
+        _in_flight[key] = asyncio.get_running_loop().create_future()
+    return future
+
+
+def _release(key: Tuple, data: Optional[bytes] = None, error: Optional[BaseException] = None):
+    """Передача результата (или ошибки) ожидающим запросам"""
+    future = _in_flight.pop(key, None)
+    if future is None or future.done():
+        return
+    if error is None:
+        future.set_result(data)
+    elif isinstance(error, asyncio.CancelledError):
+        future.cancel()
+    else:
+        future.set_exception(error)
+        # Без ожидающих ошибка не должна попадать в лог как необработанная
+        future.exception()
+
+
+async def load_series(
+    hours: int,
+    fields: Sequence[str],
+    host_id: Optional[int] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Ряды хоста за период: из буфера в полном разрешении, если он покрывает
+    период, иначе из БД (host_id=None - локальный сервер)
+    """
+    if host_directory.is_local(host_id):
+        buffer = ring_buffer
+    else:
+        remote = host_registry.get(host_directory.get_name(host_id))
+        buffer = remote.buffer if remote else None
+    if buffer is not None and buffer.covers(hours * 3600):
+        return buffer.series(hours * 3600, fields)
+    async with async_session_maker() as session:
+        return await SystemMonitor.get_series(session, fields, hours=hours, host_id=host_id)
+
+
+async def get_period_charts(
+    hours: int,
+    chart_types: Iterable[str] = PANEL_CHARTS,
+    bucket: Optional[int] = None,
+    host_id: Optional[int] = None
+) -> Dict[str, Optional[bytes]]:
+    """
+    Графики хоста за последние hours часов через общий кэш
+
+    Из БД читаются и отрисовываются только графики, которых нет в кэше
+    для интервала времени bucket (по умолчанию - текущего). Ключ графика
+    в кэше: chart_cache.make_key(тип, hours, bucket, host_id). Если такой
+    график уже строится для другого запроса, результат берётся у него.
+    """
+    chart_types = list(chart_types)
+    if bucket is None:
+        bucket = chart_cache.current_bucket()
+    charts = {}
+    missing: List[str] = []
+    waiting: Dict[str, asyncio.Future] = {}
+    for name in chart_types:
+        key = chart_cache.make_key(name, hours, bucket, host_id)
+        data = chart_cache.get(key)
+        if data is not None:
+            charts[name] = data
+            continue
+        future = _claim(key)
+        if future is None:
+            missing.append(name)
+        else:
+            waiting[name] = future
+    
+    if missing:
+        rendered = {}
+        try:
+            fields = sorted({field for name in missing for field in CHART_FIELDS[name]})
+            series = await load_series(hours, fields, host_id)
+            if len(series['timestamp']):
+                rendered = await chart_renderer.render_all(series, missing)
+        except BaseException as e:
+            for name in missing:
+                _release(chart_cache.make_key(name, hours, bucket, host_id), error=e)
+            raise
+        for name in missing:
+            key = chart_cache.make_key(name, hours, bucket, host_id)
+            data = rendered.get(name)
+            if data is not None:
+                chart_cache.put(key, data)
+                charts[name] = data
+            _release(key, data)
+    
+    # shield: отмена одного ожидающего не отменяет общую отрисовку
+    for name, future in waiting.items():
+        charts[name] = await asyncio.shield(future)
+    
+    return {name: charts.get(name) for name in chart_types}
+
+
+async def get_detail_chart(
+    chart_type: str,
+    hours: int,
+    bucket: Optional[int] = None,
+    host_id: Optional[int] = None
+) -> Optional[bytes]:
+    """
+    График детальных метрик (DETAIL_CHARTS) через общий кэш
+
+    Из series_points читаются только ряды, нужные графику.
+    """
+    if bucket is None:
+        bucket = chart_cache.current_bucket()
+    key = chart_cache.make_key(chart_type, hours, bucket, host_id)
+    data = chart_cache.get(key)
+    if data is not None:
+        return data
+    future = _claim(key)
+    if future is not None:
+        return await asyncio.shield(future)
+    try:
+        async with async_session_maker() as session:
+            series = await get_detail_series(session, DETAIL_CHARTS[chart_type], hours=hours, host_id=host_id)
+        if len(series) > 1:
+            data = await chart_renderer.render(chart_type, series)
+            if data is not None:
+                chart_cache.put(key, data)
+    except BaseException as e:
+        _release(key, error=e)
+        raise
+    _release(key, data)
+    return data
@@ -0,0 +1,115 @@
+"""
+Справочник хостов: локальный сервер бота и серверы с агентами
+"""
+import os
+import socket
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy import select, text, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.models.metrics import Host, Metric, MetricRollup5m, MetricRollup1h
+
+logger = logging.getLogger(__name__)
+
+# Имя сервера, на котором работает бот
+LOCAL_HOST = os.getenv('HOST_NAME') or socket.gethostname()
+
+# Индекс сырых метрик по одному timestamp, его заменил (host_id, timestamp)
+_LEGACY_INDEX = 'ix_metrics_timestamp'
+
+
+class HostDirectory:
+    """
+    Кэш таблицы hosts: имя <-> id
+
+    Загружается при старте (load), новые хосты добавляются при первом
+    обращении (resolve), дальше запросы к БД не нужны.
+    """
+
+    def __init__(self, local_name: str):
+        self.local_name = local_name
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+
+    @property
+    def local_id(self) -> Optional[int]:
+        return self._ids.get(self.local_name)
+
+    def _remember(self, name: str, host_id: int):
+        self._ids[name] = host_id
+        self._names[host_id] = name
+
+    def get_id(self, name: str) -> Optional[int]:
+        """id хоста из кэша"""
+        return self._ids.get(name)
+
+    def get_name(self, host_id: Optional[int]) -> str:
+        """Имя хоста по id (None - локальный)"""
+        if host_id is None:
+            return self.local_name
+        return self._names.get(host_id, str(host_id))
+
+    def is_local(self, host_id: Optional[int]) -> bool:
+        return host_id is None or host_id == self.local_id
+
+    def names(self) -> List[str]:
+        return sorted(self._ids)
+
+    async def resolve(self, session: AsyncSession, name: str) -> int:
+        """id хоста; новый хост добавляется в таблицу (коммит - за вызывающим)"""
+        host_id = self._ids.get(name)
+        if host_id is None:
+            await session.execute(
+                pg_insert(Host).values(name=name).on_conflict_do_nothing(index_elements=['name'])
+            )
+            host_id = await session.scalar(select(Host.id).where(Host.name == name))
+            self._remember(name, host_id)
+        return host_id
+
+    async def load(self, conn: AsyncConnection):
+        """Загрузка всех хостов"""
+        result = await conn.execute(select(Host.name, Host.id))
+        for name, host_id in result.all():
+            self._remember(name, host_id)
+
+
+# Глобальный справочник хостов
+host_directory = HostDirectory(LOCAL_HOST)
+
+
+def host_filter(model, host_id: Optional[int] = None):
+    """Условие на колонку host_id модели (None - локальный сервер)"""
+    if host_id is None:
+        host_id = host_directory.local_id
+    if host_id is None:
+        # Справочник хостов ещё не загружен (БД не инициализирована)
+        return true()
+    return model.host_id == host_id
+
+
+async def migrate_hosts(conn: AsyncConnection):
+    """
+    Регистрация локального хоста и перенос данных без host_id
+
+    Записи, созданные до появления колонки host_id, принадлежат локальному
+    серверу; после переноса колонка становится NOT NULL. Старый индекс
+    metrics по timestamp удаляется - его заменяет (host_id, timestamp).
+    """
+    await conn.execute(
+        pg_insert(Host).values(name=LOCAL_HOST).on_conflict_do_nothing(index_elements=['name'])
+    )
+    await host_directory.load(conn)
+    local_id = host_directory.local_id
+    
+    for model in (Metric, MetricRollup5m, MetricRollup1h):
+        table = model.__table__
+        result = await conn.execute(
+            table.update().where(table.c.host_id.is_(None)).values(host_id=local_id)
+        )
+        if result.rowcount:
+            logger.info(f"Таблица {table.name}: {result.rowcount} записей отнесены к хосту {LOCAL_HOST}")
+        # Колонка добавлена в существующую таблицу как NULL (см. _add_missing_columns)
+        await conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN host_id SET NOT NULL"))
+    await conn.execute(text(f"DROP INDEX IF EXISTS {_LEGACY_INDEX}"))
@@ -0,0 +1,179 @@
+"""
+Приём метрик от агентов (POST /ingest)
+
+Обработчик только распаковывает пакет и дописывает сэмплы в кольцевой
+буфер хоста - без обращений к БД и без блокирующих вызовов, поэтому
+сотни агентов с интервалом 10 секунд обслуживаются за доли миллисекунды
+на запрос.
+"""
+import os
+import hmac
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+from aiohttp import web
+
+from app.agent.protocol import FrameError, decode_frame
+from app.core.buffer import MetricRingBuffer
+from app.utils.helpers import get_env_float, get_env_int
+
+logger = logging.getLogger(__name__)
+
+# Токен агентов (пустой - приём без авторизации)
+INGEST_TOKEN = os.getenv('INGEST_TOKEN', '')
+
+# Ожидаемый интервал замеров агентов, замеров в пакете и длина истории хоста в памяти
+AGENT_INTERVAL = get_env_float('AGENT_INTERVAL', 10.0)
+AGENT_BATCH_SIZE = get_env_int('AGENT_BATCH_SIZE', 3)
+HOST_WINDOW = get_env_int('HIRES_WINDOW', 3600)
+
+# Максимальное число хостов (защита от неограниченного роста)
+MAX_HOSTS = get_env_int('INGEST_MAX_HOSTS', 1000)
+
+# Хост считается недоступным, если молчит дольше стольких периодов отправки
+OFFLINE_PERIODS = 3
+
+
+class RemoteHost:
+    """Состояние удалённого хоста: буфер сэмплов и последний сэмпл"""
+
+    def __init__(self, name: str, interval: float, window: float):
+        self.name = name
+        self.buffer = MetricRingBuffer(capacity=max(1, int(window / interval)), interval=interval)
+        self.last_sample: Optional[Dict] = None
+        self.last_timestamp = 0.0
+        self.last_seen = 0.0
+        # Наблюдаемый период отправки пакетов (сглаженный), None - пока неизвестен
+        self.push_period: Optional[float] = None
+        self.samples = 0
+        # Граница последней агрегации в БД (время агента)
+        self.rolled_up_until = 0.0
+
+
+class HostRegistry:
+    """Удалённые хосты, от которых приходят метрики"""
+
+    def __init__(self, interval: float = 10.0, window: float = 3600, max_hosts: int = 1000, batch_size: int = 1):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.window = window
+        self.max_hosts = max_hosts
+        self.hosts: Dict[str, RemoteHost] = {}
+        self.frames = 0
+        self.rejected = 0
+
+    def ingest(self, name: str, samples: List[Tuple[float, Dict]]) -> int:
+        """
+        Запись сэмплов хоста, возвращает число принятых
+
+        Сэмплы не новее последнего принятого отбрасываются: повторная
+        отправка пакета агентом после обрыва связи не создаёт дублей.
+        """
+        host = self.hosts.get(name)
+        if host is None:
+            if len(self.hosts) >= self.max_hosts:
+                raise ValueError(f"Превышено число хостов ({self.max_hosts})")
+            host = self.hosts[name] = RemoteHost(name, self.interval, self.window)
+            logger.info(f"Новый хост: {name}")
+        
+        accepted = 0
+        for timestamp, metrics in sorted(samples, key=lambda sample: sample[0]):
+            if timestamp <= host.last_timestamp:
+                continue
+            host.buffer.append(timestamp, metrics)
+            host.last_timestamp = timestamp
+            host.last_sample = metrics
+            accepted += 1
+        host.samples += accepted
+        now = time.time()
+        if host.last_seen:
+            self._observe_period(host, now - host.last_seen)
+        host.last_seen = now
+        self.frames += 1
+        return accepted
+
+    def drain_rows(self) -> List[Tuple[str, Dict]]:
+        """
+        Агрегация новых сэмплов каждого хоста в одну запись Metric
+
+        Границы интервала берутся по часам агента, поэтому расхождение
+        часов с сервером бота не приводит к потере сэмплов.
+        """
+        rows = []
+        for host in list(self.hosts.values()):
+            if host.last_timestamp <= host.rolled_up_until:
+                continue
+            row = host.buffer.aggregate(since=host.rolled_up_until, until=host.last_timestamp)
+            host.rolled_up_until = host.last_timestamp
+            if row is not None:
+                rows.append((host.name, row))
+        return rows
+
+    def get(self, name: str) -> Optional[RemoteHost]:
+        return self.hosts.get(name)
+
+    def _observe_period(self, host: RemoteHost, gap: float):
+        """
+        Обновление периода отправки хоста по паузе между пакетами
+
+        Паузы, после которых хост уже считался недоступным, период не
+        меняют. Первая пауза принимается, если она короче окна истории:
+        агент может быть настроен иначе, чем ожидает сервер.
+        """
+        limit = self.window if host.push_period is None else self.period(host) * OFFLINE_PERIODS
+        if gap <= 0 or gap >= limit:
+            return
+        if host.push_period is None:
+            host.push_period = gap
+        else:
+            host.push_period += (gap - host.push_period) * 0.2
+
+    def period(self, host: RemoteHost) -> float:
+        """Период отправки пакетов хостом: наблюдаемый или interval * batch_size"""
+        if host.push_period is None:
+            return self.interval * self.batch_size
+        return max(host.push_period, self.interval)
+
+    def is_online(self, host: RemoteHost, now: Optional[float] = None) -> bool:
+        """Хост присылал пакет в последние OFFLINE_PERIODS периодов отправки"""
+        return (now or time.time()) - host.last_seen < self.period(host) * OFFLINE_PERIODS
+
+
+# Глобальный реестр удалённых хостов
+host_registry = HostRegistry(
+    interval=AGENT_INTERVAL,
+    window=HOST_WINDOW,
+    max_hosts=MAX_HOSTS,
+    batch_size=AGENT_BATCH_SIZE,
+)
+
+
+def _authorized(request: web.Request) -> bool:
+    if not INGEST_TOKEN:
+        return True
+    header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(header, f'Bearer {INGEST_TOKEN}')
+
+
+async def handle_ingest(request: web.Request) -> web.Response:
+    """Приём пакета сэмплов от агента"""
+    if not _authorized(request):
+        host_registry.rejected += 1
+        return web.Response(status=401)
+    
+    try:
+        host, samples = decode_frame(await request.read())
+        accepted = host_registry.ingest(host, samples)
+    except (FrameError, ValueError) as e:
+        host_registry.rejected += 1
+        logger.warning(f"Отклонён пакет от {request.remote}: {e}")
+        return web.Response(status=400, text=str(e))
+    
+    return web.json_response({'accepted': accepted})
+
+
+def setup_ingest(app: web.Application):
+    """Регистрация маршрута приёма метрик"""
+    if not INGEST_TOKEN:
+        logger.warning("INGEST_TOKEN не задан: метрики принимаются без авторизации")
+    app.router.add_post('/ingest', handle_ingest)
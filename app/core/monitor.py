@@ -1,17 +1,272 @@
 """
 Модуль для сбора метрик системы с помощью psutil
 """
+import os
+import heapq
 import psutil
+import numpy as np
 import logging
+import time
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from sqlalchemy import select
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import and_, case, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.metrics import Metric
+from app.core.rollups import choose_model
+from app.core.hosts import host_directory, host_filter
+from app.utils.helpers import get_env_float, get_env_int
 
 logger = logging.getLogger(__name__)
 
+# Интервал записи сырых метрик в БД (секунды)
+MONITOR_INTERVAL = get_env_int('MONITOR_INTERVAL', 60)
+
+# Детальные метрики: файловые системы без реального места на диске и
+# префиксы интерфейсов/устройств, которые не собираются (loopback,
+# виртуальные интерфейсы контейнеров, loop-устройства)
+DETAIL_SKIP_FSTYPES = ('squashfs', 'overlay', 'tmpfs', 'devtmpfs')
+DETAIL_SKIP_INTERFACES = tuple(
+    os.getenv('DETAIL_SKIP_INTERFACES', 'lo,veth,docker,br-').split(',')
+)
+DETAIL_SKIP_DISKS = ('loop', 'ram', 'zram')
+
+
+class MetricsSampler:
+    """
+    Фоновый сэмплер метрик
+
+    Работает в отдельном потоке и раз в interval секунд снимает загрузку CPU
+    через psutil.cpu_percent(interval=None), т.е. по разнице счётчиков между
+    тиками, а затем полный набор метрик, который передаётся подписчикам
+    (кольцевой буфер, снимок). Вызывающий код только читает готовые значения
+    и никогда не ждёт, поэтому event loop не блокируется.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._cpu_percent: Optional[float] = None
+        self._listeners: List[Callable[[float, Dict], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_listener(self, listener: Callable[[float, Dict], None]):
+        """Подписка на сэмплы: listener(timestamp, metrics)"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def start(self):
+        """Запуск фонового потока"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        # Первый вызов только запоминает счётчики, значение 0.0 бессмысленно
+        psutil.cpu_percent(interval=None)
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+        logger.info(f"Сэмплер метрик запущен (интервал {self.interval} сек)")
+
+    def stop(self):
+        """Остановка фонового потока"""
+        if not self.running:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=self.interval * 2)
+        self._thread = None
+        logger.info("Сэмплер метрик остановлен")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Один тик сэмплера"""
+        try:
+            self._cpu_percent = psutil.cpu_percent(interval=None)
+            timestamp = time.time()
+            metrics = SystemMonitor.collect_all_metrics()
+        except Exception as e:
+            logger.error(f"Ошибка в сэмплере метрик: {e}")
+            return
+        
+        for listener in self._listeners:
+            try:
+                listener(timestamp, metrics)
+            except Exception as e:
+                logger.error(f"Ошибка в подписчике сэмплера: {e}")
+
+    def get_cpu_percent(self) -> float:
+        """Последнее измеренное значение загрузки CPU (без ожидания)"""
+        if self._cpu_percent is None:
+            # Сэмплер ещё не успел сделать замер - берём дельту с прошлого вызова
+            return psutil.cpu_percent(interval=None)
+        return self._cpu_percent
+
+
+class ProcessTracker:
+    """
+    Таблица процессов, живущая между замерами
+
+    Объекты psutil.Process сохраняются между проходами, поэтому
+    cpu_percent(None) считается по разнице с предыдущим проходом, а не
+    равен 0.0, как у только что созданного объекта. Атрибуты читаются
+    внутри oneshot(), обе выборки (CPU и RAM) строятся за один проход через
+    heapq.nlargest, завершившиеся PID удаляются на каждом проходе.
+
+    Между вызовами drain() накапливаются пиковые значения процессов,
+    попавших в топ, - они записываются в историю вместе с метриками.
+    """
+
+    def __init__(self, interval: float = 5.0, limit: int = 5):
+        self.interval = interval
+        self.limit = limit
+        self._procs: Dict[int, psutil.Process] = {}
+        self._top: Tuple[List[Dict], List[Dict]] = ([], [])
+        self._sampled_at = 0.0
+        self._passes = 0
+        self._peaks: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+
+    def age(self) -> float:
+        """Секунд с последнего прохода"""
+        return time.monotonic() - self._sampled_at
+
+    def on_sample(self, timestamp: float, metrics: Dict):
+        """Подписчик сэмплера: проход не чаще, чем раз в interval секунд"""
+        if self.age() >= self.interval:
+            self.sample()
+
+    def sample(self):
+        """Один проход по процессам"""
+        with self._lock:
+            pids = set(psutil.pids())
+            
+            # Завершившиеся процессы
+            for pid in self._procs.keys() - pids:
+                del self._procs[pid]
+            
+            records = []
+            for pid in pids:
+                proc = self._procs.get(pid)
+                if proc is None:
+                    try:
+                        proc = self._procs[pid] = psutil.Process(pid)
+                    except (psutil.NoSuchProcess, psutil.AccessDenied):
+                        continue
+                try:
+                    with proc.oneshot():
+                        records.append({
+                            'pid': pid,
+                            'name': proc.name(),
+                            'cpu_percent': proc.cpu_percent(None),
+                            'memory_percent': proc.memory_percent(),
+                            'rss': proc.memory_info().rss,
+                        })
+                except psutil.NoSuchProcess:
+                    self._procs.pop(pid, None)
+                except (psutil.AccessDenied, psutil.ZombieProcess):
+                    pass
+            
+            self._top = (
+                heapq.nlargest(self.limit, records, key=lambda r: r['cpu_percent']),
+                heapq.nlargest(self.limit, records, key=lambda r: r['memory_percent']),
+            )
+            self._sampled_at = time.monotonic()
+            self._passes += 1
+            
+            if self._passes > 1:
+                for record in self._top[0] + self._top[1]:
+                    peak = self._peaks.get(record['pid'])
+                    if peak is None:
+                        self._peaks[record['pid']] = dict(record)
+                    else:
+                        for key in ('cpu_percent', 'memory_percent', 'rss'):
+                            peak[key] = max(peak[key], record[key])
+    
+    def drain(self) -> List[Dict]:
+        """Топ процессов по пиковым CPU и RAM с прошлого вызова"""
+        with self._lock:
+            peaks, self._peaks = list(self._peaks.values()), {}
+        top = {r['pid']: r for r in heapq.nlargest(self.limit, peaks, key=lambda r: r['cpu_percent'])}
+        for record in heapq.nlargest(self.limit, peaks, key=lambda r: r['memory_percent']):
+            top.setdefault(record['pid'], record)
+        return list(top.values())
+
+    def refresh(self):
+        """Проход, если данные устарели (сэмплер не запущен)"""
+        if self.age() < self.interval * 2:
+            return
+        self.sample()
+        if self._passes == 1:
+            # Первый проход только запоминает счётчики CPU
+            time.sleep(0.5)
+            self.sample()
+
+    def top(self, by: str = 'cpu', limit: Optional[int] = None) -> List[Dict]:
+        """Топ процессов последнего прохода: by='cpu' или 'memory'"""
+        top_cpu, top_mem = self._top
+        return (top_cpu if by == 'cpu' else top_mem)[:limit or self.limit]
+
+
+class RateTracker:
+    """
+    Скорость роста счётчиков (байт/с) на стороне сборщика
+
+    Для каждого счётчика хранится прошлое значение и время по монотонным
+    часам, скорость - разница значений, делённая на реально прошедшее
+    время, поэтому не зависит от интервала и пропусков замеров.
+
+    Любое уменьшение счётчика считается сбросом (перезагрузка,
+    переподключение интерфейса, переполнение) - скорость за этот замер не
+    считается, отсчёт начинается заново. Смена boot_time сбрасывает все
+    счётчики сразу.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._last: Dict = {}
+        self._boot_time: Optional[float] = None
+        self._lock = threading.Lock()
+        self.resets = 0
+
+    def update(self, counters: Dict, boot_time: Optional[float] = None) -> Dict:
+        """
+        Новые значения счётчиков, возвращает скорости для тех, у которых
+        есть прошлое значение (ключи - те же, что в counters)
+        """
+        now = self._clock()
+        with self._lock:
+            # boot_time в Linux целый, сдвиг больше секунды - перезагрузка
+            if boot_time is not None:
+                if self._boot_time is not None and abs(boot_time - self._boot_time) > 1:
+                    self._last = {}
+                    self.resets += 1
+                self._boot_time = boot_time
+            
+            rates = {}
+            last, self._last = self._last, {}
+            for key, value in counters.items():
+                if value is None:
+                    continue
+                self._last[key] = (now, value)
+                previous = last.get(key)
+                if previous is None:
+                    continue
+                elapsed = now - previous[0]
+                if elapsed <= 0:
+                    continue
+                delta = value - previous[1]
+                if delta < 0:
+                    self.resets += 1
+                    continue
+                rates[key] = delta / elapsed
+            return rates
+
 
 class SystemMonitor:
     """Класс для сбора и анализа системных метрик"""
@@ -21,7 +276,7 @@ class SystemMonitor:
         """Получение метрик CPU"""
         try:
             load_avg = psutil.getloadavg()
-            cpu_percent = psutil.cpu_percent(interval=1)
+            cpu_percent = metrics_sampler.get_cpu_percent()
             
             # Попытка получить температуру CPU
             cpu_temp = None
@@ -78,17 +333,108 @@ class SystemMonitor:
     
     @staticmethod
     def get_network_metrics() -> Dict:
-        """Получение метрик сети"""
+        """Получение метрик сети: счётчики байт и скорость (байт/с) с прошлого вызова"""
         try:
             net = psutil.net_io_counters()
-            return {
+            metrics = {
                 'net_sent': net.bytes_sent,
                 'net_recv': net.bytes_recv,
             }
+            metrics.update(network_rates.update(
+                {'net_sent_rate': net.bytes_sent, 'net_recv_rate': net.bytes_recv},
+                boot_time=SystemMonitor.get_boot_time(),
+            ))
+            return metrics
         except Exception as e:
             logger.error(f"Ошибка при получении Network метрик: {e}")
             return {}
     
+    # Первый вызов cpu_percent(percpu=True) только запоминает счётчики
+    _percpu_primed = False
+    
+    @classmethod
+    def get_cpu_core_metrics(cls) -> Dict[Tuple[str, str], float]:
+        """Загрузка каждого ядра за время с прошлого вызова"""
+        try:
+            values = psutil.cpu_percent(interval=None, percpu=True)
+            if not cls._percpu_primed:
+                cls._percpu_primed = True
+                return {}
+            return {('cpu_core_percent', str(core)): value for core, value in enumerate(values)}
+        except Exception as e:
+            logger.error(f"Ошибка при получении метрик ядер CPU: {e}")
+            return {}
+    
+    @staticmethod
+    def get_mount_metrics() -> Dict[Tuple[str, str], float]:
+        """Заполнение каждого смонтированного раздела"""
+        points = {}
+        try:
+            devices = set()
+            for partition in psutil.disk_partitions(all=False):
+                # bind-монтирования одного устройства считаются один раз
+                if partition.fstype in DETAIL_SKIP_FSTYPES or partition.device in devices:
+                    continue
+                devices.add(partition.device)
+                try:
+                    usage = psutil.disk_usage(partition.mountpoint)
+                except OSError:
+                    continue  # раздел недоступен (отключённый носитель, нет прав)
+                points[('mount_percent', partition.mountpoint)] = usage.percent
+        except Exception as e:
+            logger.error(f"Ошибка при получении метрик разделов: {e}")
+        return points
+    
+    @staticmethod
+    def get_interface_metrics() -> Dict[Tuple[str, str], float]:
+        """Счётчики байт каждого сетевого интерфейса"""
+        points = {}
+        try:
+            for nic, counters in psutil.net_io_counters(pernic=True).items():
+                if nic.startswith(DETAIL_SKIP_INTERFACES):
+                    continue
+                points[('net_iface_sent', nic)] = counters.bytes_sent
+                points[('net_iface_recv', nic)] = counters.bytes_recv
+        except Exception as e:
+            logger.error(f"Ошибка при получении метрик интерфейсов: {e}")
+        return points
+    
+    @staticmethod
+    def get_disk_io_metrics() -> Dict[Tuple[str, str], float]:
+        """Счётчики чтения и записи (байт) каждого блочного устройства"""
+        points = {}
+        try:
+            for disk, counters in (psutil.disk_io_counters(perdisk=True) or {}).items():
+                if disk.startswith(DETAIL_SKIP_DISKS):
+                    continue
+                points[('disk_read', disk)] = counters.read_bytes
+                points[('disk_write', disk)] = counters.write_bytes
+        except Exception as e:
+            logger.error(f"Ошибка при получении метрик Disk I/O: {e}")
+        return points
+    
+    @classmethod
+    def collect_detail_metrics(cls) -> Dict[Tuple[str, str], float]:
+        """
+        Детальные метрики: ядра CPU, разделы, интерфейсы и Disk I/O
+
+        Счётчики интерфейсов и дисков переводятся в скорость (байт/с):
+        ряды net_iface_sent_rate, net_iface_recv_rate, disk_read_rate,
+        disk_write_rate.
+
+        Returns:
+            {(метрика, метка): значение}, например {('mount_percent', '/var'): 71.2}
+        """
+        points = {}
+        points.update(cls.get_cpu_core_metrics())
+        points.update(cls.get_mount_metrics())
+        counters = {}
+        counters.update(cls.get_interface_metrics())
+        counters.update(cls.get_disk_io_metrics())
+        rates = detail_rates.update(counters, boot_time=cls.get_boot_time())
+        points.update({(f'{name}_rate', label): rate for (name, label), rate in rates.items()})
+        return points
+    
     @staticmethod
     def get_process_metrics() -> Dict:
         """Получение информации о процессах"""
@@ -102,11 +448,21 @@ class SystemMonitor:
             return {}
     
     @staticmethod
-    def get_uptime() -> timedelta:
+    def get_boot_time() -> Optional[float]:
+        """Время загрузки системы (unix timestamp)"""
+        try:
+            return psutil.boot_time()
+        except Exception as e:
+            logger.error(f"Ошибка при получении boot_time: {e}")
+            return None
+    
+    @staticmethod
+    def get_uptime(boot_time: Optional[float] = None) -> timedelta:
         """Получение времени работы системы"""
         try:
-            boot_time = datetime.fromtimestamp(psutil.boot_time())
-            return datetime.now() - boot_time
+            if boot_time is None:
+                boot_time = psutil.boot_time()
+            return datetime.now() - datetime.fromtimestamp(boot_time)
         except Exception as e:
             logger.error(f"Ошибка при получении uptime: {e}")
             return timedelta(0)
@@ -121,19 +477,8 @@ class SystemMonitor:
             limit: количество процессов
         """
         try:
-            processes = []
-            for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
-                try:
-                    pinfo = proc.info
-                    processes.append(pinfo)
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    pass
-            
-            # Сортируем
-            sort_key = 'cpu_percent' if by == 'cpu' else 'memory_percent'
-            processes.sort(key=lambda x: x.get(sort_key, 0), reverse=True)
-            
-            return processes[:limit]
+            process_tracker.refresh()
+            return process_tracker.top(by, limit)
         except Exception as e:
             logger.error(f"Ошибка при получении топ процессов: {e}")
             return []
@@ -151,10 +496,16 @@ class SystemMonitor:
         return metrics
     
     @classmethod
-    async def save_metrics(cls, session: AsyncSession) -> Optional[Metric]:
+    async def save_metrics(
+        cls,
+        session: AsyncSession,
+        metrics: Optional[Dict] = None
+    ) -> Optional[Metric]:
         """Сохранение метрик в базу данных"""
         try:
-            metrics = cls.collect_all_metrics()
+            if metrics is None:
+                metrics = cls.collect_all_metrics()
+            metrics.setdefault('host_id', host_directory.local_id)
             
             metric = Metric(**metrics)
             session.add(metric)
@@ -171,15 +522,24 @@ class SystemMonitor:
     @staticmethod
     async def get_metrics_for_period(
         session: AsyncSession,
-        hours: int = 24
+        hours: int = 24,
+        host_id: Optional[int] = None
     ) -> List[Metric]:
-        """Получение метрик за указанный период"""
+        """
+        Получение метрик хоста за указанный период
+        
+        Для длинных периодов читаются таблицы агрегатов (5 минут или 1 час),
+        см. choose_model - объём выборки остаётся порядка сотен строк.
+        host_id=None - локальный сервер.
+        """
         try:
             start_time = datetime.utcnow() - timedelta(hours=hours)
+            model = choose_model(hours, MONITOR_INTERVAL)
             
-            stmt = select(Metric).where(
-                Metric.timestamp >= start_time
-            ).order_by(Metric.timestamp)
+            stmt = select(model).where(
+                host_filter(model, host_id),
+                model.timestamp >= start_time
+            ).order_by(model.timestamp)
             
             result = await session.execute(stmt)
             metrics = result.scalars().all()
@@ -189,6 +549,117 @@ class SystemMonitor:
             logger.error(f"Ошибка при получении метрик из БД: {e}")
             return []
     
+    @staticmethod
+    async def get_series(
+        session: AsyncSession,
+        fields: Sequence[str],
+        hours: int = 24,
+        host_id: Optional[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Временные ряды выбранных колонок за период
+        
+        Читаются только timestamp и перечисленные колонки, без создания
+        ORM-объектов; разрешение выбирается так же, как в get_metrics_for_period.
+        
+        Returns:
+            {'timestamp': datetime64[us], поле: float64 (NaN вместо NULL)}
+        """
+        fields = tuple(fields)
+        try:
+            start_time = datetime.utcnow() - timedelta(hours=hours)
+            model = choose_model(hours, MONITOR_INTERVAL)
+            
+            columns = [model.timestamp] + [getattr(model, field) for field in fields]
+            stmt = select(*columns).where(
+                host_filter(model, host_id),
+                model.timestamp >= start_time
+            ).order_by(model.timestamp)
+            
+            result = await session.execute(stmt)
+            rows = result.all()
+        except Exception as e:
+            logger.error(f"Ошибка при получении рядов из БД: {e}")
+            rows = []
+        
+        if not rows:
+            series = {'timestamp': np.array([], dtype='datetime64[us]')}
+            series.update({field: np.array([], dtype=np.float64) for field in fields})
+            return series
+        
+        columns = list(zip(*rows))
+        series = {'timestamp': np.array(columns[0], dtype='datetime64[us]')}
+        for field, values in zip(fields, columns[1:]):
+            series[field] = np.array(values, dtype=np.float64)
+        return series
+    
+    @staticmethod
+    async def get_period_stats(
+        session: AsyncSession,
+        hours: int = 24,
+        high_threshold: float = 80.0,
+        host_id: Optional[int] = None
+    ) -> Optional[Dict]:
+        """
+        Статистика метрик за период одним агрегирующим запросом
+        
+        Returns:
+            Словарь вида {'count', 'first', 'last', 'cpu_avg', 'cpu_min', 'cpu_max',
+            'cpu_p95', 'cpu_high', ..., 'net_sent', 'net_recv', 'net_sent_peak',
+            'net_recv_peak'} или None, если данных нет
+        """
+        try:
+            start_time = datetime.utcnow() - timedelta(hours=hours)
+            in_period = and_(host_filter(Metric, host_id), Metric.timestamp >= start_time)
+            
+            columns = [
+                func.count().label('count'),
+                func.min(Metric.timestamp).label('first'),
+                func.max(Metric.timestamp).label('last'),
+            ]
+            for name in ('cpu', 'ram', 'disk'):
+                value = getattr(Metric, f'{name}_percent')
+                low = func.coalesce(getattr(Metric, f'{name}_percent_min'), value)
+                high = func.coalesce(getattr(Metric, f'{name}_percent_max'), value)
+                columns += [
+                    func.avg(value).label(f'{name}_avg'),
+                    func.min(low).label(f'{name}_min'),
+                    func.max(high).label(f'{name}_max'),
+                    func.percentile_cont(0.95).within_group(value).label(f'{name}_p95'),
+                    func.count().filter(value > high_threshold).label(f'{name}_high'),
+                ]
+            
+            # Сетевой трафик: средняя скорость записи (байт/с), умноженная на
+            # время, которое покрывают её сэмплы (samples * интервал сэмплов
+            # хоста). Записи без samples собраны напрямую раз в MONITOR_INTERVAL.
+            # Сброс счётчиков на результат не влияет.
+            if host_directory.is_local(host_id):
+                sample_interval = metrics_sampler.interval
+            else:
+                # Локальный импорт: monitor используется агентом, которому
+                # не нужен aiohttp из модуля приёма
+                from app.core.ingest import AGENT_INTERVAL
+                sample_interval = AGENT_INTERVAL
+            covered = case(
+                (Metric.samples.is_(None), MONITOR_INTERVAL),
+                else_=Metric.samples * sample_interval,
+            )
+            for field in ('net_sent', 'net_recv'):
+                rate = getattr(Metric, f'{field}_rate')
+                columns += [
+                    func.sum(rate * covered).label(field),
+                    func.max(rate).label(f'{field}_peak'),
+                ]
+            
+            result = await session.execute(select(*columns).where(in_period))
+            stats = dict(result.one()._mapping)
+            if not stats['count']:
+                return None
+            return stats
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики из БД: {e}")
+            return None
+    
     @staticmethod
     def format_bytes(bytes_value: int) -> str:
         """Форматирование байтов в читаемый вид"""
@@ -215,3 +686,16 @@ class SystemMonitor:
         
         return ' '.join(parts)
 
+
+# Глобальный сэмплер метрик
+metrics_sampler = MetricsSampler(interval=get_env_float('SAMPLE_INTERVAL', 1.0))
+
+# Скорости счётчиков сети (общих и детальных по интерфейсам и дискам)
+network_rates = RateTracker()
+detail_rates = RateTracker()
+
+# Таблица процессов для /top
+process_tracker = ProcessTracker(
+    interval=get_env_float('PROCESS_SAMPLE_INTERVAL', 5.0),
+    limit=get_env_int('TOP_PROCESSES', 5),
+)
@@ -0,0 +1,115 @@
+"""
+История топа процессов: запись вместе с метриками и выборка за период
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.metrics import ProcessName, ProcessSample
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessNameCache:
+    """
+    Кэш словаря имён процессов: имя -> id в process_names
+
+    Набор имён на сервере почти не меняется, поэтому после прогрева запись
+    истории не требует обращений к словарю.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+
+    async def resolve(self, session: AsyncSession, names: Iterable[str]) -> Dict[str, int]:
+        """id для имён; новые имена добавляются в словарь"""
+        missing = {name for name in names if name not in self._ids}
+        if missing:
+            await session.execute(
+                pg_insert(ProcessName)
+                .values([{'name': name} for name in missing])
+                .on_conflict_do_nothing(index_elements=['name'])
+            )
+            result = await session.execute(
+                select(ProcessName.name, ProcessName.id).where(ProcessName.name.in_(missing))
+            )
+            self._ids.update(result.tuples().all())
+        return self._ids
+
+    def clear(self):
+        self._ids.clear()
+
+
+# Глобальный кэш имён процессов
+process_names = ProcessNameCache()
+
+
+async def save_process_samples(session: AsyncSession, samples: List[Dict]):
+    """
+    Пакетная запись топа процессов
+
+    samples - словари с timestamp, pid, name, cpu_percent, memory_percent, rss
+    (см. ProcessTracker.drain). Коммит выполняет вызывающий код.
+    """
+    if not samples:
+        return
+    ids = await process_names.resolve(session, {sample['name'][:255] for sample in samples})
+    rows = [
+        {
+            'timestamp': sample['timestamp'],
+            'pid': sample['pid'],
+            'name_id': ids[sample['name'][:255]],
+            'cpu_percent': sample['cpu_percent'],
+            'memory_percent': sample['memory_percent'],
+            'rss': sample['rss'],
+        }
+        for sample in samples
+    ]
+    await session.execute(
+        pg_insert(ProcessSample).on_conflict_do_nothing(index_elements=['timestamp', 'pid']),
+        rows
+    )
+
+
+async def get_top_consumers(
+    session: AsyncSession,
+    since: datetime,
+    until: datetime,
+    by: str = 'cpu',
+    limit: int = 10
+) -> List[Dict]:
+    """
+    Процессы с наибольшим потреблением за период [since, until]
+
+    Агрегация идёт по покрывающему индексу (timestamp) INCLUDE (name_id,
+    cpu_percent, memory_percent), имена подставляются после группировки.
+
+    Returns:
+        Список {'name', 'cpu_max', 'cpu_avg', 'memory_max', 'samples'}
+    """
+    column = ProcessSample.cpu_percent if by == 'cpu' else ProcessSample.memory_percent
+    top = (
+        select(
+            ProcessSample.name_id,
+            func.max(ProcessSample.cpu_percent).label('cpu_max'),
+            func.avg(ProcessSample.cpu_percent).label('cpu_avg'),
+            func.max(ProcessSample.memory_percent).label('memory_max'),
+            func.count().label('samples'),
+            func.max(column).label('rank_value'),
+        )
+        .where(ProcessSample.timestamp.between(since, until))
+        .group_by(ProcessSample.name_id)
+        .order_by(func.max(column).desc())
+        .limit(limit)
+        .subquery()
+    )
+    stmt = (
+        select(ProcessName.name, top.c.cpu_max, top.c.cpu_avg, top.c.memory_max, top.c.samples)
+        .join(top, top.c.name_id == ProcessName.id)
+        .order_by(top.c.rank_value.desc())
+    )
+    result = await session.execute(stmt)
+    return [dict(row._mapping) for row in result]
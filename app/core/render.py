@@ -0,0 +1,202 @@
+"""
+Отрисовка графиков в пуле процессов
+
+matplotlib работает синхронно и долго, поэтому графики строятся в отдельных
+процессах: event loop передаёт массивы данных и получает готовые PNG.
+Сам модуль лёгкий - matplotlib импортируется только в рабочих процессах,
+а выборка данных и кэш графиков находятся в app/core/graphs.py.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Optional
+import numpy as np
+
+from app.utils.helpers import get_env_float, get_env_int
+
+logger = logging.getLogger(__name__)
+
+# Колонки, необходимые каждому графику (помимо timestamp)
+CHART_FIELDS = {
+    'cpu': ('cpu_percent', 'cpu_load_1m', 'cpu_load_5m', 'cpu_load_15m'),
+    'memory': ('ram_percent',),
+    'disk': ('disk_percent',),
+    'network': ('net_sent_rate', 'net_recv_rate'),
+    # Сводный график: панели CPU, RAM, Disk и Network на одном изображении
+    'dashboard': ('cpu_percent', 'ram_percent', 'disk_percent', 'net_sent_rate', 'net_recv_rate'),
+}
+
+# Отдельные графики, отправляемые по /graph
+PANEL_CHARTS = ('cpu', 'memory', 'disk', 'network')
+
+# Графики детальных метрик (/detail) и ряды series_points для каждого
+DETAIL_CHARTS = {
+    'cores': ('cpu_core_percent',),
+    'mounts': ('mount_percent',),
+    'interfaces': ('net_iface_sent_rate', 'net_iface_recv_rate'),
+    'diskio': ('disk_read_rate', 'disk_write_rate'),
+}
+
+# Методы ChartGenerator для каждого графика
+_CHART_METHODS = {
+    'cpu': 'create_cpu_chart',
+    'memory': 'create_memory_chart',
+    'disk': 'create_disk_chart',
+    'network': 'create_network_chart',
+    'dashboard': 'create_dashboard_chart',
+    'cores': 'create_cores_chart',
+    'mounts': 'create_mounts_chart',
+    'interfaces': 'create_interfaces_chart',
+    'diskio': 'create_diskio_chart',
+}
+
+
+class ChartQueueFull(Exception):
+    """Очередь отрисовки переполнена"""
+
+
+def _render_chart(chart_type: str, series: Dict[str, np.ndarray]) -> Optional[bytes]:
+    """Отрисовка графика (выполняется в рабочем процессе)"""
+    from app.core.charts import ChartGenerator
+    return getattr(ChartGenerator, _CHART_METHODS[chart_type])(series)
+
+
+def _warmup():
+    """Импорт matplotlib в рабочем процессе заранее"""
+    import app.core.charts  # noqa: F401
+
+
+class ChartRenderer:
+    """
+    Пул процессов для отрисовки графиков
+
+    Одновременно в работе и в очереди может быть не больше queue_limit
+    графиков; если место не освободилось за queue_timeout секунд,
+    выбрасывается ChartQueueFull.
+    """
+
+    def __init__(self, workers: int = 2, queue_limit: int = 8, queue_timeout: float = 10.0):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        self.in_flight = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: рабочие процессы не наследуют потоки и состояние event loop
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warmup,
+            )
+        return self._executor
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        """
+        Замена пула, рабочий процесс которого упал (OOM, ошибка в matplotlib)
+
+        Сломанный ProcessPoolExecutor не принимает новые задачи, поэтому он
+        останавливается и создаётся новый, который сразу прогревается.
+        Несколько задач упавшего пула заменяют его только один раз.
+        """
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.restarts += 1
+        logger.error("Рабочий процесс отрисовки завершился аварийно, пул пересоздаётся")
+        self._warmup_task = asyncio.get_running_loop().create_task(self.warmup())
+
+    async def _run(self, chart_type: str, payload: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Задача в пуле; при падении рабочего процесса - один повтор в новом пуле"""
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(executor, _render_chart, chart_type, payload)
+            except BrokenProcessPool:
+                self._restart(executor)
+                if attempt:
+                    raise
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_limit)
+        return self._slots
+
+    async def render(self, chart_type: str, series: Dict[str, np.ndarray]) -> Optional[bytes]:
+        """Отрисовка одного графика в пуле процессов"""
+        slots = self._get_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ChartQueueFull(f"Очередь отрисовки заполнена ({self.queue_limit})")
+        
+        self.in_flight += 1
+        try:
+            # В процесс передаются только нужные графику колонки
+            # (ряды детальных метрик выбираются под график целиком)
+            if chart_type in DETAIL_CHARTS:
+                payload = series
+            else:
+                payload = {'timestamp': series['timestamp']}
+                for field in CHART_FIELDS[chart_type]:
+                    if field in series:
+                        payload[field] = series[field]
+            return await self._run(chart_type, payload)
+        finally:
+            self.in_flight -= 1
+            slots.release()
+
+    async def render_all(
+        self,
+        series: Dict[str, np.ndarray],
+        chart_types: Iterable[str] = PANEL_CHARTS
+    ) -> Dict[str, Optional[bytes]]:
+        """Параллельная отрисовка нескольких графиков"""
+        chart_types = list(chart_types)
+        results = await asyncio.gather(*(self.render(name, series) for name in chart_types))
+        return dict(zip(chart_types, results))
+
+    async def warmup(self):
+        """
+        Запуск всех рабочих процессов заранее
+
+        Процессы создаются по мере поступления задач, поэтому отправляется
+        по одной задаче на процесс: каждый импортирует matplotlib в
+        инициализаторе, и первый /graph не ждёт холодного старта.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        started = loop.time()
+        try:
+            await asyncio.gather(*(
+                loop.run_in_executor(executor, _warmup) for _ in range(self.workers)
+            ))
+            logger.info(f"Пул отрисовки прогрет за {loop.time() - started:.2f}с ({self.workers} процессов)")
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть пул отрисовки: {e}")
+
+    def shutdown(self):
+        """Остановка рабочих процессов"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.info("Пул отрисовки графиков остановлен")
+
+
+# Глобальный пул отрисовки
+chart_renderer = ChartRenderer(
+    workers=get_env_int('CHART_WORKERS', 2),
+    queue_limit=get_env_int('CHART_QUEUE_LIMIT', 8),
+    queue_timeout=get_env_float('CHART_QUEUE_TIMEOUT', 10.0),
+)
+
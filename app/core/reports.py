@@ -0,0 +1,193 @@
+"""
+Автоматические отчёты пользователям по расписанию
+"""
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update
+from aiogram import Bot
+
+from app.core.db import async_session_maker
+from app.core.graphs import get_period_charts
+from app.core.cache import chart_cache, send_cached_chart
+from app.core.snapshot import snapshot_store
+from app.models.metrics import UserSettings
+from app.utils.helpers import get_env_int
+
+logger = logging.getLogger(__name__)
+
+
+class ReportScheduler:
+    """
+    Очередь автоотчётов по времени следующей отправки
+
+    Пользователи хранятся в куче (время отправки, user_id, версия); задача
+    спит до ближайшего времени и просыпается раньше, только если расписание
+    изменилось. Все пользователи, у которых наступило время, получают один
+    и тот же отчёт: текст и график строятся один раз за срабатывание, а
+    last_report_time обновляется одним UPDATE.
+
+    Изменённые записи в куче не удаляются: запись пропускается, если её
+    версия не совпадает с текущей версией пользователя.
+    """
+
+    def __init__(self, concurrency: int = 10):
+        self.concurrency = concurrency
+        self._heap: List[Tuple[datetime, int, int]] = []
+        # user_id -> (интервал в минутах, версия записи в куче)
+        self._users: Dict[int, Tuple[int, int]] = {}
+        self._version = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.bot: Optional[Bot] = None
+        self.reports_sent = 0
+
+    def schedule(self, user_id: int, interval: int, last_report_time: Optional[datetime] = None):
+        """Добавление или изменение расписания пользователя (интервал в минутах)"""
+        self._version += 1
+        self._users[user_id] = (interval, self._version)
+        due = datetime.utcnow() if last_report_time is None else last_report_time + timedelta(minutes=interval)
+        heapq.heappush(self._heap, (due, user_id, self._version))
+        self._wakeup.set()
+
+    def unschedule(self, user_id: int):
+        """Отключение автоотчётов пользователя"""
+        self._users.pop(user_id, None)
+
+    async def load(self):
+        """Загрузка расписания из БД"""
+        async with async_session_maker() as session:
+            stmt = select(
+                UserSettings.user_id,
+                UserSettings.report_interval,
+                UserSettings.last_report_time,
+            ).where(UserSettings.auto_report_enabled == True)
+            result = await session.execute(stmt)
+            rows = result.all()
+        for row in rows:
+            self.schedule(row.user_id, row.report_interval, row.last_report_time)
+        logger.info(f"Загружено расписаний автоотчётов: {len(rows)}")
+
+    def _pop_due(self, now: datetime) -> List[int]:
+        """Извлечение пользователей, у которых наступило время отчёта"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, user_id, version = heapq.heappop(self._heap)
+            current = self._users.get(user_id)
+            if current is not None and current[1] == version:
+                due.append(user_id)
+        return due
+
+    def _next_delay(self) -> Optional[float]:
+        """Секунд до ближайшего отчёта (None - очередь пуста)"""
+        while self._heap:
+            _, user_id, version = self._heap[0]
+            current = self._users.get(user_id)
+            if current is None or current[1] != version:
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+        return None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._next_delay()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = datetime.utcnow()
+            user_ids = self._pop_due(now)
+            if not user_ids:
+                continue
+            try:
+                await self.send_reports(user_ids)
+            except Exception as e:
+                logger.error(f"Ошибка в задаче автоотчётов: {e}")
+            finally:
+                # Следующий отчёт - через интервал от текущего срабатывания
+                for user_id in user_ids:
+                    if user_id in self._users:
+                        self.schedule(user_id, self._users[user_id][0], now)
+                await self._save_report_time(user_ids, now)
+
+    async def send_reports(self, user_ids: List[int]):
+        """Один отчёт (текст и CPU график за час) для всех пользователей"""
+        snapshot = await snapshot_store.get()
+
+        status_text = "📊 <b>Автоматический отчёт</b>\n\n"
+        status_text += f"🖥 CPU: {snapshot.get('cpu_percent') or 0:.1f}%\n"
+        status_text += f"🧠 RAM: {snapshot.get('ram_percent') or 0:.1f}%\n"
+        status_text += f"💾 Disk: {snapshot.get('disk_percent') or 0:.1f}%\n"
+
+        bucket = chart_cache.current_bucket()
+        charts = await get_period_charts(1, ('cpu',), bucket=bucket)
+        chart_data = charts['cpu']
+        key = chart_cache.make_key('cpu', 1, bucket)
+
+        async def send(user_id: int):
+            try:
+                await self.bot.send_message(user_id, status_text)
+                if chart_data:
+                    await send_cached_chart(
+                        self.bot.send_photo,
+                        key,
+                        chart_data,
+                        filename="cpu_report.png",
+                        chat_id=user_id,
+                        caption="📈 CPU метрики за последний час"
+                    )
+                self.reports_sent += 1
+            except Exception as e:
+                logger.error(f"Ошибка отправки автоотчёта пользователю {user_id}: {e}")
+
+        # Первый отчёт загружает график, остальные отправляют его по file_id
+        await send(user_ids[0])
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def send_limited(user_id: int):
+            async with slots:
+                await send(user_id)
+
+        await asyncio.gather(*(send_limited(user_id) for user_id in user_ids[1:]))
+        logger.info(f"Автоотчёт отправлен {len(user_ids)} пользователям")
+
+    async def _save_report_time(self, user_ids: List[int], now: datetime):
+        """Обновление last_report_time одним запросом"""
+        try:
+            async with async_session_maker() as session:
+                await session.execute(
+                    update(UserSettings)
+                    .where(UserSettings.user_id.in_(user_ids))
+                    .values(last_report_time=now)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения времени автоотчётов: {e}")
+
+    async def start(self, bot: Bot):
+        """Загрузка расписания и запуск фоновой задачи"""
+        self.bot = bot
+        if self._task is None:
+            await self.load()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фоновой задачи"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Автоотчёты остановлены")
+
+
+# Глобальная очередь автоотчётов
+report_scheduler = ReportScheduler(concurrency=get_env_int('REPORT_SEND_CONCURRENCY', 10))
@@ -0,0 +1,248 @@
+"""
+Политика хранения метрик и секционирование таблиц metrics и series_points
+"""
+import re
+import time
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.db import engine
+from app.core.rollups import ROLLUP_MODELS
+from app.models.metrics import Metric, ProcessSample, SeriesPoint
+from app.utils.helpers import get_env_int
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней хранить сырые метрики и агрегаты
+RETENTION_RAW_DAYS = get_env_int('RETENTION_RAW_DAYS', 30)
+RETENTION_ROLLUP_DAYS = get_env_int('RETENTION_ROLLUP_DAYS', 365)
+
+# Размер секции в днях (1 - по дням, 7 - по неделям) и запас секций вперёд
+PARTITION_DAYS = get_env_int('METRICS_PARTITION_DAYS', 1)
+PARTITIONS_AHEAD = get_env_int('METRICS_PARTITIONS_AHEAD', 3)
+
+# Размер пакета удаления для несекционированных таблиц
+DELETE_BATCH_SIZE = 10000
+
+# Таблицы сырых данных, секционированные по timestamp
+PARTITIONED_TABLES = (Metric.__tablename__, SeriesPoint.__tablename__)
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+async def is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    """Является ли таблица секционированной"""
+    result = await conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :name)"
+    ), {'name': table})
+    return bool(result.scalar())
+
+
+def _partition_start(day: date) -> date:
+    """Начало секции, содержащей день (секции по неделям начинаются с понедельника)"""
+    ordinal = day.toordinal() - 1
+    return date.fromordinal(ordinal - ordinal % PARTITION_DAYS + 1)
+
+
+async def _list_partitions(conn: AsyncConnection, table: str) -> List[Tuple[str, datetime, datetime]]:
+    """Секции таблицы с границами [from, to)"""
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :name"
+    ), {'name': table})
+    partitions = []
+    for name, bound in result.all():
+        match = _BOUND_RE.search(bound or '')
+        if match:  # секция DEFAULT границ не имеет
+            partitions.append((
+                name,
+                datetime.fromisoformat(match.group(1)),
+                datetime.fromisoformat(match.group(2)),
+            ))
+    return partitions
+
+
+async def _create_partition(conn: AsyncConnection, table: str, name: str, start: date, end: date) -> int:
+    """
+    Создание секции [start, end) с переносом её строк из секции DEFAULT
+
+    Пока секции не было, записи за этот период попадали в секцию DEFAULT;
+    PostgreSQL не даст создать секцию, пока они там. Таблица создаётся
+    отдельно, строки переносятся в неё и она подключается как секция -
+    всё в одной транзакции, поэтому записи не теряются и не дублируются.
+
+    Returns:
+        Количество перенесённых строк
+    """
+    bounds = {
+        'start': datetime.combine(start, datetime.min.time()),
+        'end': datetime.combine(end, datetime.min.time()),
+    }
+    await conn.execute(text(
+        f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    result = await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {table}_default "
+        f"WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    await conn.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return result.rowcount
+
+
+async def _ensure_table_partitions(table: str) -> int:
+    """Секции одной таблицы на текущий период и PARTITIONS_AHEAD вперёд"""
+    async with engine.begin() as conn:
+        if not await is_partitioned(conn, table):
+            return 0
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"
+        ))
+        existing = {start for _, start, _ in await _list_partitions(conn, table)}
+    
+    created = 0
+    start = _partition_start(datetime.utcnow().date())
+    for _ in range(PARTITIONS_AHEAD + 1):
+        end = start + timedelta(days=PARTITION_DAYS)
+        if datetime.combine(start, datetime.min.time()) not in existing:
+            name = f"{table}_p{start.strftime('%Y%m%d')}"
+            try:
+                async with engine.begin() as conn:
+                    moved = await _create_partition(conn, table, name, start, end)
+                created += 1
+                logger.info(f"Создана секция {name}" + (f", перенесено из DEFAULT: {moved}" if moved else ""))
+            except Exception as e:
+                logger.error(f"Не удалось создать секцию {name}: {e}")
+        start = end
+    return created
+
+
+async def ensure_partitions() -> int:
+    """
+    Создание секций metrics и series_points на текущий период и PARTITIONS_AHEAD вперёд
+
+    Returns:
+        Количество созданных секций
+    """
+    created = 0
+    for table in PARTITIONED_TABLES:
+        created += await _ensure_table_partitions(table)
+    return created
+
+
+async def _relation_size(conn: AsyncConnection, name: str) -> int:
+    result = await conn.execute(text("SELECT pg_total_relation_size(:name)"), {'name': name})
+    return result.scalar() or 0
+
+
+async def _estimated_rows(conn: AsyncConnection, name: str) -> int:
+    """Оценка числа строк по статистике планировщика (без чтения таблицы)"""
+    result = await conn.execute(text(
+        "SELECT reltuples::bigint FROM pg_class WHERE relname = :name"
+    ), {'name': name})
+    # -1 - таблица ещё не анализировалась
+    return max(0, result.scalar() or 0)
+
+
+async def _delete_batched(table: str, cutoff: datetime) -> int:
+    """
+    Удаление строк старше cutoff из несекционированной таблицы пакетами
+
+    Каждый пакет - отдельная короткая транзакция, поэтому удаление не
+    держит блокировки и не создаёт один большой всплеск WAL.
+    """
+    deleted = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(text(
+                f"DELETE FROM {table} WHERE ctid IN ("
+                f"SELECT ctid FROM {table} WHERE timestamp < :cutoff LIMIT :limit)"
+            ), {'cutoff': cutoff, 'limit': DELETE_BATCH_SIZE})
+        deleted += result.rowcount
+        if result.rowcount < DELETE_BATCH_SIZE:
+            return deleted
+
+
+async def _expire_table(table: str, cutoff: datetime, report: Dict):
+    """
+    Удаление данных таблицы старше cutoff
+
+    У секционированной таблицы секции целиком старше cutoff удаляются
+    (DROP TABLE), из секции DEFAULT строки удаляются DELETE. Число строк
+    удалённой секции - оценка по pg_class.reltuples.
+    """
+    async with engine.begin() as conn:
+        partitioned = await is_partitioned(conn, table)
+        partitions = await _list_partitions(conn, table) if partitioned else []
+    
+    if not partitioned:
+        async with engine.begin() as conn:
+            size_before = await _relation_size(conn, table)
+        report['deleted_rows'] += await _delete_batched(table, cutoff)
+        async with engine.begin() as conn:
+            # Без VACUUM FULL место возвращается в свободное пространство таблицы
+            report['reclaimed_bytes'] += max(0, size_before - await _relation_size(conn, table))
+        return
+    
+    for name, _, end in partitions:
+        if end > cutoff:
+            continue
+        async with engine.begin() as conn:
+            size = await _relation_size(conn, name)
+            rows = await _estimated_rows(conn, name)
+            await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        report['dropped_partitions'] += 1
+        report['deleted_rows'] += rows
+        report['reclaimed_bytes'] += size
+        logger.info(f"Удалена секция {name} (~{rows} строк)")
+    # Записи, попавшие в DEFAULT до создания секции на их период
+    report['deleted_rows'] += await _delete_batched(f"{table}_default", cutoff)
+
+
+async def apply_retention() -> Dict:
+    """
+    Удаление устаревших метрик
+
+    Сырые метрики и детальные ряды старше RETENTION_RAW_DAYS удаляются
+    целыми секциями, история топа процессов - пакетным DELETE (хранится
+    столько же), агрегаты - пакетным DELETE через RETENTION_ROLLUP_DAYS.
+
+    Returns:
+        Отчёт: {'dropped_partitions', 'deleted_rows', 'reclaimed_bytes', 'duration'}
+    """
+    started = time.perf_counter()
+    report = {'dropped_partitions': 0, 'deleted_rows': 0, 'reclaimed_bytes': 0, 'duration': 0.0}
+    raw_cutoff = datetime.utcnow() - timedelta(days=RETENTION_RAW_DAYS)
+    rollup_cutoff = datetime.utcnow() - timedelta(days=RETENTION_ROLLUP_DAYS)
+    
+    for table in PARTITIONED_TABLES:
+        await _expire_table(table, raw_cutoff, report)
+    
+    report['deleted_rows'] += await _delete_batched(ProcessSample.__tablename__, raw_cutoff)
+    for model in ROLLUP_MODELS:
+        report['deleted_rows'] += await _delete_batched(model.__tablename__, rollup_cutoff)
+    
+    report['duration'] = time.perf_counter() - started
+    return report
+
+
+async def retention_job():
+    """Фоновая задача обслуживания хранилища: секции вперёд и удаление старых данных"""
+    try:
+        await ensure_partitions()
+        report = await apply_retention()
+        logger.info(
+            f"Очистка метрик: удалено секций {report['dropped_partitions']}, "
+            f"строк {report['deleted_rows']}, освобождено {report['reclaimed_bytes'] / (1024 * 1024):.1f} MB "
+            f"за {report['duration']:.2f} сек"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при очистке метрик: {e}")
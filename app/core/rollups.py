@@ -0,0 +1,169 @@
+"""
+Многоуровневые агрегаты метрик (5 минут, 1 час)
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence, Tuple
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.core.buffer import AVG_FIELDS, LAST_FIELDS, RANGE_FIELDS, INT_FIELDS
+from app.models.metrics import Metric, MetricRollup5m, MetricRollup1h
+from app.utils.helpers import get_env_int
+
+logger = logging.getLogger(__name__)
+
+# Таблицы агрегатов от мелкого разрешения к крупному
+ROLLUP_MODELS = (MetricRollup5m, MetricRollup1h)
+
+# Минимальное количество точек, которое должен дать выбранный уровень
+ROLLUP_MIN_POINTS = get_env_int('ROLLUP_MIN_POINTS', 150)
+
+_EPOCH = datetime(1970, 1, 1)
+# Начало отсчёта интервалов в БД (date_bin), кратно часу от _EPOCH
+BIN_ORIGIN = datetime(2000, 1, 1)
+
+
+def bucket_start(timestamp: datetime, resolution: int) -> datetime:
+    """Начало интервала агрегации, в который попадает timestamp"""
+    seconds = int((timestamp - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def merge_into_buckets(rows: Sequence[Dict], resolution: int) -> List[Dict]:
+    """
+    Объединение записей Metric в интервалы агрегации
+
+    Интервалы считаются отдельно для каждого хоста. Средние взвешиваются
+    по количеству сэмплов, для RANGE_FIELDS берутся общие минимум и
+    максимум, для LAST_FIELDS - последнее значение.
+    """
+    buckets: Dict[Tuple[int, datetime], Dict] = {}
+    weights: Dict[Tuple[int, datetime], Dict[str, int]] = {}
+    
+    for row in sorted(rows, key=lambda r: r['timestamp']):
+        start = bucket_start(row['timestamp'], resolution)
+        key = (row['host_id'], start)
+        samples = row.get('samples') or 1
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = {'host_id': row['host_id'], 'timestamp': start, 'samples': 0}
+            for field in AVG_FIELDS + LAST_FIELDS:
+                bucket[field] = None
+            for field in RANGE_FIELDS:
+                bucket[f'{field}_min'] = None
+                bucket[f'{field}_max'] = None
+            buckets[key] = bucket
+            weights[key] = {field: 0 for field in AVG_FIELDS}
+        
+        bucket['samples'] += samples
+        for field in AVG_FIELDS:
+            value = row.get(field)
+            if value is None:
+                continue
+            weight = weights[key][field]
+            current = bucket[field] or 0
+            bucket[field] = (current * weight + value * samples) / (weight + samples)
+            weights[key][field] = weight + samples
+        for field in LAST_FIELDS:
+            if row.get(field) is not None:
+                bucket[field] = row[field]
+        for field in RANGE_FIELDS:
+            low = row.get(f'{field}_min')
+            high = row.get(f'{field}_max')
+            if low is None:
+                low = row.get(field)
+            if high is None:
+                high = row.get(field)
+            if low is not None:
+                current = bucket[f'{field}_min']
+                bucket[f'{field}_min'] = low if current is None else min(current, low)
+            if high is not None:
+                current = bucket[f'{field}_max']
+                bucket[f'{field}_max'] = high if current is None else max(current, high)
+    
+    for bucket in buckets.values():
+        for field in INT_FIELDS:
+            if bucket[field] is not None:
+                bucket[field] = int(round(bucket[field]))
+    return list(buckets.values())
+
+
+def _upsert_statement(model, buckets: List[Dict]):
+    """INSERT ... ON CONFLICT, сливающий новые интервалы с уже сохранёнными"""
+    table = model.__table__
+    stmt = pg_insert(table).values(buckets)
+    new = stmt.excluded
+    old_samples = func.coalesce(table.c.samples, 0)
+    
+    update = {'samples': old_samples + new.samples}
+    for field in AVG_FIELDS:
+        old, value = table.c[field], new[field]
+        update[field] = case(
+            (old.is_(None), value),
+            (value.is_(None), old),
+            else_=(old * old_samples + value * new.samples) / (old_samples + new.samples),
+        )
+    for field in LAST_FIELDS:
+        update[field] = func.coalesce(new[field], table.c[field])
+    for field in RANGE_FIELDS:
+        # least/greatest в PostgreSQL игнорируют NULL
+        update[f'{field}_min'] = func.least(table.c[f'{field}_min'], new[f'{field}_min'])
+        update[f'{field}_max'] = func.greatest(table.c[f'{field}_max'], new[f'{field}_max'])
+    
+    return stmt.on_conflict_do_update(index_elements=['host_id', 'timestamp'], set_=update)
+
+
+async def update_rollups(session: AsyncSession, rows: Sequence[Dict]):
+    """Инкрементальное обновление агрегатов новыми записями (без commit)"""
+    if not rows:
+        return
+    for model in ROLLUP_MODELS:
+        buckets = merge_into_buckets(rows, model.resolution)
+        await session.execute(_upsert_statement(model, buckets))
+
+
+async def backfill_rollups(conn: AsyncConnection):
+    """Заполнение пустых таблиц агрегатов по уже накопленным сырым данным"""
+    for model in ROLLUP_MODELS:
+        table = model.__table__
+        has_rows = await conn.scalar(select(table.c.id).limit(1))
+        if has_rows is not None:
+            continue
+        
+        bucket = func.date_bin(timedelta(seconds=model.resolution), Metric.timestamp, BIN_ORIGIN)
+        samples = func.coalesce(Metric.samples, 1)
+        columns = [Metric.host_id, bucket.label('timestamp'), func.sum(samples).label('samples')]
+        for field in AVG_FIELDS:
+            column = getattr(Metric, field)
+            columns.append(func.avg(column).label(field))
+        for field in LAST_FIELDS:
+            # Счётчики растут, объёмы постоянны - максимум совпадает с последним значением
+            columns.append(func.max(getattr(Metric, field)).label(field))
+        for field in RANGE_FIELDS:
+            column = getattr(Metric, field)
+            columns.append(func.min(func.coalesce(getattr(Metric, f'{field}_min'), column)).label(f'{field}_min'))
+            columns.append(func.max(func.coalesce(getattr(Metric, f'{field}_max'), column)).label(f'{field}_max'))
+        
+        query = select(*columns).group_by(Metric.host_id, bucket)
+        names = [column.name for column in columns]
+        result = await conn.execute(
+            pg_insert(table).from_select(names, query).on_conflict_do_nothing()
+        )
+        if result.rowcount:
+            logger.info(f"Таблица {table.name} заполнена по сырым данным: {result.rowcount} интервалов")
+
+
+def choose_model(hours: int, raw_resolution: int):
+    """
+    Выбор самого крупного разрешения, дающего не меньше ROLLUP_MIN_POINTS точек
+
+    Returns:
+        Модель (MetricRollup1h, MetricRollup5m или Metric)
+    """
+    period = hours * 3600
+    for model in reversed(ROLLUP_MODELS):
+        if model.resolution > raw_resolution and period / model.resolution >= ROLLUP_MIN_POINTS:
+            return model
+    return Metric
@@ -3,20 +3,25 @@
 """
 import os
 import logging
+import time
 import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from sqlalchemy import select
 from aiogram import Bot
-from aiogram.types import BufferedInputFile
 
-from app.core.db import async_session_maker
-from app.core.monitor import SystemMonitor
-from app.core.charts import ChartGenerator
-from app.models.metrics import UserSettings
-from app.utils.helpers import get_env_int, get_env_float
+from app.core.db import async_session_maker, get_pool_stats, DB_POOL_SLOW_CHECKOUT_MS
+from app.core.monitor import SystemMonitor, process_tracker
+from app.core.cache import chart_cache
+from app.core.snapshot import snapshot_store
+from app.core.buffer import ring_buffer
+from app.core.writer import metric_writer
+from app.core.retention import retention_job
+from app.core.alerts import check_alerts
+from app.core.hosts import host_directory
+from app.core.ingest import host_registry
+from app.utils.helpers import get_env_int
 
 logger = logging.getLogger(__name__)
 
@@ -24,179 +29,92 @@ logger = logging.getLogger(__name__)
 scheduler: Optional[AsyncIOScheduler] = None
 bot_instance: Optional[Bot] = None
 
-# Пороги для алертов
-ALERT_CPU_THRESHOLD = get_env_float('ALERT_CPU_THRESHOLD', 90.0)
-ALERT_RAM_THRESHOLD = get_env_float('ALERT_RAM_THRESHOLD', 90.0)
-ALERT_DISK_THRESHOLD = get_env_float('ALERT_DISK_THRESHOLD', 90.0)
-
-# Словарь для отслеживания отправленных алертов (чтобы не спамить)
-last_alerts = {
-    'cpu': None,
-    'ram': None,
-    'disk': None,
-}
+# Граница последней агрегации буфера (unix time)
+last_rollup_time: float = 0.0
 
 
 async def collect_metrics_job():
-    """Фоновая задача для сбора метрик"""
-    try:
-        async with async_session_maker() as session:
-            metric = await SystemMonitor.save_metrics(session)
-            if metric:
-                logger.debug(f"Метрики собраны: CPU {metric.cpu_percent}%, RAM {metric.ram_percent}%")
-                
-                # Проверяем пороги для алертов
-                await check_alerts(metric)
-    except Exception as e:
-        logger.error(f"Ошибка при сборе метрик: {e}")
-
-
-async def check_alerts(metric):
-    """Проверка порогов и отправка алертов"""
-    global last_alerts
-    
-    if not bot_instance:
-        return
+    """Фоновая задача для сбора метрик: агрегация буфера в одну запись за интервал"""
+    global last_rollup_time
     
     try:
-        # Получаем всех пользователей с включёнными алертами
-        async with async_session_maker() as session:
-            stmt = select(UserSettings).where(UserSettings.alerts_enabled == True)
-            result = await session.execute(stmt)
-            users = result.scalars().all()
-        
-        current_time = datetime.utcnow()
+        now = time.time()
+        metrics = ring_buffer.aggregate(since=last_rollup_time, until=now)
+        last_rollup_time = now
+        chart_cache.on_new_data(now)
         
-        # Проверяем CPU
-        if metric.cpu_percent and metric.cpu_percent > ALERT_CPU_THRESHOLD:
-            if not last_alerts['cpu'] or (current_time - last_alerts['cpu']).seconds > 300:  # 5 минут
-                for user in users:
-                    try:
-                        await bot_instance.send_message(
-                            user.user_id,
-                            f"⚠️ <b>ПРЕДУПРЕЖДЕНИЕ: Высокая нагрузка CPU!</b>\n\n"
-                            f"Текущее значение: {metric.cpu_percent:.1f}%\n"
-                            f"Порог: {ALERT_CPU_THRESHOLD}%"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки алерта пользователю {user.user_id}: {e}")
-                
-                last_alerts['cpu'] = current_time
+        if metrics is None:
+            # Сэмплер не работает - собираем метрики напрямую в отдельном потоке,
+            # чтобы psutil не блокировал event loop
+            metrics = await asyncio.to_thread(SystemMonitor.collect_all_metrics)
+            metrics['timestamp'] = datetime.utcnow()
+            snapshot_store.update(metrics)
         
-        # Проверяем RAM
-        if metric.ram_percent and metric.ram_percent > ALERT_RAM_THRESHOLD:
-            if not last_alerts['ram'] or (current_time - last_alerts['ram']).seconds > 300:
-                for user in users:
-                    try:
-                        await bot_instance.send_message(
-                            user.user_id,
-                            f"⚠️ <b>ПРЕДУПРЕЖДЕНИЕ: Высокое использование RAM!</b>\n\n"
-                            f"Текущее значение: {metric.ram_percent:.1f}%\n"
-                            f"Порог: {ALERT_RAM_THRESHOLD}%"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки алерта пользователю {user.user_id}: {e}")
-                
-                last_alerts['ram'] = current_time
+        # Запись в БД отложенная и пакетная, алерты проверяем по сэмплу в памяти
+        metrics['host_id'] = host_directory.local_id
+        metric_writer.add(metrics)
+        metric_writer.add_processes(metrics['timestamp'], process_tracker.drain())
+        details = await asyncio.to_thread(SystemMonitor.collect_detail_metrics)
+        metric_writer.add_series(metrics['timestamp'], metrics['host_id'], details)
+        logger.debug(f"Метрики собраны: CPU {metrics.get('cpu_percent')}%, RAM {metrics.get('ram_percent')}%")
         
-        # Проверяем Disk
-        if metric.disk_percent and metric.disk_percent > ALERT_DISK_THRESHOLD:
-            if not last_alerts['disk'] or (current_time - last_alerts['disk']).seconds > 300:
-                for user in users:
-                    try:
-                        await bot_instance.send_message(
-                            user.user_id,
-                            f"⚠️ <b>ПРЕДУПРЕЖДЕНИЕ: Мало места на диске!</b>\n\n"
-                            f"Текущее значение: {metric.disk_percent:.1f}%\n"
-                            f"Порог: {ALERT_DISK_THRESHOLD}%"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки алерта пользователю {user.user_id}: {e}")
-                
-                last_alerts['disk'] = current_time
-    
+        if bot_instance:
+            await check_alerts(bot_instance, metrics, now)
     except Exception as e:
-        logger.error(f"Ошибка при проверке алертов: {e}")
-
-
-async def send_auto_reports_job():
-    """Фоновая задача для автоматической отправки отчётов"""
-    if not bot_instance:
-        return
+        logger.error(f"Ошибка при сборе метрик: {e}")
     
+    # Метрики агентов - после собственных: ошибка с удалённым хостом
+    # не должна мешать записи и алертам сервера бота
     try:
-        async with async_session_maker() as session:
-            # Получаем пользователей с включённой автоотправкой
-            stmt = select(UserSettings).where(UserSettings.auto_report_enabled == True)
-            result = await session.execute(stmt)
-            users = result.scalars().all()
-            
-            current_time = datetime.utcnow()
-            
-            for user in users:
-                try:
-                    # Проверяем, нужно ли отправлять отчёт
-                    should_send = False
-                    
-                    if user.last_report_time is None:
-                        should_send = True
-                    else:
-                        time_since_last = (current_time - user.last_report_time).total_seconds() / 60
-                        if time_since_last >= user.report_interval:
-                            should_send = True
-                    
-                    if should_send:
-                        # Отправляем отчёт
-                        await send_report_to_user(user.user_id)
-                        
-                        # Обновляем время последней отправки
-                        user.last_report_time = current_time
-                        await session.commit()
-                        
-                        logger.info(f"Отправлен автоотчёт пользователю {user.user_id}")
-                
-                except Exception as e:
-                    logger.error(f"Ошибка отправки автоотчёта пользователю {user.user_id}: {e}")
-    
+        await collect_remote_hosts()
     except Exception as e:
-        logger.error(f"Ошибка в задаче автоотчётов: {e}")
+        logger.error(f"Ошибка при записи метрик агентов: {e}")
 
 
-async def send_report_to_user(user_id: int):
-    """Отправка отчёта пользователю"""
-    if not bot_instance:
+async def collect_remote_hosts():
+    """Запись в БД метрик, полученных от агентов с прошлого тика"""
+    rows = host_registry.drain_rows()
+    if not rows:
         return
     
-    try:
-        # Получаем текущий статус
-        cpu = SystemMonitor.get_cpu_metrics()
-        memory = SystemMonitor.get_memory_metrics()
-        disk = SystemMonitor.get_disk_metrics()
-        
-        status_text = "📊 <b>Автоматический отчёт</b>\n\n"
-        status_text += f"🖥 CPU: {cpu.get('cpu_percent', 0):.1f}%\n"
-        status_text += f"🧠 RAM: {memory.get('ram_percent', 0):.1f}%\n"
-        status_text += f"💾 Disk: {disk.get('disk_percent', 0):.1f}%\n"
-        
-        await bot_instance.send_message(user_id, status_text)
-        
-        # Отправляем график за последний час
-        async with async_session_maker() as session:
-            metrics = await SystemMonitor.get_metrics_for_period(session, hours=1)
-        
-        if metrics:
-            # Отправляем только CPU график
-            chart_data = ChartGenerator.create_cpu_chart(metrics)
-            if chart_data:
-                chart_file = BufferedInputFile(chart_data, filename="cpu_report.png")
-                await bot_instance.send_photo(
-                    user_id,
-                    photo=chart_file,
-                    caption="📈 CPU метрики за последний час"
-                )
+    unknown = {name for name, _ in rows if host_directory.get_id(name) is None}
+    for name in unknown:
+        # Каждый хост регистрируется отдельно: ошибка с одним не теряет записи остальных
+        try:
+            async with async_session_maker() as session:
+                await host_directory.resolve(session, name)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Не удалось зарегистрировать хост {name[:64]!r}: {e}")
     
-    except Exception as e:
-        logger.error(f"Ошибка при отправке отчёта: {e}")
+    for name, row in rows:
+        row['host_id'] = host_directory.get_id(name)
+        if row['host_id'] is None:
+            continue
+        metric_writer.add(row)
+
+
+async def log_stats_job():
+    """Периодический вывод статистики пула соединений с БД и кэша графиков"""
+    stats = get_pool_stats()
+    logger.info(
+        f"Пул БД: занято {stats['checked_out']}/{stats['size']} "
+        f"(+{stats['overflow']} overflow, макс. {stats['max_checked_out']}), "
+        f"подключений {stats['connects']} "
+        f"(ср. {stats['connect_ms_avg']:.1f} мс, макс. {stats['connect_ms_max']:.1f} мс)"
+    )
+    logger.info(
+        f"Получение соединений: ожидают {stats['waiting']}, "
+        f"медленных (>= {DB_POOL_SLOW_CHECKOUT_MS} мс) {stats['slow_checkouts']} из {stats['checkouts']}, "
+        f"ожидание всего {stats['checkout_wait_ms_total']:.0f} мс, макс. {stats['checkout_wait_ms_max']:.1f} мс"
+    )
+    stats = chart_cache.stats()
+    logger.info(
+        f"Кэш графиков: {stats['entries']} шт., {stats['bytes'] / (1024 * 1024):.1f} MB, "
+        f"попаданий {stats['hits']}, промахов {stats['misses']} ({stats['hit_ratio']:.0%}), "
+        f"вытеснено {stats['evictions']}, устарело {stats['invalidations']}, "
+        f"повторов по file_id {stats['file_id_hits']}"
+    )
 
 
 def init_scheduler(bot: Bot):
@@ -218,15 +136,28 @@ def init_scheduler(bot: Bot):
         replace_existing=True,
     )
     
-    # Задача для автоотчётов (проверяем каждую минуту)
+    # Обслуживание хранилища: секции и удаление старых метрик
     scheduler.add_job(
-        send_auto_reports_job,
-        trigger=IntervalTrigger(minutes=1),
-        id='auto_reports',
-        name='Send auto reports',
+        retention_job,
+        trigger=IntervalTrigger(hours=get_env_int('RETENTION_INTERVAL_HOURS', 6)),
+        id='retention',
+        name='Apply metrics retention',
         replace_existing=True,
+        next_run_time=datetime.now(),
     )
     
+    # Статистика пула соединений и кэша графиков (0 - отключено);
+    # POOL_STATS_INTERVAL - прежнее имя настройки
+    stats_interval = get_env_int('STATS_LOG_INTERVAL', get_env_int('POOL_STATS_INTERVAL', 600))
+    if stats_interval > 0:
+        scheduler.add_job(
+            log_stats_job,
+            trigger=IntervalTrigger(seconds=stats_interval),
+            id='log_stats',
+            name='Log pool and cache stats',
+            replace_existing=True,
+        )
+    
     logger.info("Планировщик инициализирован")
 
 
@@ -0,0 +1,151 @@
+"""
+Детальные метрики в узком формате: словарь рядов и значения (series_id, timestamp, value)
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.metrics import Metric, MetricSeries, SeriesPoint
+from app.core.rollups import BIN_ORIGIN, choose_model
+from app.core.monitor import MONITOR_INTERVAL
+from app.core.hosts import host_filter
+
+logger = logging.getLogger(__name__)
+
+SeriesKey = Tuple[int, str, str]
+
+
+class SeriesDirectory:
+    """
+    Кэш словаря рядов: (host_id, метрика, метка) -> id в metric_series
+
+    Набор ядер, разделов и интерфейсов почти не меняется, поэтому после
+    прогрева запись значений не требует обращений к словарю.
+    """
+
+    def __init__(self):
+        self._ids: Dict[SeriesKey, int] = {}
+
+    async def resolve(self, session: AsyncSession, keys: Iterable[SeriesKey]) -> Dict[SeriesKey, int]:
+        """id для рядов; новые ряды добавляются в словарь"""
+        missing = {key for key in keys if key not in self._ids}
+        if missing:
+            await session.execute(
+                pg_insert(MetricSeries)
+                .values([{'host_id': host_id, 'name': name, 'label': label} for host_id, name, label in missing])
+                .on_conflict_do_nothing(index_elements=['host_id', 'name', 'label'])
+            )
+            host_ids = {key[0] for key in missing}
+            result = await session.execute(
+                select(MetricSeries.host_id, MetricSeries.name, MetricSeries.label, MetricSeries.id)
+                .where(MetricSeries.host_id.in_(host_ids))
+            )
+            for host_id, name, label, series_id in result.tuples():
+                self._ids[(host_id, name, label)] = series_id
+        return self._ids
+
+    def clear(self):
+        self._ids.clear()
+
+
+# Глобальный кэш словаря рядов
+series_directory = SeriesDirectory()
+
+
+async def save_series_points(
+    session: AsyncSession,
+    batches: Sequence[Tuple[datetime, int, Dict[Tuple[str, str], float]]]
+):
+    """
+    Пакетная запись детальных метрик
+
+    batches - (timestamp, host_id, {(метрика, метка): значение}), см.
+    SystemMonitor.collect_detail_metrics. Коммит выполняет вызывающий код.
+    """
+    keys = {
+        (host_id, name, label[:255])
+        for _, host_id, points in batches
+        for name, label in points
+    }
+    if not keys:
+        return
+    ids = await series_directory.resolve(session, keys)
+    rows = [
+        {'series_id': ids[(host_id, name, label[:255])], 'timestamp': timestamp, 'value': value}
+        for timestamp, host_id, points in batches
+        for (name, label), value in points.items()
+    ]
+    await session.execute(
+        pg_insert(SeriesPoint).on_conflict_do_nothing(index_elements=['series_id', 'timestamp']),
+        rows
+    )
+
+
+async def get_detail_series(
+    session: AsyncSession,
+    names: Sequence[str],
+    hours: int = 24,
+    host_id: Optional[int] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Ряды детальных метрик хоста за период в формате графиков
+
+    Сначала из словаря выбираются id нужных рядов, затем значения читаются
+    диапазонами первичного ключа (series_id, timestamp) - только эти ряды.
+    Для длинных периодов значения усредняются до разрешения агрегатов
+    (см. choose_model), чтобы объём выборки не рос с длиной периода.
+
+    Returns:
+        {'timestamp': datetime64[us], 'метрика:метка': float64, ...};
+        отсутствующие значения - NaN
+    """
+    series = {'timestamp': np.array([], dtype='datetime64[us]')}
+    try:
+        result = await session.execute(
+            select(MetricSeries.id, MetricSeries.name, MetricSeries.label)
+            .where(host_filter(MetricSeries, host_id), MetricSeries.name.in_(names))
+            .order_by(MetricSeries.name, MetricSeries.label)
+        )
+        keys = {series_id: f"{name}:{label}" for series_id, name, label in result.tuples()}
+        if not keys:
+            return series
+
+        start_time = datetime.utcnow() - timedelta(hours=hours)
+        in_period = (SeriesPoint.series_id.in_(keys), SeriesPoint.timestamp >= start_time)
+        model = choose_model(hours, MONITOR_INTERVAL)
+        if model is Metric:
+            stmt = select(SeriesPoint.series_id, SeriesPoint.timestamp, SeriesPoint.value).where(*in_period)
+        else:
+            bucket = func.date_bin(timedelta(seconds=model.resolution), SeriesPoint.timestamp, BIN_ORIGIN)
+            stmt = (
+                select(SeriesPoint.series_id, bucket, func.avg(SeriesPoint.value))
+                .where(*in_period)
+                .group_by(SeriesPoint.series_id, bucket)
+            )
+        rows = (await session.execute(stmt)).all()
+    except Exception as e:
+        logger.error(f"Ошибка при получении детальных метрик из БД: {e}")
+        return series
+
+    if not rows:
+        return series
+
+    # Широкая таблица: общая ось времени, по колонке на ряд
+    series_ids, timestamps, values = zip(*rows)
+    timestamps = np.array(timestamps, dtype='datetime64[us]')
+    axis, positions = np.unique(timestamps, return_inverse=True)
+    values = np.array(values, dtype=np.float64)
+    series_ids = np.array(series_ids)
+    series['timestamp'] = axis
+    for series_id, key in keys.items():
+        mask = series_ids == series_id
+        if not mask.any():
+            continue
+        column = np.full(len(axis), np.nan)
+        column[positions[mask]] = values[mask]
+        series[key] = column
+    return series
@@ -0,0 +1,83 @@
+"""
+Хранилище последнего снимка метрик в памяти
+"""
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from app.core.monitor import SystemMonitor
+from app.utils.helpers import get_env_float
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """
+    Последний снимок метрик процесса
+
+    Сборщик метрик обновляет снимок через update(), обработчики читают его
+    через get() за O(1). Если снимок старше max_age, он обновляется, причём
+    одновременные запросы ждут один общий сбор (single-flight), а не
+    запускают каждый свой проход psutil.
+    """
+
+    def __init__(self, max_age: float = 15.0):
+        self.max_age = max_age
+        self._data: Optional[Dict] = None
+        self._updated_at: float = 0.0
+        self._boot_time: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def age(self) -> float:
+        """Возраст снимка в секундах"""
+        if self._data is None:
+            return float('inf')
+        return time.monotonic() - self._updated_at
+
+    def peek(self) -> Optional[Dict]:
+        """Текущий снимок без проверки свежести"""
+        return self._data
+
+    def update(self, metrics: Dict):
+        """Публикация нового снимка"""
+        data = dict(metrics)
+        if 'boot_time' not in data:
+            if self._boot_time is None:
+                self._boot_time = SystemMonitor.get_boot_time()
+            data['boot_time'] = self._boot_time
+        self._data = data
+        self._updated_at = time.monotonic()
+
+    def on_sample(self, timestamp: float, metrics: Dict):
+        """Подписчик сэмплера метрик"""
+        self.update(metrics)
+
+    async def get(self, max_age: Optional[float] = None) -> Dict:
+        """Получение снимка не старше max_age секунд"""
+        if max_age is None:
+            max_age = self.max_age
+        if self._data is not None and self.age <= max_age:
+            return self._data
+        return await self.refresh()
+
+    async def refresh(self) -> Dict:
+        """Обновление снимка (один сбор на всех ожидающих)"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._collect())
+            self._refresh_task.add_done_callback(self._on_refresh_done)
+        # shield: отмена одного ожидающего не должна отменять общий сбор
+        return await asyncio.shield(self._refresh_task)
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        self._refresh_task = None
+
+    async def _collect(self) -> Dict:
+        metrics = await asyncio.to_thread(SystemMonitor.collect_all_metrics)
+        self.update(metrics)
+        return self._data
+
+
+# Глобальное хранилище снимка
+snapshot_store = SnapshotStore(max_age=get_env_float('SNAPSHOT_MAX_AGE', 15.0))
@@ -0,0 +1,63 @@
+"""
+HTTP-сервер бота (aiohttp) в том же event loop, что и Dispatcher
+"""
+import os
+import logging
+from typing import Optional
+from aiohttp import web
+
+from app.utils.helpers import get_env_int
+
+logger = logging.getLogger(__name__)
+
+# Порт HTTP-сервера (0 - сервер не запускается)
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+WEB_PORT = get_env_int('WEB_PORT', 0)
+
+# Максимальный размер тела запроса
+WEB_MAX_BODY = get_env_int('WEB_MAX_BODY', 1024 * 1024)
+
+# Экспорт метрик для Prometheus (GET /metrics)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+web_app: Optional[web.Application] = None
+web_runner: Optional[web.AppRunner] = None
+
+
+def init_web() -> web.Application:
+    """Создание приложения; модули регистрируют в нём свои маршруты"""
+    global web_app
+    
+    from app.core.ingest import setup_ingest
+    from app.core.exporter import setup_exporter
+    
+    web_app = web.Application(client_max_size=WEB_MAX_BODY)
+    setup_ingest(web_app)
+    if METRICS_ENABLED:
+        setup_exporter(web_app)
+    return web_app
+
+
+async def start_web_server(host: str = WEB_HOST, port: int = WEB_PORT) -> Optional[web.AppRunner]:
+    """Запуск HTTP-сервера, если задан порт"""
+    global web_runner
+    
+    if port <= 0 or web_runner is not None:
+        return web_runner
+    app = web_app or init_web()
+    # access log на каждый запрос агентов не нужен
+    web_runner = web.AppRunner(app, access_log=None)
+    await web_runner.setup()
+    await web.TCPSite(web_runner, host, port).start()
+    logger.info(f"HTTP-сервер запущен на {host}:{port}")
+    return web_runner
+
+
+async def stop_web_server():
+    """Остановка HTTP-сервера"""
+    global web_runner
+    
+    if web_runner is not None:
+        await web_runner.cleanup()
+        web_runner = None
+        logger.info("HTTP-сервер остановлен")
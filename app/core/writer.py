@@ -0,0 +1,158 @@
+"""
+Отложенная (write-behind) пакетная запись метрик в базу данных
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import insert
+
+from app.core.db import async_session_maker
+from app.core.rollups import update_rollups
+from app.core.processes import process_names, save_process_samples
+from app.core.series import series_directory, save_series_points
+from app.models.metrics import Metric
+from app.utils.helpers import get_env_float, get_env_int
+
+logger = logging.getLogger(__name__)
+
+
+class MetricWriter:
+    """
+    Очередь записей Metric с пакетным сбросом в БД
+
+    В той же транзакции обновляются таблицы агрегатов (5 минут, 1 час),
+    записываются топ процессов (add_processes) и детальные метрики
+    (add_series).
+
+    Записи накапливаются в памяти и сбрасываются одним многострочным INSERT,
+    когда очередь достигает batch_size или с момента первой записи прошло
+    flush_interval секунд. При ошибке БД записи возвращаются в очередь
+    (не более max_pending, старые отбрасываются).
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 120.0, max_pending: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[Dict] = []
+        self._pending_processes: List[Dict] = []
+        self._pending_series: List[Tuple[datetime, int, Dict[Tuple[str, str], float]]] = []
+        self._oldest_at: Optional[float] = None
+        self._flush_lock = asyncio.Lock()
+        self._size_flush_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self.rows_written = 0
+        self.flushes = 0
+        self.errors = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, row: Dict):
+        """Постановка записи в очередь"""
+        if not self._pending:
+            self._oldest_at = time.monotonic()
+        self._pending.append(row)
+        
+        if len(self._pending) > self.max_pending:
+            dropped = len(self._pending) - self.max_pending
+            del self._pending[:dropped]
+            logger.warning(f"Очередь записи переполнена, отброшено записей: {dropped}")
+        
+        if len(self._pending) >= self.batch_size and self._size_flush_task is None:
+            self._size_flush_task = asyncio.create_task(self.flush())
+            self._size_flush_task.add_done_callback(self._on_size_flush_done)
+
+    def add_processes(self, timestamp: datetime, processes: List[Dict]):
+        """Постановка в очередь топа процессов на момент записи метрик"""
+        self._pending_processes.extend(dict(process, timestamp=timestamp) for process in processes)
+        if len(self._pending_processes) > self.max_pending:
+            del self._pending_processes[:len(self._pending_processes) - self.max_pending]
+
+    def add_series(self, timestamp: datetime, host_id: int, points: Dict[Tuple[str, str], float]):
+        """Постановка в очередь детальных метрик хоста: {(метрика, метка): значение}"""
+        if not points:
+            return
+        self._pending_series.append((timestamp, host_id, points))
+        if len(self._pending_series) > self.max_pending:
+            del self._pending_series[:len(self._pending_series) - self.max_pending]
+
+    def _on_size_flush_done(self, task: asyncio.Task):
+        self._size_flush_task = None
+
+    async def flush(self) -> int:
+        """Сброс очереди в БД, возвращает количество записанных строк"""
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            processes, self._pending_processes = self._pending_processes, []
+            series, self._pending_series = self._pending_series, []
+            self._oldest_at = None
+            if not rows and not processes and not series:
+                return 0
+            
+            try:
+                async with async_session_maker() as session:
+                    if rows:
+                        await session.execute(insert(Metric), rows)
+                        await update_rollups(session, rows)
+                    await save_process_samples(session, processes)
+                    await save_series_points(session, series)
+                    await session.commit()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка при пакетной записи метрик ({len(rows)} строк): {e}")
+                # Новые имена процессов и ряды могли не сохраниться вместе с транзакцией
+                process_names.clear()
+                series_directory.clear()
+                # Возвращаем строки в начало очереди для следующей попытки
+                self._pending[:0] = rows
+                self._pending = self._pending[-self.max_pending:]
+                self._pending_processes[:0] = processes
+                self._pending_processes = self._pending_processes[-self.max_pending:]
+                self._pending_series[:0] = series
+                self._pending_series = self._pending_series[-self.max_pending:]
+                self._oldest_at = time.monotonic()
+                return 0
+            
+            self.rows_written += len(rows)
+            self.flushes += 1
+            logger.debug(f"Записано метрик пакетом: {len(rows)}")
+            return len(rows)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(min(self.flush_interval, 5.0))
+            if self._oldest_at is not None and time.monotonic() - self._oldest_at >= self.flush_interval:
+                await self.flush()
+
+    def start(self):
+        """Запуск фонового сброса по времени"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Пакетная запись метрик запущена "
+                f"(пакет {self.batch_size}, интервал {self.flush_interval} сек)"
+            )
+
+    async def stop(self):
+        """Остановка с финальным сбросом очереди"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        written = await self.flush()
+        logger.info(f"Пакетная запись метрик остановлена, финальный сброс: {written} строк")
+
+
+# Глобальная очередь записи
+metric_writer = MetricWriter(
+    batch_size=get_env_int('WRITE_BATCH_SIZE', 100),
+    flush_interval=get_env_float('WRITE_FLUSH_INTERVAL', 120.0),
+    max_pending=get_env_int('WRITE_MAX_PENDING', 10000),
+)
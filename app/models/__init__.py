@@ -1,4 +1,9 @@
-from .metrics import Metric, UserSettings
-
-__all__ = ['Metric', 'UserSettings']
+from .metrics import (
+    Host, Metric, MetricRollup5m, MetricRollup1h, MetricSeries, ProcessName, ProcessSample,
+    SeriesPoint, UserSettings
+)
 
+__all__ = [
+    'Host', 'Metric', 'MetricRollup5m', 'MetricRollup1h', 'MetricSeries', 'ProcessName',
+    'ProcessSample', 'SeriesPoint', 'UserSettings'
+]
@@ -2,18 +2,17 @@
 Модели базы данных для хранения метрик и настроек пользователей
 """
 from datetime import datetime
-from sqlalchemy import BigInteger, Column, DateTime, Float, Integer, String, Boolean
+from sqlalchemy import REAL, BigInteger, Column, DateTime, Float, Index, Integer, String, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 
-class Metric(Base):
-    """Модель для хранения метрик системы"""
-    __tablename__ = 'metrics'
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+class MetricColumnsMixin:
+    """Общие колонки метрик для сырых записей и агрегатов"""
+    
+    # Сервер, с которого сняты метрики (hosts.id)
+    host_id = Column(Integer, nullable=False)
     
     # CPU метрики
     cpu_load_1m = Column(Float, nullable=True)
@@ -21,28 +20,185 @@ class Metric(Base):
     cpu_load_15m = Column(Float, nullable=True)
     cpu_percent = Column(Float, nullable=True)
     cpu_temp = Column(Float, nullable=True)  # Температура CPU (если доступна)
+    cpu_percent_min = Column(Float, nullable=True)
+    cpu_percent_max = Column(Float, nullable=True)
     
     # RAM метрики
     ram_used = Column(BigInteger, nullable=True)  # в байтах
     ram_total = Column(BigInteger, nullable=True)  # в байтах
     ram_percent = Column(Float, nullable=True)
+    ram_percent_min = Column(Float, nullable=True)
+    ram_percent_max = Column(Float, nullable=True)
     
     # Disk метрики
     disk_used = Column(BigInteger, nullable=True)  # в байтах
     disk_total = Column(BigInteger, nullable=True)  # в байтах
     disk_percent = Column(Float, nullable=True)
+    disk_percent_min = Column(Float, nullable=True)
+    disk_percent_max = Column(Float, nullable=True)
     
     # Network метрики
     net_sent = Column(BigInteger, nullable=True)  # всего отправлено байт
     net_recv = Column(BigInteger, nullable=True)  # всего получено байт
+    net_sent_rate = Column(Float, nullable=True)  # байт/с, среднее за интервал
+    net_recv_rate = Column(Float, nullable=True)  # байт/с, среднее за интервал
     
     # Процессы
     process_count = Column(Integer, nullable=True)
     
+    # Количество сэмплов, агрегированных в запись (средние значения за интервал)
+    samples = Column(Integer, nullable=True)
+
+
+class Metric(MetricColumnsMixin, Base):
+    """
+    Модель для хранения метрик системы
+
+    Таблица секционирована по времени (см. app.core.retention), поэтому
+    timestamp входит в первичный ключ. Запросы за период по хосту читают
+    диапазон индекса (host_id, timestamp), а строки берут из таблицы:
+    графики и статистика выбирают разные наборы колонок, и покрыть их все
+    индексом дороже, чем прочитать строки одного хоста за период. Выборки
+    по времени без хоста ограничиваются секциями.
+    """
+    __tablename__ = 'metrics'
+    __table_args__ = (
+        Index('ix_metrics_host_timestamp', 'host_id', 'timestamp'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, primary_key=True)
+    
     def __repr__(self):
         return f"<Metric(id={self.id}, timestamp={self.timestamp}, cpu={self.cpu_percent}%)>"
 
 
+class MetricRollup5m(MetricColumnsMixin, Base):
+    """Агрегаты метрик с разрешением 5 минут"""
+    __tablename__ = 'metrics_5m'
+    __table_args__ = (
+        Index('ix_metrics_5m_host_timestamp', 'host_id', 'timestamp', unique=True),
+    )
+    
+    # Длительность интервала агрегации (секунды)
+    resolution = 300
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime, nullable=False)  # начало интервала
+    
+    def __repr__(self):
+        return f"<MetricRollup5m(timestamp={self.timestamp}, cpu={self.cpu_percent}%)>"
+
+
+class MetricRollup1h(MetricColumnsMixin, Base):
+    """Агрегаты метрик с разрешением 1 час"""
+    __tablename__ = 'metrics_1h'
+    __table_args__ = (
+        Index('ix_metrics_1h_host_timestamp', 'host_id', 'timestamp', unique=True),
+    )
+    
+    # Длительность интервала агрегации (секунды)
+    resolution = 3600
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime, nullable=False)  # начало интервала
+    
+    def __repr__(self):
+        return f"<MetricRollup1h(timestamp={self.timestamp}, cpu={self.cpu_percent}%)>"
+
+
+class Host(Base):
+    """Сервер, метрики которого хранятся в БД (локальный или с агентом)"""
+    __tablename__ = 'hosts'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<Host(id={self.id}, name={self.name})>"
+
+
+class ProcessName(Base):
+    """Словарь имён процессов (в process_samples хранится только id)"""
+    __tablename__ = 'process_names'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f"<ProcessName(id={self.id}, name={self.name})>"
+
+
+class ProcessSample(Base):
+    """
+    Топ процессов по CPU и RAM на момент записи метрик
+
+    Строка компактная: без суррогатного ключа, имя - ссылка на словарь,
+    проценты - REAL. Покрывающий индекс по timestamp позволяет считать
+    топ за период только по индексу.
+    """
+    __tablename__ = 'process_samples'
+    __table_args__ = (
+        Index(
+            'ix_process_samples_timestamp_cover', 'timestamp',
+            postgresql_include=['name_id', 'cpu_percent', 'memory_percent'],
+        ),
+    )
+
+    timestamp = Column(DateTime, nullable=False, primary_key=True)
+    pid = Column(Integer, nullable=False, primary_key=True)
+    name_id = Column(Integer, nullable=False)
+    cpu_percent = Column(REAL, nullable=True)
+    memory_percent = Column(REAL, nullable=True)
+    rss = Column(BigInteger, nullable=True)  # в байтах
+    
+    def __repr__(self):
+        return f"<ProcessSample(timestamp={self.timestamp}, pid={self.pid}, cpu={self.cpu_percent}%)>"
+
+
+class MetricSeries(Base):
+    """
+    Словарь рядов детальных метрик: хост, метрика и метка
+
+    Например ('cpu_core_percent', '3') - загрузка ядра 3, ('mount_percent',
+    '/var') - заполнение раздела. Значения хранятся в series_points.
+    """
+    __tablename__ = 'metric_series'
+    __table_args__ = (
+        Index('ix_metric_series_host_name_label', 'host_id', 'name', 'label', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    host_id = Column(Integer, nullable=False)
+    name = Column(String(64), nullable=False)
+    label = Column(String(255), nullable=False)
+    
+    def __repr__(self):
+        return f"<MetricSeries(id={self.id}, name={self.name}, label={self.label})>"
+
+
+class SeriesPoint(Base):
+    """
+    Значение ряда детальных метрик в момент времени
+
+    Узкая строка (series_id, timestamp, value): число ядер, разделов и
+    интерфейсов не меняет схему. Выборка ряда за период - диапазон по
+    первичному ключу. Таблица секционирована по времени, как metrics:
+    старые данные удаляются целыми секциями (см. app.core.retention).
+    """
+    __tablename__ = 'series_points'
+    __table_args__ = {'postgresql_partition_by': 'RANGE (timestamp)'}
+
+    series_id = Column(Integer, nullable=False, primary_key=True)
+    timestamp = Column(DateTime, nullable=False, primary_key=True)
+    value = Column(Float, nullable=True)
+    
+    def __repr__(self):
+        return f"<SeriesPoint(series_id={self.series_id}, timestamp={self.timestamp}, value={self.value})>"
+
+
 class UserSettings(Base):
     """Модель для хранения настроек пользователей"""
     __tablename__ = 'user_settings'
@@ -57,6 +213,10 @@ class UserSettings(Base):
     
     # Настройки уведомлений
     alerts_enabled = Column(Boolean, default=True)
+    # Личные пороги алертов (NULL - порог по умолчанию из правила)
+    alert_cpu_threshold = Column(Float, nullable=True)
+    alert_ram_threshold = Column(Float, nullable=True)
+    alert_disk_threshold = Column(Float, nullable=True)
     
     # Системная информация
     created_at = Column(DateTime, default=datetime.utcnow)
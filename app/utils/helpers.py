@@ -33,6 +33,9 @@ async def get_or_create_user_settings(
                 await session.commit()
                 await session.refresh(user_settings)
                 logger.info(f"Создан новый пользователь: {user_id}")
+                # Новый пользователь подписан на алерты по умолчанию
+                from app.core.alerts import alert_subscribers
+                alert_subscribers.invalidate()
             except Exception as commit_error:
                 # Возможно, пользователь был создан в другой сессии
                 await session.rollback()
@@ -0,0 +1,47 @@
+"""
+Замер времени запуска бота по фазам
+"""
+import time
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Длительность фаз запуска: импорты, init_db, планировщик и т.д.
+
+    Фаза отсчитывается от предыдущей отметки mark(); отдельно
+    фиксируется время до первого обработанного update.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.first_update: Optional[float] = None
+        self._last = self.started
+
+    def mark(self, phase: str) -> float:
+        """Завершение фазы, возвращает её длительность в секундах"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+        return self.phases[phase]
+
+    def elapsed(self) -> float:
+        """Время с начала запуска"""
+        return time.perf_counter() - self.started
+
+    def mark_first_update(self) -> bool:
+        """Отметка первого update; True, если это первый вызов"""
+        if self.first_update is not None:
+            return False
+        self.first_update = self.elapsed()
+        return True
+
+    def report(self) -> str:
+        """Строка отчёта вида 'imports=0.84s init_db=0.12s ... total=1.10s'"""
+        parts = [f"{phase}={duration:.2f}s" for phase, duration in self.phases.items()]
+        parts.append(f"total={self._last - self.started:.2f}s")
+        return ' '.join(parts)
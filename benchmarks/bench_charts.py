@@ -0,0 +1,68 @@
+"""
+Бенчмарк отрисовки графиков с прореживанием рядов и без него
+
+Запуск: python -m benchmarks.bench_charts [количество точек]
+По умолчанию - 7 дней при сборе раз в минуту (10080 точек).
+"""
+import sys
+import time
+import logging
+import numpy as np
+
+from app.core import charts
+from app.core.charts import ChartGenerator
+from app.core.render import CHART_FIELDS
+
+logging.disable(logging.WARNING)  # предупреждения о глифах эмодзи
+
+
+def make_series(points: int) -> dict:
+    """Синтетические ряды графиков (CHART_FIELDS) с редкими пиками"""
+    rng = np.random.default_rng(42)
+    start = np.datetime64('2024-01-01T00:00:00', 'us')
+    series = {'timestamp': start + np.arange(points) * np.timedelta64(60, 's')}
+    for fields in CHART_FIELDS.values():
+        for field in fields:
+            values = rng.normal(30, 5, points).clip(0, 100)
+            values[rng.integers(0, points, max(1, points // 1000))] = 98.0
+            series[field] = values
+    # Скорость сети (байт/с), как в net_*_rate: фон и редкие всплески трафика
+    for field, scale in (('net_sent_rate', 10 ** 5), ('net_recv_rate', 10 ** 6)):
+        values = rng.lognormal(0, 0.5, points) * scale
+        values[rng.integers(0, points, max(1, points // 1000))] *= 50
+        series[field] = values
+    return series
+
+
+def bench(series: dict, method: str, repeat: int = 3) -> dict:
+    """Лучшее время отрисовки каждого графика (секунды)"""
+    charts.CHART_DECIMATION = method
+    results = {}
+    for name in CHART_FIELDS:
+        render = getattr(ChartGenerator, f'create_{name}_chart')
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render(series)
+            timings.append(time.perf_counter() - started)
+        results[name] = min(timings)
+    return results
+
+
+def main():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 10080
+    series = make_series(points)
+    bench(series, 'none', repeat=1)  # прогрев шрифтов matplotlib
+    
+    print(f"Точек в ряду: {points}, прореживание до {charts.CHART_MAX_POINTS}")
+    print(f"{'график':<10}{'none':>10}{'minmax':>10}{'lttb':>10}")
+    results = {method: bench(series, method) for method in ('none', 'minmax', 'lttb')}
+    for name in CHART_FIELDS:
+        row = ''.join(f"{results[method][name] * 1000:>8.0f}мс" for method in results)
+        print(f"{name:<10}{row}")
+    totals = ''.join(f"{sum(results[method].values()) * 1000:>8.0f}мс" for method in results)
+    print(f"{'всего':<10}{totals}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Стоимость scrape /metrics: построение ответа и запросы по loopback
+
+Запуск: python -m benchmarks.bench_exporter [хостов] [запросов]
+По умолчанию - 300 хостов с агентами и 1000 запросов. Сэмплы
+синтетические, psutil и БД не используются.
+"""
+import sys
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from aiohttp import web
+
+from app.core.buffer import BUFFER_FIELDS
+from app.core.ingest import host_registry
+from app.core.snapshot import snapshot_store
+from app.core.exporter import metrics_exporter, setup_exporter
+
+logging.disable(logging.WARNING)
+
+PORT = 18082
+
+
+def _sample() -> dict:
+    return {field: random.uniform(0, 100) for field in BUFFER_FIELDS}
+
+
+async def main():
+    hosts_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    
+    snapshot_store.update(dict(_sample(), boot_time=time.time()))
+    for i in range(hosts_count):
+        host_registry.ingest(f'host-{i:04d}', [(time.time(), _sample())])
+    
+    # Построение ответа без кэша
+    rounds = 100
+    started = time.perf_counter()
+    for _ in range(rounds):
+        body = metrics_exporter.render()
+    render_ms = (time.perf_counter() - started) / rounds * 1000
+    
+    app = web.Application()
+    setup_exporter(app)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(requests):
+            started = time.perf_counter()
+            async with session.get(f'http://127.0.0.1:{PORT}/metrics') as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+    await runner.cleanup()
+    
+    latencies.sort()
+    lines = body.count(b'\n')
+    print(f"Хостов: {hosts_count}, строк ответа: {lines}, размер {len(body) / 1024:.1f} KB")
+    print(f"Построение ответа: {render_ms:.2f} мс, построений за {requests} запросов: {metrics_exporter.renders - rounds}")
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"Задержка запроса: p50 {p50:.2f} мс, p99 {p99:.2f} мс")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
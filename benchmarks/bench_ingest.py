@@ -0,0 +1,81 @@
+"""
+Нагрузочный тест приёма метрик: несколько агентов на loopback
+
+Запуск: python -m benchmarks.bench_ingest [агентов] [секунд] [интервал]
+По умолчанию - 300 агентов с интервалом 10 секунд в течение 30 секунд.
+Сервер приёма и агенты работают в одном процессе, агенты отправляют
+синтетические сэмплы без psutil.
+"""
+import sys
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from aiohttp import web
+
+from app.agent.main import MetricsAgent
+from app.core.buffer import BUFFER_FIELDS
+from app.core.ingest import host_registry, setup_ingest
+
+logging.disable(logging.WARNING)
+
+PORT = 18081
+
+
+class SyntheticAgent(MetricsAgent):
+    """Агент со случайными метриками вместо psutil"""
+
+    def collect(self):
+        return time.time(), {field: random.uniform(0, 100) for field in BUFFER_FIELDS}
+
+
+async def run_agent(agent: SyntheticAgent, session: aiohttp.ClientSession, until: float, latencies: list):
+    # Агенты стартуют вразнобой, как в реальном парке серверов
+    await asyncio.sleep(random.uniform(0, agent.interval))
+    while time.monotonic() < until:
+        agent.add_sample(*agent.collect())
+        if agent._pending:
+            started = time.perf_counter()
+            await agent.push(session)
+            latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(agent.interval)
+
+
+async def main():
+    agents_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 30.0
+    interval = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    
+    app = web.Application()
+    setup_ingest(app)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    
+    url = f'http://127.0.0.1:{PORT}/ingest'
+    agents = [
+        SyntheticAgent(url, host=f'host-{i:04d}', interval=interval, batch_size=1)
+        for i in range(agents_count)
+    ]
+    latencies = []
+    until = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(run_agent(agent, session, until, latencies) for agent in agents))
+    await runner.cleanup()
+    
+    latencies.sort()
+    errors = sum(agent.errors for agent in agents)
+    samples = sum(host.samples for host in host_registry.hosts.values())
+    print(f"Агентов: {agents_count}, интервал {interval} сек, длительность {duration} сек")
+    print(f"Пакетов: {host_registry.frames} ({host_registry.frames / duration:.1f}/сек), "
+          f"сэмплов: {samples}, ошибок: {errors}, хостов: {len(host_registry.hosts)}")
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f"Задержка отправки: p50 {p50:.2f} мс, p99 {p99:.2f} мс, макс. {latencies[-1] * 1000:.2f} мс")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Тесты RateTracker: скорость счётчиков, сбросы, перезагрузка и монотонные часы
+"""
+from app.core.monitor import RateTracker
+
+
+class FakeClock:
+    """Управляемые монотонные часы"""
+
+    def __init__(self, now: float = 100.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_tracker():
+    clock = FakeClock()
+    return RateTracker(clock=clock), clock
+
+
+def test_first_update_has_no_rate():
+    tracker, _ = make_tracker()
+    assert tracker.update({'sent': 1000}) == {}
+
+
+def test_rate_uses_elapsed_time():
+    tracker, clock = make_tracker()
+    tracker.update({'sent': 1000})
+    clock.now += 4
+    assert tracker.update({'sent': 3000}) == {'sent': 500.0}
+
+
+def test_decrease_is_reset():
+    tracker, clock = make_tracker()
+    tracker.update({'sent': 5000})
+    clock.now += 1
+    assert tracker.update({'sent': 100}) == {}
+    assert tracker.resets == 1
+    # Отсчёт начинается заново от значения после сброса
+    clock.now += 1
+    assert tracker.update({'sent': 300}) == {'sent': 200.0}
+
+
+def test_decrease_near_32bit_limit_is_reset():
+    tracker, clock = make_tracker()
+    tracker.update({'sent': 2 ** 32 - 10})
+    clock.now += 1
+    assert tracker.update({'sent': 5}) == {}
+    assert tracker.resets == 1
+
+
+def test_reboot_drops_all_counters():
+    tracker, clock = make_tracker()
+    tracker.update({'sent': 1000, 'recv': 2000}, boot_time=1_700_000_000)
+    clock.now += 1
+    # Счётчики после перезагрузки могут успеть вырасти выше прежних
+    assert tracker.update({'sent': 5000, 'recv': 9000}, boot_time=1_700_086_400) == {}
+    assert tracker.resets == 1
+    clock.now += 1
+    assert tracker.update({'sent': 6000, 'recv': 9500}, boot_time=1_700_086_400) == {'sent': 1000.0, 'recv': 500.0}
+
+
+def test_boot_time_jitter_is_not_reboot():
+    tracker, clock = make_tracker()
+    tracker.update({'sent': 1000}, boot_time=1_700_000_000.0)
+    clock.now += 1
+    assert tracker.update({'sent': 2000}, boot_time=1_700_000_000.6) == {'sent': 1000.0}
+    assert tracker.resets == 0
+
+
+def test_no_rate_without_elapsed_time():
+    tracker, clock = make_tracker()
+    tracker.update({'sent': 1000})
+    assert tracker.update({'sent': 2000}) == {}
+    clock.now -= 1
+    assert tracker.update({'sent': 3000}) == {}
+    # Прошлое значение обновляется, следующий замер считается от него
+    clock.now += 2
+    assert tracker.update({'sent': 3500}) == {'sent': 250.0}
+
+
+def test_missing_counter_is_skipped():
+    tracker, clock = make_tracker()
+    tracker.update({'sent': 1000, 'recv': None})
+    clock.now += 1
+    assert tracker.update({'sent': 1500, 'recv': 700}) == {'sent': 500.0}